@@ -1,19 +1,37 @@
-from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, UploadFile, File, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Date, text
-from sqlalchemy.orm import DeclarativeBase, sessionmaker, Session, relationship
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Date, text, Index, UniqueConstraint, and_, or_, case, func, insert, select, union_all
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import DeclarativeBase, sessionmaker, Session, relationship, aliased
 from datetime import datetime, timedelta, date
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Generic, TypeVar
 from pydantic import BaseModel, EmailStr
 import os
 from dotenv import load_dotenv
 import json
 import asyncio
+import anyio
+import uuid
+import random
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
+from utils.queries import with_related, author_summary, upsert, insert_ignore
+from utils.cache import TTLCache, build_shared_cache
+from utils.backplane import Backplane, build_backplane
+from utils.connections import QueuedConnection
+from utils.uploads import stream_to_disk
+from utils.media_files import MediaFiles
+from utils.friend_graph import Adjacency, FriendGraph, count_common, rank_friends_of_friends
+from utils.search import fold, index_terms, query_terms, tokenize
+from utils.availability import AvailabilityFilter
+from utils.scheduler import DeadlineHeap
+from utils.write_buffer import CoalescingBuffer, WriteBehindQueue
+from utils.images import render_variants, variant_path, variant_url, variants_available, forget_variant_url, remove_variants
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -32,6 +50,72 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Timeline (fan-out on write)
+TIMELINE_MAX_ENTRIES = 800  # Máximo de posts guardados por timeline
+TIMELINE_BACKFILL_LIMIT = 50  # Posts recentes copiados ao criar um novo vínculo
+
+# Cache de autenticação (usuário resolvido a partir do token)
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+SHARED_USER_CACHE_TTL_SECONDS = int(os.getenv("SHARED_USER_CACHE_TTL_SECONDS", "300"))
+
+# Grafo de amizades: listas de adjacência por usuário
+FRIEND_GRAPH_TTL_SECONDS = int(os.getenv("FRIEND_GRAPH_TTL_SECONDS", "30"))
+SHARED_FRIEND_GRAPH_TTL_SECONDS = int(os.getenv("SHARED_FRIEND_GRAPH_TTL_SECONDS", "600"))
+FRIEND_SUGGESTIONS_TTL_SECONDS = int(os.getenv("FRIEND_SUGGESTIONS_TTL_SECONDS", "600"))
+FRIEND_SUGGESTIONS_LIMIT = 50  # Candidatos guardados por usuário
+FRIEND_GRAPH_BATCH_SIZE = 500  # IDs por consulta ao carregar listas de adjacência em lote
+
+# Busca de usuários (índice de prefixos)
+USER_SEARCH_LIMIT = 20
+USER_SEARCH_CANDIDATES = 200  # Candidatos lidos do índice antes de ordenar por proximidade
+
+# Disponibilidade de username/email (filtro em memória por processo)
+AVAILABILITY_REFRESH_SECONDS = int(os.getenv("AVAILABILITY_REFRESH_SECONDS", "30"))  # Traz nomes gravados por outros workers
+USERNAME_MIN_LENGTH = 3
+USERNAME_MAX_LENGTH = 30
+
+# Bandeja de stories: caches por processo (stories por autor, stories vistos por leitor)
+STORY_TRAY_CACHE_TTL_SECONDS = int(os.getenv("STORY_TRAY_CACHE_TTL_SECONDS", "30"))
+
+# Expiração de stories: arquivamento em lotes por um agendador em background
+STORY_SWEEP_BATCH_SIZE = 500
+STORY_SWEEP_HORIZON_MINUTES = 30  # Expirações carregadas do banco para o heap a cada ciclo
+STORY_SWEEP_MAX_SLEEP_SECONDS = 60
+
+# Visualizações de stories: agrupadas em memória e gravadas em lote
+STORY_VIEW_FLUSH_MS = int(os.getenv("STORY_VIEW_FLUSH_MS", "250"))
+STORY_VIEW_FLUSH_ROWS = int(os.getenv("STORY_VIEW_FLUSH_ROWS", "500"))
+
+# Notificações: fila em memória gravada em lote por um flusher em background (write-behind)
+NOTIFICATION_FLUSH_MS = int(os.getenv("NOTIFICATION_FLUSH_MS", "200"))
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_MAX_BACKLOG = int(os.getenv("NOTIFICATION_MAX_BACKLOG", "10000"))  # Cheia, a ação grava a própria notificação
+NOTIFICATION_GROUP_WINDOW_MINUTES = int(os.getenv("NOTIFICATION_GROUP_WINDOW_MINUTES", "60"))  # Agrupa na mesma linha não lida
+NOTIFICATION_GROUP_ACTORS = 5  # IDs dos últimos atores guardados na notificação agrupada
+
+# Comentários em árvore (caminho materializado)
+COMMENT_REPLIES_PREVIEW = 3  # Respostas de cada thread que vêm junto com a página
+COMMENT_MAX_DEPTH = 8        # Respostas mais fundas são penduradas no nível anterior
+
+# WebSocket: fila de saída por conexão
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "close")  # close ou drop
+
+# Uploads (limite verificado nos bytes recebidos, não no tamanho declarado)
+MAX_AVATAR_SIZE_MB = 5
+MAX_COVER_SIZE_MB = 10
+MAX_MEDIA_SIZE_MB = 100
+MEDIA_VARIANT_WORKERS = int(os.getenv("MEDIA_VARIANT_WORKERS", "2"))  # Processos para redimensionar imagens
+MEDIA_GC_GRACE_SECONDS = int(os.getenv("MEDIA_GC_GRACE_SECONDS", "3600"))  # Blob sem referências é removido após esse tempo
+
+# Pool do banco e threadpool: as rotas são síncronas e rodam no threadpool do
+# AnyIO. Sessões por requisição são limitadas ao que o pool pode entregar, e o
+# threadpool tem uma folga acima disso para tarefas em background e rotas sem banco
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW + 10)))
+
 # Database Configuration
 def get_database_url():
     """Create database URL from environment variables"""
@@ -61,8 +145,8 @@ engine = create_engine(
     echo=False,  # Set to True for SQL debugging
     pool_pre_ping=True,  # Verify connections before use
     pool_recycle=300,  # Recycle connections every 5 minutes
-    pool_size=10,  # Connection pool size
-    max_overflow=20,  # Maximum overflow connections
+    pool_size=DB_POOL_SIZE,  # Connection pool size
+    max_overflow=DB_MAX_OVERFLOW,  # Maximum overflow connections
     connect_args={
         "charset": "utf8mb4",
         "use_unicode": True,
@@ -82,6 +166,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 # Models
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("idx_users_updated_at", "updated_at"),  # Atualização incremental do filtro de disponibilidade
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     display_id = Column(String(20), unique=True, index=True)  # Random ID for URLs
@@ -132,8 +219,43 @@ class User(Base):
     last_seen = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+class UserSnapshot:
+    """Cópia somente-leitura de um User, desanexada da sessão, guardada no cache de autenticação"""
+    __slots__ = tuple(column.key for column in User.__table__.columns)
+    _DATETIME_FIELDS = frozenset(column.key for column in User.__table__.columns if isinstance(column.type, DateTime))
+    _DATE_FIELDS = frozenset(column.key for column in User.__table__.columns if isinstance(column.type, Date))
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(**{field: getattr(user, field) for field in cls.__slots__})
+
+    def to_json(self) -> str:
+        values = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            values[field] = value.isoformat() if isinstance(value, (datetime, date)) else value
+        return json.dumps(values)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "UserSnapshot":
+        values = json.loads(raw)
+        for field in cls._DATETIME_FIELDS:
+            if values.get(field):
+                values[field] = datetime.fromisoformat(values[field])
+        for field in cls._DATE_FIELDS:
+            if values.get(field):
+                values[field] = date.fromisoformat(values[field])
+        return cls(**values)
+
 class Post(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        Index("idx_posts_author_type_created", "author_id", "post_type", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -154,6 +276,10 @@ class Post(Base):
 
 class Story(Base):
     __tablename__ = "stories"
+    __table_args__ = (
+        Index("idx_stories_author_expires", "author_id", "expires_at"),
+        Index("idx_stories_archived_expires", "archived", "expires_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -173,6 +299,10 @@ class Story(Base):
 
 class StoryView(Base):
     __tablename__ = "story_views"
+    __table_args__ = (
+        UniqueConstraint("story_id", "viewer_id", name="uq_story_views_story_viewer"),
+        Index("idx_story_views_viewer_story", "viewer_id", "story_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
@@ -184,6 +314,10 @@ class StoryView(Base):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("idx_notifications_recipient_created", "recipient_id", "created_at", "id"),
+        Index("idx_notifications_recipient_group", "recipient_id", "group_key", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -193,13 +327,21 @@ class Notification(Base):
     message = Column(Text, nullable=False)
     data = Column(Text)  # JSON data
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)  # Última atividade, nas agrupadas
+    group_key = Column(String(100), nullable=True)  # Ex.: "reaction:post:42"; mesmo alvo e tipo viram uma linha
+    actor_count = Column(Integer, nullable=False, default=1)
+    actor_ids = Column(Text, nullable=True)  # JSON com os últimos atores, o mais recente primeiro
     
     recipient = relationship("User", foreign_keys=[recipient_id], backref="received_notifications")
     sender = relationship("User", foreign_keys=[sender_id], backref="sent_notifications")
 
 class Friendship(Base):
     __tablename__ = "friendships"
+    __table_args__ = (
+        # Uma busca indexada por lado da aresta (a amizade é guardada num sentido só)
+        Index("idx_friendships_requester_status", "requester_id", "status", "addressee_id"),
+        Index("idx_friendships_addressee_status", "addressee_id", "status", "requester_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     requester_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -213,6 +355,10 @@ class Friendship(Base):
 
 class Reaction(Base):
     __tablename__ = "reactions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "post_id", name="uq_reactions_user_post"),
+        Index("idx_reactions_post_type_created", "post_id", "reaction_type", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -224,14 +370,31 @@ class Reaction(Base):
     user = relationship("User", backref="reactions")
     post = relationship("Post", backref="reactions")
 
+class PostReactionCount(Base):
+    """Reações de um post por tipo, mantidas na mesma transação de cada reação"""
+    __tablename__ = "post_reaction_counts"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    reaction_type = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        Index("idx_comments_post_created", "post_id", "created_at", "id"),
+        Index("idx_comments_post_parent_created", "post_id", "parent_id", "created_at", "id"),
+        Index("idx_comments_root_path", "root_id", "path"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
+    root_id = Column(Integer, nullable=True)  # Comentário de primeiro nível da thread (o próprio, se for um)
+    path = Column(String(255), nullable=True)  # IDs dos ancestrais com 10 dígitos: "0000000012/0000000034"
+    depth = Column(Integer, nullable=False, default=0)
+    replies_count = Column(Integer, nullable=False, default=0)  # Respostas diretas
     created_at = Column(DateTime, default=datetime.utcnow)
     
     author = relationship("User", backref="comments")
@@ -240,6 +403,9 @@ class Comment(Base):
 
 class Share(Base):
     __tablename__ = "shares"
+    __table_args__ = (
+        Index("idx_shares_user_post", "user_id", "post_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -250,6 +416,9 @@ class Share(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("idx_messages_pair_created", "sender_id", "recipient_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -265,6 +434,58 @@ class Message(Base):
     sender = relationship("User", foreign_keys=[sender_id], backref="sent_messages")
     recipient = relationship("User", foreign_keys=[recipient_id], backref="received_messages")
 
+class MediaBlob(Base):
+    """Conteúdo de upload armazenado uma única vez, endereçado pelo SHA-256"""
+    __tablename__ = "media_blobs"
+    __table_args__ = (
+        Index("idx_media_blobs_unreferenced", "ref_count", "released_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    file_path = Column(String(500), nullable=False)
+    file_size = Column(Integer)
+    ref_count = Column(Integer, default=0, nullable=False)  # Linhas de media_files apontando para este blob
+    created_at = Column(DateTime, default=datetime.utcnow)
+    released_at = Column(DateTime)  # Última vez que uma referência foi liberada
+
+class MediaQualitySetting(Base):
+    """Tamanho/qualidade de cada variante por contexto (populado por setup_media_quality.py)"""
+    __tablename__ = "media_quality_settings"
+    __table_args__ = (
+        UniqueConstraint("media_type", "variant_type", name="unique_quality_setting"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    media_type = Column(String(20), nullable=False)  # profile_avatar, cover_photo, post_image, story_image, comment_image, chat_image
+    variant_type = Column(String(20), nullable=False)  # thumbnail, small, medium, large, original
+    max_width = Column(Integer, nullable=False)
+    max_height = Column(Integer, nullable=False)
+    quality_percentage = Column(Integer, default=85)
+    format = Column(String(10), default="jpeg")  # jpeg, webp, png
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class MediaVariant(Base):
+    """Versão redimensionada de um MediaFile de imagem"""
+    __tablename__ = "media_variants"
+    __table_args__ = (
+        UniqueConstraint("original_media_id", "variant_type", name="unique_variant"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    original_media_id = Column(Integer, ForeignKey("media_files.id", ondelete="CASCADE"), nullable=False)
+    variant_type = Column(String(20), nullable=False)
+    file_name = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)
+    file_url = Column(String(500), nullable=False)
+    width = Column(Integer)
+    height = Column(Integer)
+    file_size = Column(Integer)
+    quality_percentage = Column(Integer, default=100)
+    is_processed = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class MediaFile(Base):
     __tablename__ = "media_files"
 
@@ -277,8 +498,10 @@ class MediaFile(Base):
     file_type = Column(String(20))  # image, video, audio, document
     uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
+    blob_id = Column(Integer, ForeignKey("media_blobs.id"))  # NULL para uploads anteriores ao armazenamento por conteúdo
 
     uploader = relationship("User", backref="uploaded_files")
+    blob = relationship("MediaBlob")
 
 class Block(Base):
     __tablename__ = "blocks"
@@ -333,7 +556,64 @@ class StoryOverlay(Base):
 
     story = relationship("Story", backref="overlays")
 
+class TimelineEntry(Base):
+    """Post entregue na timeline (feed inicial) de um usuário"""
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        UniqueConstraint("user_id", "post_id", name="uq_timeline_user_post"),
+        Index("idx_timeline_user_created", "user_id", "created_at", "post_id"),
+        Index("idx_timeline_post", "post_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Dono da timeline
+    post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, nullable=False)  # Cópia de posts.created_at para ordenação
+
+class TimelineState(Base):
+    """Marca de timeline já montada: uma timeline vazia não dispara nova reconstrução"""
+    __tablename__ = "timeline_states"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    built_at = Column(DateTime, nullable=False)
+
+class Conversation(Base):
+    """Resumo de uma conversa do ponto de vista de um participante (uma linha por lado)"""
+    __tablename__ = "conversations"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "partner_id", name="uq_conversations_owner_partner"),
+        Index("idx_conversations_owner_activity", "owner_id", "last_activity", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Dono da caixa de entrada
+    partner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    last_message_id = Column(Integer, ForeignKey("messages.id"))
+    last_activity = Column(DateTime, nullable=False)  # Cópia de messages.created_at para ordenação
+    unread_count = Column(Integer, default=0, nullable=False)  # Mensagens do parceiro ainda não lidas pelo dono
+
+    partner = relationship("User", foreign_keys=[partner_id])
+    last_message = relationship("Message", foreign_keys=[last_message_id])
+
+class UserSearchTerm(Base):
+    """Índice de busca: um prefixo (sem acentos) de um token do nome/username por linha"""
+    __tablename__ = "user_search_terms"
+    __table_args__ = (
+        Index("idx_user_search_terms_user", "user_id"),
+    )
+
+    term = Column(String(20), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
 # Pydantic models
+T = TypeVar("T")
+
+class Page(BaseModel, Generic[T]):
+    """Envelope das listas paginadas por cursor"""
+    items: List[T]
+    next_cursor: Optional[str] = None
+
 class UserBase(BaseModel):
     first_name: str
     last_name: str
@@ -395,11 +675,18 @@ class CommentResponse(BaseModel):
     author: Dict[str, Any]
     created_at: datetime
     reactions_count: int = 0
+    parent_id: Optional[int] = None
+    replies_count: int = 0
     replies: List['CommentResponse'] = []
     
     class Config:
         from_attributes = True
 
+class ReactorResponse(BaseModel):
+    user: Dict[str, Any]
+    reaction_type: str
+    created_at: datetime
+
 class ShareCreate(BaseModel):
     post_id: int
 
@@ -424,6 +711,17 @@ class PostCreate(BaseModel):
     is_profile_update: Optional[bool] = False
     is_cover_update: Optional[bool] = False
 
+class PostViewerState(BaseModel):
+    """O que o leitor precisa para desenhar os botões de um post sem chamadas extras"""
+    post_id: int
+    user_reaction: Optional[str] = None
+    shared: bool = False
+    comments_count: int = 0
+    reactions: Dict[str, int] = {}
+
+class PostViewerStateRequest(BaseModel):
+    post_ids: List[int]
+
 class PostResponse(BaseModel):
     id: int
     author: Dict[str, Any]
@@ -431,16 +729,19 @@ class PostResponse(BaseModel):
     post_type: str
     media_type: Optional[str] = None
     media_url: Optional[str] = None
+    media_preview_url: Optional[str] = None  # Variante redimensionada para o feed, ou o original
     created_at: datetime
     reactions_count: int
     comments_count: int
     shares_count: int
     is_profile_update: Optional[bool] = False
     is_cover_update: Optional[bool] = False
+    viewer: Optional[PostViewerState] = None
     
     class Config:
         from_attributes = True
 
+
 class StoryCreate(BaseModel):
     content: Optional[str] = None
     media_type: Optional[str] = None
@@ -464,6 +765,16 @@ class StoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class StoryTrayItem(StoryResponse):
+    seen: bool = False
+
+class StoryTrayEntry(BaseModel):
+    """Stories ativos de um autor, na ordem em que são exibidos"""
+    author: Dict[str, Any]
+    stories: List[StoryTrayItem]
+    all_seen: bool
+    latest_at: datetime
+
 class NotificationResponse(BaseModel):
     id: int
     notification_type: str
@@ -473,6 +784,8 @@ class NotificationResponse(BaseModel):
     is_read: bool
     created_at: datetime
     sender: Optional[Dict[str, Any]] = None
+    actor_count: int = 1
+    actor_ids: List[int] = []
     
     class Config:
         from_attributes = True
@@ -552,10 +865,16 @@ class MediaUploadResponse(BaseModel):
     file_size: int
     mime_type: str
     upload_date: datetime
+    sha256: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class MediaHashUpload(BaseModel):
+    sha256: str
+    filename: Optional[str] = None
+    mime_type: str
+
 class StoryTagCreate(BaseModel):
     story_id: int
     tagged_user_id: int
@@ -603,15 +922,52 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 # Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+db_slots = asyncio.Semaphore(DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+async def get_db():
+    """Sessão por requisição; requisições além do pool esperam no event loop, não numa thread"""
+    async with db_slots:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+# User identity cache: L1 por processo, L2 compartilhado (Redis) opcional
+user_cache = TTLCache(ttl_seconds=USER_CACHE_TTL_SECONDS)
+shared_user_cache = build_shared_cache("auth_user", SHARED_USER_CACHE_TTL_SECONDS)
+
+def load_user_snapshot(db: Session, email: str) -> Optional[UserSnapshot]:
+    """Resolver o usuário do token, consultando o MySQL só em cache miss"""
+    snapshot = user_cache.get(email)
+    if snapshot is not None:
+        return snapshot
+
+    if shared_user_cache is not None:
+        raw = shared_user_cache.get(email)
+        if raw:
+            snapshot = UserSnapshot.from_json(raw)
+            user_cache.set(email, snapshot)
+            return snapshot
+
+    user = db.query(User).filter(User.email == email).first()
+    if user is None:
+        return None
+    snapshot = UserSnapshot.from_user(user)
+    user_cache.set(email, snapshot)
+    if shared_user_cache is not None:
+        shared_user_cache.set(email, snapshot.to_json())
+    return snapshot
+
+def invalidate_user_cache(*emails: str):
+    """Descartar o usuário em cache após alterar seus dados"""
+    for email in emails:
+        user_cache.delete(email)
+        if shared_user_cache is not None:
+            shared_user_cache.delete(email)
 
 # Get current user
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -625,36 +981,59 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
+    user = load_user_snapshot(db, email)
     if user is None:
         raise credentials_exception
     return user
 
+def get_current_user_for_update(current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Usuário atual anexado à sessão, para rotas que alteram os dados do próprio usuário"""
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    return user
+
 # WebSocket Manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    """Sockets deste worker; a entrega entre workers passa pelo backplane"""
+    def __init__(self, backplane: Backplane):
+        self.active_connections: Dict[int, List[QueuedConnection]] = {}
+        self.backplane = backplane
+        self.backplane.bind(self.deliver_local)
 
-    async def connect(self, websocket: WebSocket, user_id: int):
+    async def connect(self, websocket: WebSocket, user_id: int) -> QueuedConnection:
         await websocket.accept()
+        connection = QueuedConnection(
+            websocket,
+            max_queue=WS_SEND_QUEUE_SIZE,
+            send_timeout=WS_SEND_TIMEOUT_SECONDS,
+            overflow=WS_SLOW_CONSUMER_POLICY,
+            on_close=lambda closed: self.disconnect(closed, user_id)
+        )
+        connection.start()
         if user_id not in self.active_connections:
             self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+            await self.backplane.subscribe(user_id)
+        self.active_connections[user_id].append(connection)
+        return connection
 
-    def disconnect(self, websocket: WebSocket, user_id: int):
+    async def disconnect(self, connection: QueuedConnection, user_id: int):
+        connection.stop()
         if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
+            if connection in self.active_connections[user_id]:
+                self.active_connections[user_id].remove(connection)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
+                await self.backplane.unsubscribe(user_id)
 
     async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    self.active_connections[user_id].remove(connection)
+        """Publicar para o usuário, esteja ele conectado a este worker ou a outro"""
+        await self.backplane.publish(user_id, message)
+
+    async def deliver_local(self, user_id: int, message: str):
+        """Só enfileira: cada conexão tem sua própria tarefa de escrita"""
+        for connection in list(self.active_connections.get(user_id, ())):
+            connection.send(message)
 
     async def send_notification(self, user_id: int, notification: dict):
         message = json.dumps({
@@ -687,7 +1066,7 @@ class ConnectionManager:
         })
         await self.send_personal_message(message, user_id)
 
-manager = ConnectionManager()
+manager = ConnectionManager(build_backplane())
 
 def verify_websocket_token(token: str):
     try:
@@ -698,8 +1077,7 @@ def verify_websocket_token(token: str):
         
         db = SessionLocal()
         try:
-            user = db.query(User).filter(User.email == email).first()
-            return user
+            return load_user_snapshot(db, email)
         finally:
             db.close()
     except JWTError:
@@ -708,6 +1086,48 @@ def verify_websocket_token(token: str):
 # FastAPI app
 app = FastAPI(title="Backend API", version="1.0.0")
 
+@app.on_event("startup")
+async def limit_threadpool():
+    """Rotas com banco rodam no threadpool; mais threads que conexões só gera espera no pool"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADPOOL_SIZE
+
+@app.on_event("startup")
+async def start_availability_refresher():
+    global availability_task
+    availability_task = asyncio.create_task(refresh_availability_periodically())
+
+@app.on_event("startup")
+async def start_story_sweeper():
+    global story_sweeper_task
+    story_sweeper_task = asyncio.create_task(sweep_expired_stories_periodically())
+
+@app.on_event("startup")
+async def start_notification_flusher():
+    global notification_task
+    notification_task = asyncio.create_task(flush_notifications_periodically())
+
+@app.on_event("startup")
+async def start_story_view_flusher():
+    global story_view_task
+    story_view_task = asyncio.create_task(flush_story_views_periodically())
+
+@app.on_event("shutdown")
+async def close_backplane():
+    # Notificações pendentes são gravadas e enviadas antes de fechar o backplane
+    if notification_task is not None:
+        notification_task.cancel()
+    await flush_notifications()
+    await manager.backplane.close()
+    if availability_task is not None:
+        availability_task.cancel()
+    if story_sweeper_task is not None:
+        story_sweeper_task.cancel()
+    if story_view_task is not None:
+        story_view_task.cancel()
+    await run_in_threadpool(flush_story_views)
+    if media_process_pool is not None:
+        media_process_pool.shutdown(wait=False, cancel_futures=True)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -717,14 +1137,1401 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create uploads directories if they don't exist
-os.makedirs("uploads/stories", exist_ok=True)
-os.makedirs("uploads/posts", exist_ok=True)
-os.makedirs("uploads/profiles", exist_ok=True)
-os.makedirs("uploads/image", exist_ok=True)
+# Create uploads directories if they don't exist
+os.makedirs("uploads/stories", exist_ok=True)
+os.makedirs("uploads/posts", exist_ok=True)
+os.makedirs("uploads/profiles", exist_ok=True)
+os.makedirs("uploads/image", exist_ok=True)
+
+# Serve static files for uploads (ETag/304, Range e cache imutável para nomes por conteúdo)
+app.mount("/uploads", MediaFiles(directory="uploads"), name="uploads")
+
+# Contadores denormalizados
+def bump_counter(db: Session, model, row_id: int, column, delta: int = 1):
+    """UPDATE atômico (col = col + delta) na mesma transação da escrita que o originou"""
+    query = db.query(model).filter(model.id == row_id)
+    if delta < 0:
+        query = query.filter(column >= -delta)
+    query.update({column: func.coalesce(column, 0) + delta}, synchronize_session=False)
+
+CommentReply = aliased(Comment)
+
+COUNTER_SOURCES = [
+    (Post, Post.reactions_count, Reaction, Reaction.post_id, None),
+    (Post, Post.comments_count, Comment, Comment.post_id, None),
+    (Post, Post.shares_count, Share, Share.post_id, None),
+    (Comment, Comment.replies_count, CommentReply, CommentReply.parent_id, None),
+    # Stories expirados têm as visualizações compactadas em views_count (não há mais linhas para contar)
+    (Story, Story.views_count, StoryView, StoryView.story_id, lambda: Story.expires_at > datetime.utcnow()),
+]
+
+def reconcile_counters(db: Session, batch_size: int = 5000) -> int:
+    """Recalcular os contadores a partir das tabelas de origem, em lotes de IDs"""
+    fixed = 0
+    for model, column, source, source_fk, scope in COUNTER_SOURCES:
+        max_id = db.query(func.max(model.id)).scalar() or 0
+        for start in range(0, max_id, batch_size):
+            actual = select(func.count(source.id)).where(source_fk == model.id).scalar_subquery()
+            query = db.query(model).filter(
+                model.id > start,
+                model.id <= start + batch_size,
+                func.coalesce(column, -1) != actual
+            )
+            if scope is not None:
+                query = query.filter(scope())
+            fixed += query.update({column: actual}, synchronize_session=False)
+            db.commit()
+    return fixed + reconcile_reaction_counts(db, batch_size)
+
+# Reações por tipo
+REACTION_TYPES = ["like", "love", "haha", "wow", "sad", "angry", "care", "pride", "grateful", "celebrating"]
+REACTION_PREVIEW_USERS = 5  # Nomes exibidos por tipo no resumo detalhado
+
+def adjust_reaction_count(db: Session, post_id: int, reaction_type: str, delta: int):
+    if delta > 0:
+        upsert(
+            db, PostReactionCount,
+            {"post_id": post_id, "reaction_type": reaction_type, "count": delta},
+            ["post_id", "reaction_type"],
+            lambda row: {"count": PostReactionCount.count + delta}
+        )
+    else:
+        db.query(PostReactionCount).filter(
+            PostReactionCount.post_id == post_id,
+            PostReactionCount.reaction_type == reaction_type,
+            PostReactionCount.count >= -delta
+        ).update({PostReactionCount.count: PostReactionCount.count + delta}, synchronize_session=False)
+
+def record_reaction_change(db: Session, post_id: int, old_type: Optional[str], new_type: Optional[str]):
+    """Atualizar posts.reactions_count e post_reaction_counts (None = sem reação antes/depois)"""
+    if old_type == new_type:
+        return
+    if old_type is not None:
+        adjust_reaction_count(db, post_id, old_type, -1)
+    if new_type is not None:
+        adjust_reaction_count(db, post_id, new_type, 1)
+    if old_type is None:
+        bump_counter(db, Post, post_id, Post.reactions_count)
+    elif new_type is None:
+        bump_counter(db, Post, post_id, Post.reactions_count, -1)
+
+REACTION_WRITE_ATTEMPTS = 3
+
+def write_reaction(db: Session, post_id: int, user_id: int, reaction_type: Optional[str], toggle: bool = False):
+    """Gravar a reação do usuário e ajustar os contadores numa transação só
+
+    A linha existente é lida com SELECT ... FOR UPDATE, então o tipo antigo que vai para
+    record_reaction_change é o que está travado. Duas primeiras reações simultâneas batem
+    na uq_reactions_user_post (ou num deadlock do gap lock): desfaz e tenta de novo.
+    reaction_type=None remove; toggle=True remove quando o tipo é o mesmo.
+    Retorna (tipo antigo, tipo novo).
+    """
+    for attempt in range(REACTION_WRITE_ATTEMPTS):
+        existing = db.query(Reaction).filter(
+            Reaction.post_id == post_id,
+            Reaction.user_id == user_id
+        ).with_for_update().first()
+        old_type = existing.reaction_type if existing else None
+        new_type = None if toggle and old_type == reaction_type else reaction_type
+
+        if existing and new_type is None:
+            db.delete(existing)
+        elif existing:
+            existing.reaction_type = new_type
+        elif new_type is not None:
+            db.add(Reaction(post_id=post_id, user_id=user_id, reaction_type=new_type))
+        record_reaction_change(db, post_id, old_type, new_type)
+        try:
+            db.commit()
+            return old_type, new_type
+        except (IntegrityError, OperationalError):
+            db.rollback()
+            if attempt == REACTION_WRITE_ATTEMPTS - 1:
+                raise HTTPException(status_code=409, detail="Reaction changed concurrently, try again")
+
+def post_reaction_counts(db: Session, post_id: int) -> Dict[str, int]:
+    return {
+        reaction_type: count
+        for reaction_type, count in db.query(PostReactionCount.reaction_type, PostReactionCount.count).filter(
+            PostReactionCount.post_id == post_id,
+            PostReactionCount.count > 0
+        )
+    }
+
+def post_viewer_states(db: Session, viewer_id: int, posts) -> Dict[int, PostViewerState]:
+    """Estado do leitor para uma página de posts, com um número fixo de consultas IN (...)
+
+    `posts` são objetos com id e comments_count (Post ou linhas de uma consulta).
+    """
+    states = {
+        post.id: PostViewerState(post_id=post.id, comments_count=post.comments_count or 0)
+        for post in posts
+    }
+    if not states:
+        return states
+    post_ids = list(states)
+
+    for post_id, reaction_type in db.query(Reaction.post_id, Reaction.reaction_type).filter(
+        Reaction.user_id == viewer_id,
+        Reaction.post_id.in_(post_ids)
+    ):
+        states[post_id].user_reaction = reaction_type
+    for (post_id,) in db.query(Share.post_id).filter(
+        Share.user_id == viewer_id,
+        Share.post_id.in_(post_ids)
+    ).distinct():
+        states[post_id].shared = True
+    for post_id, reaction_type, count in db.query(
+        PostReactionCount.post_id, PostReactionCount.reaction_type, PostReactionCount.count
+    ).filter(PostReactionCount.post_id.in_(post_ids), PostReactionCount.count > 0):
+        states[post_id].reactions[reaction_type] = count
+    return states
+
+def viewer_reaction(db: Session, post_id: int, user_id: int) -> Optional[str]:
+    """Reação do usuário no post, pela chave única (user_id, post_id)"""
+    return db.query(Reaction.reaction_type).filter(
+        Reaction.user_id == user_id,
+        Reaction.post_id == post_id
+    ).scalar()
+
+def recent_reactors(db: Session, post_id: int, limit: int) -> Dict[str, list]:
+    """Os `limit` usuários mais recentes de cada tipo, numa consulta só"""
+    ranked = select(
+        Reaction.id,
+        func.row_number().over(
+            partition_by=Reaction.reaction_type,
+            order_by=(Reaction.created_at.desc(), Reaction.id.desc())
+        ).label("position")
+    ).where(Reaction.post_id == post_id).subquery()
+
+    reactions = with_related(db.query(Reaction), Reaction.user).join(ranked, ranked.c.id == Reaction.id).filter(
+        ranked.c.position <= limit
+    ).order_by(Reaction.reaction_type, ranked.c.position).all()
+
+    reactors: Dict[str, list] = {}
+    for reaction in reactions:
+        reactors.setdefault(reaction.reaction_type, []).append(reaction)
+    return reactors
+
+def reconcile_reaction_counts(db: Session, batch_size: int = 5000) -> int:
+    """Recalcular post_reaction_counts a partir de reactions, em lotes de posts"""
+    fixed = 0
+    max_id = db.query(func.max(Post.id)).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        actual = {
+            (post_id, reaction_type): count
+            for post_id, reaction_type, count in db.query(Reaction.post_id, Reaction.reaction_type, func.count(Reaction.id)).filter(
+                Reaction.post_id > start,
+                Reaction.post_id <= start + batch_size
+            ).group_by(Reaction.post_id, Reaction.reaction_type)
+        }
+        stored = {
+            (post_id, reaction_type): count
+            for post_id, reaction_type, count in db.query(PostReactionCount.post_id, PostReactionCount.reaction_type, PostReactionCount.count).filter(
+                PostReactionCount.post_id > start,
+                PostReactionCount.post_id <= start + batch_size
+            )
+        }
+        for (post_id, reaction_type), count in actual.items():
+            if stored.get((post_id, reaction_type)) != count:
+                upsert(
+                    db, PostReactionCount,
+                    {"post_id": post_id, "reaction_type": reaction_type, "count": count},
+                    ["post_id", "reaction_type"],
+                    lambda row: {"count": row.count}
+                )
+                fixed += 1
+        for post_id, reaction_type in stored.keys() - actual.keys():
+            db.query(PostReactionCount).filter(
+                PostReactionCount.post_id == post_id,
+                PostReactionCount.reaction_type == reaction_type
+            ).delete(synchronize_session=False)
+            fixed += 1
+        db.commit()
+    return fixed
+
+# Comentários em árvore
+def attach_comment(db: Session, comment: Comment):
+    """Preencher root_id/path/depth de um comentário novo e contar a resposta no pai
+
+    Chamado depois do db.add, na mesma transação; o flush gera o ID usado no caminho.
+    """
+    parent = None
+    if comment.parent_id is not None:
+        parent = db.query(Comment).filter(
+            Comment.id == comment.parent_id,
+            Comment.post_id == comment.post_id
+        ).first()
+        if not parent:
+            raise HTTPException(status_code=404, detail="Parent comment not found")
+        if parent.depth >= COMMENT_MAX_DEPTH:
+            parent = db.get(Comment, parent.parent_id)
+            comment.parent_id = parent.id
+
+    db.flush()
+    segment = f"{comment.id:010d}"
+    if parent is None:
+        comment.root_id, comment.path, comment.depth = comment.id, segment, 0
+    else:
+        comment.root_id = parent.root_id or parent.id
+        comment.path = f"{parent.path or f'{parent.id:010d}'}/{segment}"
+        comment.depth = parent.depth + 1
+        bump_counter(db, Comment, parent.id, Comment.replies_count)
+
+def comment_response(comment: Comment) -> CommentResponse:
+    return CommentResponse(
+        id=comment.id,
+        content=comment.content,
+        author=author_summary(comment.author),
+        created_at=comment.created_at,
+        reactions_count=0,  # TODO: Add comment reactions
+        parent_id=comment.parent_id,
+        replies_count=comment.replies_count or 0,
+        replies=[]
+    )
+
+def comment_threads(db: Session, roots: List[Comment], replies_per_thread: int) -> List[CommentResponse]:
+    """Comentários de primeiro nível com as primeiras respostas de cada thread, já aninhadas
+
+    Uma consulta traz as `replies_per_thread` primeiras respostas (em qualquer nível)
+    de cada thread pela ordem do caminho, que é a ordem de leitura da árvore: todo
+    ancestral vem antes dos descendentes, então a árvore se monta numa passada só.
+    """
+    nodes = {root.id: comment_response(root) for root in roots}
+    if roots and replies_per_thread > 0:
+        ranked = select(
+            Comment.id,
+            func.row_number().over(partition_by=Comment.root_id, order_by=Comment.path).label("position")
+        ).where(
+            Comment.root_id.in_(list(nodes)),
+            Comment.parent_id.isnot(None)
+        ).subquery()
+
+        replies = with_related(db.query(Comment), Comment.author).join(ranked, ranked.c.id == Comment.id).filter(
+            ranked.c.position <= replies_per_thread
+        ).order_by(Comment.path).all()
+
+        for reply in replies:
+            node = comment_response(reply)
+            nodes[reply.id] = node
+            parent = nodes.get(reply.parent_id)
+            if parent is not None:
+                parent.replies.append(node)
+    return [nodes[root.id] for root in roots]
+
+# Conversas (índice da caixa de entrada)
+def record_conversation_message(db: Session, message: Message):
+    """Atualizar as linhas dos dois participantes na mesma transação do envio"""
+    sides = [(message.sender_id, message.recipient_id, 0)]
+    if message.recipient_id != message.sender_id:
+        sides.append((message.recipient_id, message.sender_id, 1))
+
+    for owner_id, partner_id, unread in sides:
+        upsert(
+            db, Conversation,
+            {
+                "owner_id": owner_id,
+                "partner_id": partner_id,
+                "last_message_id": message.id,
+                "last_activity": message.created_at,
+                "unread_count": unread
+            },
+            ["owner_id", "partner_id"],
+            lambda row: {
+                "last_message_id": row.last_message_id,
+                "last_activity": row.last_activity,
+                "unread_count": Conversation.unread_count + unread
+            }
+        )
+
+def mark_conversation_read(db: Session, owner_id: int, partner_id: int, count: int = 1):
+    """Descontar mensagens lidas do contador de não lidas (sem ficar negativo)"""
+    db.query(Conversation).filter(
+        Conversation.owner_id == owner_id,
+        Conversation.partner_id == partner_id
+    ).update({
+        Conversation.unread_count: case(
+            (Conversation.unread_count > count, Conversation.unread_count - count),
+            else_=0
+        )
+    }, synchronize_session=False)
+
+def rebuild_conversations(db: Session, batch_size: int = 1000) -> int:
+    """Recriar o índice de conversas a partir da tabela de mensagens"""
+    last_ids = {}
+    for sender_id, recipient_id, last_id in db.query(
+        Message.sender_id, Message.recipient_id, func.max(Message.id)
+    ).group_by(Message.sender_id, Message.recipient_id):
+        for pair in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            last_ids[pair] = max(last_ids.get(pair, 0), last_id)
+
+    unread = {
+        (recipient_id, sender_id): total
+        for recipient_id, sender_id, total in db.query(
+            Message.recipient_id, Message.sender_id, func.count(Message.id)
+        ).filter(Message.is_read == False).group_by(Message.recipient_id, Message.sender_id)
+    }
+
+    message_ids = list(set(last_ids.values()))
+    created = {}
+    for start in range(0, len(message_ids), batch_size):
+        created.update(db.query(Message.id, Message.created_at).filter(
+            Message.id.in_(message_ids[start:start + batch_size])
+        ).all())
+
+    rows = [
+        {
+            "owner_id": owner_id,
+            "partner_id": partner_id,
+            "last_message_id": last_id,
+            "last_activity": created.get(last_id) or datetime.utcnow(),
+            "unread_count": unread.get((owner_id, partner_id), 0)
+        }
+        for (owner_id, partner_id), last_id in last_ids.items()
+    ]
+
+    db.query(Conversation).delete(synchronize_session=False)
+    for start in range(0, len(rows), batch_size):
+        db.execute(insert(Conversation), rows[start:start + batch_size])
+    db.commit()
+    return len(rows)
+
+# Armazenamento de mídia endereçado por conteúdo
+MEDIA_TYPES = {
+    "image": ["image/jpeg", "image/png", "image/gif", "image/webp"],
+    "video": ["video/mp4", "video/webm", "video/avi", "video/mov"],
+    "audio": ["audio/mp3", "audio/wav", "audio/ogg", "audio/m4a"],
+    "document": ["application/pdf", "text/plain", "application/msword"]
+}
+
+def media_type_for(mime_type: Optional[str]) -> Optional[str]:
+    for file_type, mimes in MEDIA_TYPES.items():
+        if mime_type in mimes:
+            return file_type
+    return None
+
+def media_url(file_path: str) -> str:
+    return "/" + Path(file_path).as_posix()
+
+def store_blob(db: Session, source, file_type: str, extension: str, max_bytes: int, kind: str = "File") -> MediaBlob:
+    """Gravar o upload com nome = SHA-256 e incrementar a referência do blob (cria se for novo)"""
+    staging = Path("uploads") / file_type / f"{uuid.uuid4()}.upload"
+    stored = stream_to_disk(source, staging, max_bytes, kind)
+    try:
+        upsert(
+            db, MediaBlob,
+            {
+                "sha256": stored.sha256,
+                "file_path": str(Path("uploads") / file_type / f"{stored.sha256}{extension.lower()}"),
+                "file_size": stored.size,
+                "ref_count": 1,
+                "created_at": datetime.utcnow()
+            },
+            ["sha256"],
+            lambda row: {"ref_count": MediaBlob.ref_count + 1}
+        )
+        blob = db.query(MediaBlob).filter(MediaBlob.sha256 == stored.sha256).one()
+        # Mesmo conteúdo: substituir é seguro e garante o arquivo mesmo se uma coleta acabou de removê-lo
+        os.replace(staging, blob.file_path)
+    except BaseException:
+        staging.unlink(missing_ok=True)
+        raise
+    return blob
+
+def store_media(db: Session, file: UploadFile, file_type: str, uploader_id: int, max_bytes: int, kind: str = "File") -> MediaFile:
+    """Salvar um upload como MediaFile apontando para o blob do seu conteúdo"""
+    extension = Path(file.filename).suffix if file.filename else ""
+    blob = store_blob(db, file.file, file_type, extension, max_bytes, kind)
+    media = MediaFile(
+        filename=Path(blob.file_path).name,
+        original_filename=file.filename,
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        mime_type=file.content_type,
+        file_type=file_type,
+        uploaded_by=uploader_id,
+        blob_id=blob.id
+    )
+    db.add(media)
+    db.flush()
+    return media
+
+def reference_blob(db: Session, sha256: str) -> Optional[MediaBlob]:
+    """Nova referência a um blob existente (reenvio sem transferir os bytes)"""
+    blob = db.query(MediaBlob).filter(MediaBlob.sha256 == sha256).first()
+    if not blob or not os.path.exists(blob.file_path):
+        return None
+    referenced = db.query(MediaBlob).filter(MediaBlob.id == blob.id).update(
+        {MediaBlob.ref_count: MediaBlob.ref_count + 1}, synchronize_session=False
+    )
+    return blob if referenced else None
+
+def release_media(db: Session, media: MediaFile):
+    """Remover o MediaFile e liberar sua referência; o arquivo só sai na coleta"""
+    if media.blob_id is not None:
+        db.query(MediaBlob).filter(MediaBlob.id == media.blob_id, MediaBlob.ref_count > 0).update({
+            MediaBlob.ref_count: MediaBlob.ref_count - 1,
+            MediaBlob.released_at: datetime.utcnow()
+        }, synchronize_session=False)
+    db.query(MediaVariant).filter(MediaVariant.original_media_id == media.id).delete(synchronize_session=False)
+    db.delete(media)
+
+def collect_media_blobs(db: Session, grace_seconds: int = MEDIA_GC_GRACE_SECONDS, batch_size: int = 500) -> int:
+    """Apagar blobs sem referências há mais de `grace_seconds`
+
+    O arquivo é renomeado para uma lápide antes do DELETE: um reenvio do mesmo
+    conteúdo nesse meio tempo recria a linha e grava um arquivo novo no nome
+    original, que a coleta nunca toca. Depois do commit a lápide só é apagada
+    (com as variantes) se nenhuma linha voltou a existir para o hash.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    candidates = db.query(MediaBlob.id, MediaBlob.sha256, MediaBlob.file_path).filter(
+        MediaBlob.ref_count <= 0,
+        MediaBlob.released_at < cutoff
+    ).limit(batch_size).all()
+
+    removed = 0
+    for blob_id, sha256, file_path in candidates:
+        tombstone = f"{file_path}.gc-{uuid.uuid4().hex}"
+        try:
+            os.replace(file_path, tombstone)
+        except FileNotFoundError:
+            tombstone = None
+
+        # Condição repetida no DELETE: um reenvio concorrente pode ter voltado a referenciar o blob
+        deleted = db.query(MediaBlob).filter(
+            MediaBlob.id == blob_id,
+            MediaBlob.ref_count <= 0
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        if not deleted:
+            # Blob voltou a ser usado: devolver o arquivo (se o reenvio já não gravou outro igual)
+            if tombstone and not os.path.exists(file_path):
+                os.replace(tombstone, file_path)
+            elif tombstone:
+                Path(tombstone).unlink(missing_ok=True)
+            continue
+
+        if tombstone:
+            Path(tombstone).unlink(missing_ok=True)
+        if not db.query(MediaBlob.id).filter(MediaBlob.sha256 == sha256).first():
+            remove_variants(file_path)
+        removed += 1
+    return removed
+
+# Variantes de imagem (geradas fora do caminho da requisição, em processos separados)
+MEDIA_CONTEXTS = {"profile_avatar", "cover_photo", "post_image", "story_image", "comment_image", "chat_image"}
+media_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_media_process_pool() -> ProcessPoolExecutor:
+    global media_process_pool
+    if media_process_pool is None:
+        media_process_pool = ProcessPoolExecutor(max_workers=MEDIA_VARIANT_WORKERS)
+    return media_process_pool
+
+def prepare_variant_jobs(media_id: int, context: str):
+    """Registrar as variantes pendentes (is_processed=False) e montar os trabalhos de redimensionamento"""
+    db = SessionLocal()
+    try:
+        media = db.query(MediaFile).filter(MediaFile.id == media_id).first()
+        if not media or media.file_type != "image":
+            return None, []
+
+        settings = db.query(MediaQualitySetting).filter(
+            MediaQualitySetting.media_type == context,
+            MediaQualitySetting.is_active == True,
+            MediaQualitySetting.variant_type != "original"
+        ).all()
+
+        jobs = []
+        for setting in settings:
+            fmt = setting.format or "jpeg"
+            output = variant_path(media.file_path, context, setting.variant_type, fmt)
+            upsert(
+                db, MediaVariant,
+                {
+                    "original_media_id": media.id,
+                    "variant_type": setting.variant_type,
+                    "file_name": output.name,
+                    "file_path": str(output),
+                    "file_url": media_url(str(output)),
+                    "quality_percentage": setting.quality_percentage,
+                    "is_processed": False,
+                    "created_at": datetime.utcnow()
+                },
+                ["original_media_id", "variant_type"],
+                lambda row: {
+                    "file_name": row.file_name,
+                    "file_path": row.file_path,
+                    "file_url": row.file_url,
+                    "quality_percentage": row.quality_percentage,
+                    "is_processed": False
+                }
+            )
+            jobs.append({
+                "variant_type": setting.variant_type,
+                "max_width": setting.max_width,
+                "max_height": setting.max_height,
+                "quality": setting.quality_percentage or 85,
+                "format": fmt,
+                "output_path": str(output)
+            })
+        db.commit()
+        return media.file_path, jobs
+    finally:
+        db.close()
+
+def finish_variant_jobs(media_id: int, results):
+    """Gravar dimensões/tamanho e marcar is_processed"""
+    db = SessionLocal()
+    try:
+        for result in results:
+            db.query(MediaVariant).filter(
+                MediaVariant.original_media_id == media_id,
+                MediaVariant.variant_type == result["variant_type"]
+            ).update({
+                MediaVariant.width: result["width"],
+                MediaVariant.height: result["height"],
+                MediaVariant.file_size: result["file_size"],
+                MediaVariant.is_processed: True
+            }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+async def generate_media_variants(media_id: int, context: str):
+    """Gerar as variantes de uma imagem (executado em background)"""
+    if not variants_available():
+        return
+    try:
+        source_path, jobs = await run_in_threadpool(prepare_variant_jobs, media_id, context)
+        if not jobs:
+            return
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(get_media_process_pool(), render_variants, source_path, jobs)
+        await run_in_threadpool(finish_variant_jobs, media_id, results)
+        for result in results:
+            forget_variant_url(media_url(source_path), context, result["variant_type"])
+    except Exception as e:
+        print(f"❌ Erro ao gerar variantes da mídia {media_id}: {e}")
+
+def post_preview_url(post) -> Optional[str]:
+    """Variante adequada ao card do feed (cai para o original enquanto não foi gerada)"""
+    if post.media_type not in ("image", "photo"):
+        return post.media_url
+    if post.is_profile_update:
+        return variant_url(post.media_url, "profile_avatar", "large")
+    if post.is_cover_update:
+        return variant_url(post.media_url, "cover_photo", "large")
+    return variant_url(post.media_url, "post_image", "medium")
+
+# Grafo de amizades
+friend_graph = FriendGraph(
+    FRIEND_GRAPH_TTL_SECONDS,
+    shared=build_shared_cache("friend_graph", SHARED_FRIEND_GRAPH_TTL_SECONDS)
+)
+
+suggestion_cache = TTLCache(ttl_seconds=FRIEND_SUGGESTIONS_TTL_SECONDS)
+
+def load_friend_edges_many(db: Session, user_ids: List[int]) -> Dict[int, list]:
+    """Amizades aceitas de vários usuários: {user_id: [(id do amigo, amigos desde), ...]}"""
+    edges: Dict[int, list] = {}
+    accepted = Friendship.status == "accepted"
+    for start in range(0, len(user_ids), FRIEND_GRAPH_BATCH_SIZE):
+        batch = user_ids[start:start + FRIEND_GRAPH_BATCH_SIZE]
+        as_requester = select(
+            Friendship.requester_id, Friendship.addressee_id, Friendship.updated_at, Friendship.created_at
+        ).where(Friendship.requester_id.in_(batch), accepted)
+        as_addressee = select(
+            Friendship.addressee_id, Friendship.requester_id, Friendship.updated_at, Friendship.created_at
+        ).where(Friendship.addressee_id.in_(batch), accepted)
+
+        for owner_id, friend_id, updated_at, created_at in db.execute(union_all(as_requester, as_addressee)):
+            since = updated_at or created_at
+            edges.setdefault(owner_id, []).append((friend_id, since.isoformat() if since else None))
+    return edges
+
+def load_friend_edges(db: Session, user_id: int):
+    """Amizades aceitas de um usuário: (id do amigo, amigos desde)"""
+    return load_friend_edges_many(db, [user_id]).get(user_id, [])
+
+def friend_adjacency(db: Session, user_id: int) -> Adjacency:
+    """Lista de adjacência em cache (carregada do banco só em cache miss)"""
+    return friend_graph.adjacency(user_id, lambda uid: load_friend_edges(db, uid))
+
+def friend_adjacencies(db: Session, user_ids: List[int]) -> Dict[int, Adjacency]:
+    return friend_graph.adjacency_many(user_ids, lambda ids: load_friend_edges_many(db, ids))
+
+def invalidate_friend_graph(*user_ids: int):
+    """Descartar listas de adjacência e sugestões após uma amizade mudar"""
+    friend_graph.invalidate(*user_ids)
+    for user_id in user_ids:
+        suggestion_cache.delete(user_id)
+
+def get_friend_ids(db: Session, user_id: int) -> List[int]:
+    """IDs dos amigos (amizades aceitas) de um usuário, em ordem crescente"""
+    return list(friend_adjacency(db, user_id).ids)
+
+def are_friends(db: Session, user_id: int, other_id: int) -> bool:
+    return other_id in friend_adjacency(db, user_id).members
+
+def count_friends(db: Session, user_id: int) -> int:
+    return len(friend_adjacency(db, user_id).ids)
+
+def mutual_friend_count(db: Session, user_id: int, other_id: int) -> int:
+    adjacencies = friend_adjacencies(db, [user_id, other_id])
+    return count_common(adjacencies[user_id], adjacencies[other_id])
+
+def friend_suggestions(db: Session, user_id: int) -> List[tuple]:
+    """Amigos de amigos ordenados por amigos em comum: [(user_id, mutual), ...] (em cache)"""
+    cached = suggestion_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    own = friend_adjacency(db, user_id)
+    friends = friend_adjacencies(db, list(own.ids))
+
+    # Fora da lista: bloqueios (nos dois sentidos) e solicitações já existentes
+    exclude = {user_id}
+    exclude.update(
+        blocked_id if blocker_id == user_id else blocker_id
+        for blocker_id, blocked_id in db.query(Block.blocker_id, Block.blocked_id).filter(
+            (Block.blocker_id == user_id) | (Block.blocked_id == user_id)
+        )
+    )
+    exclude.update(
+        addressee_id if requester_id == user_id else requester_id
+        for requester_id, addressee_id in db.query(Friendship.requester_id, Friendship.addressee_id).filter(
+            (Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id),
+            Friendship.status == "pending"
+        )
+    )
+
+    ranked = rank_friends_of_friends(own, friends, exclude, FRIEND_SUGGESTIONS_LIMIT)
+    suggestion_cache.set(user_id, ranked)
+    return ranked
+
+# Busca de usuários
+def user_search_texts(user: User):
+    return (user.first_name, user.last_name, user.username, user.nickname)
+
+def index_user_search_terms(db: Session, user: User):
+    """Regravar os termos de busca do usuário (na transação de quem alterou o nome)"""
+    db.query(UserSearchTerm).filter(UserSearchTerm.user_id == user.id).delete(synchronize_session=False)
+    rows = [{"term": term, "user_id": user.id} for term in index_terms(*user_search_texts(user))]
+    if rows:
+        db.execute(insert(UserSearchTerm), rows)
+
+def rebuild_user_search_index(db: Session, batch_size: int = 1000) -> int:
+    """Recriar o índice de busca de todos os usuários"""
+    db.query(UserSearchTerm).delete(synchronize_session=False)
+    indexed = 0
+    last_id = 0
+    while True:
+        users = db.query(User.id, User.first_name, User.last_name, User.username, User.nickname).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+        rows = [
+            {"term": term, "user_id": user.id}
+            for user in users
+            for term in index_terms(*user_search_texts(user))
+        ]
+        if rows:
+            db.execute(insert(UserSearchTerm), rows)
+        db.commit()
+        indexed += len(users)
+        last_id = users[-1].id
+    return indexed
+
+def search_user_ids(db: Session, terms: List[str], exclude_id: int, limit: int, within: Optional[List[int]] = None) -> List[int]:
+    """Usuários ativos com um token começando por cada termo (uma busca por chave primária por termo)"""
+    driving = max(terms, key=len)  # O termo mais longo é o mais seletivo
+    query = db.query(UserSearchTerm.user_id).join(User, User.id == UserSearchTerm.user_id).filter(
+        UserSearchTerm.term == driving,
+        UserSearchTerm.user_id != exclude_id,
+        User.is_active == True
+    )
+    for term in terms:
+        if term == driving:
+            continue
+        other = aliased(UserSearchTerm)
+        query = query.join(other, (other.user_id == UserSearchTerm.user_id) & (other.term == term))
+    if within is not None:
+        query = query.filter(UserSearchTerm.user_id.in_(within))
+    return [row[0] for row in query.order_by(UserSearchTerm.user_id).limit(limit)]
+
+def search_users_ranked(db: Session, search: str, viewer_id: int, limit: int = USER_SEARCH_LIMIT) -> List[User]:
+    """Typeahead: amigos primeiro, depois por amigos em comum e nome mais parecido"""
+    terms = query_terms(search)
+    if not terms:
+        return []
+
+    own = friend_adjacency(db, viewer_id)
+    candidate_ids = search_user_ids(db, terms, viewer_id, USER_SEARCH_CANDIDATES)
+    if own.ids:
+        # Amigos entram mesmo se ficaram fora dos primeiros candidatos de um prefixo curto
+        candidate_ids += search_user_ids(db, terms, viewer_id, USER_SEARCH_CANDIDATES, within=list(own.ids))
+    candidate_ids = list(dict.fromkeys(candidate_ids))
+    if not candidate_ids:
+        return []
+
+    adjacencies = friend_adjacencies(db, candidate_ids)
+    users = db.query(User).filter(User.id.in_(candidate_ids)).all()
+    folded_query = " ".join(tokenize(search))
+
+    def rank(user: User):
+        tokens = tokenize(*user_search_texts(user))
+        full_name = " ".join(tokenize(user.first_name, user.last_name))
+        return (
+            user.id not in own.members,
+            -count_common(own, adjacencies[user.id]),
+            not full_name.startswith(folded_query),
+            not any(token in terms for token in tokens),  # Palavra completa antes de prefixo
+            full_name,
+            user.id
+        )
+
+    users.sort(key=rank)
+    return users[:limit]
+
+# Disponibilidade de username/email: o filtro responde "livre" sem consultar o banco;
+# só um possível "ocupado" é confirmado com uma consulta
+username_filter = AvailabilityFilter()
+email_filter = AvailabilityFilter()
+availability_watermark = {"max_id": 0, "since": None}
+availability_task: Optional[asyncio.Task] = None
+
+def load_availability_filters(db: Session):
+    """Carregar todos os usernames e emails (na inicialização e quando o filtro enche)"""
+    started_at = datetime.utcnow()
+    total = db.query(func.count(User.id)).scalar() or 0
+    max_id = db.query(func.max(User.id)).scalar() or 0
+    username_filter.load(
+        (username for (username,) in db.query(User.username).filter(User.username.isnot(None)).yield_per(10000)),
+        expected=total
+    )
+    email_filter.load((email for (email,) in db.query(User.email).yield_per(10000)), expected=total)
+    availability_watermark.update(max_id=max_id, since=started_at)
+
+def refresh_availability_filters():
+    """Acrescentar os usuários criados ou alterados (também por outros workers) desde a última leitura"""
+    db = SessionLocal()
+    try:
+        if not username_filter.loaded or username_filter.needs_reload() or email_filter.needs_reload():
+            load_availability_filters(db)
+            return
+
+        started_at = datetime.utcnow()
+        rows = db.query(User.id, User.username, User.email).filter(
+            (User.id > availability_watermark["max_id"]) |
+            (User.updated_at >= availability_watermark["since"] - timedelta(seconds=5))
+        ).all()
+        for user_id, username, email in rows:
+            username_filter.add(username)
+            email_filter.add(email)
+            availability_watermark["max_id"] = max(availability_watermark["max_id"], user_id)
+        availability_watermark["since"] = started_at
+    finally:
+        db.close()
+
+async def refresh_availability_periodically():
+    while True:
+        try:
+            await run_in_threadpool(refresh_availability_filters)
+        except Exception as e:
+            print(f"❌ Erro ao atualizar filtro de disponibilidade: {e}")
+        await asyncio.sleep(AVAILABILITY_REFRESH_SECONDS)
+
+def remember_taken(user: User):
+    """Registrar no filtro deste processo o que acabou de ser gravado"""
+    username_filter.add(user.username)
+    email_filter.add(user.email)
+
+def normalize_username(value: str) -> str:
+    return "".join(char for char in fold(value) if char.isalnum() or char == "_")[:USERNAME_MAX_LENGTH]
+
+def taken_usernames(db: Session, candidates: List[str], exclude_id: Optional[int] = None, use_filter: bool = True) -> set:
+    """Quais candidatos estão em uso; só os possíveis positivos do filtro vão ao banco
+
+    O filtro só vê na hora as gravações deste processo (as de outros workers chegam no
+    próximo refresh), então caminhos de escrita passam use_filter=False e consultam tudo.
+    """
+    maybe_taken = [candidate for candidate in candidates if not use_filter or username_filter.might_be_taken(candidate)]
+    if not maybe_taken:
+        return set()
+    query = db.query(User.username).filter(User.username.in_(maybe_taken))
+    if exclude_id is not None:
+        query = query.filter(User.id != exclude_id)
+    taken = {username.lower() for (username,) in query}
+    return {candidate for candidate in candidates if candidate.lower() in taken}
+
+def username_suggestions(db: Session, base: str, limit: int = 5) -> List[str]:
+    """Alternativas livres para um username: base, base + número, base + sufixos aleatórios"""
+    base = normalize_username(base)[:USERNAME_MAX_LENGTH - 4]
+    if len(base) < USERNAME_MIN_LENGTH:
+        return []
+
+    candidates = [base, f"{base}_"]
+    candidates += [f"{base}{number}" for number in range(1, 10)]
+    candidates += [f"{base}{number}" for number in random.sample(range(10, 1000), 12)]
+    candidates += [f"{base}_{number}" for number in random.sample(range(10, 100), 6)]
+    taken = taken_usernames(db, candidates)
+    return [candidate for candidate in candidates if candidate not in taken][:limit]
+
+# Bandeja de stories
+author_story_cache = TTLCache(ttl_seconds=STORY_TRAY_CACHE_TTL_SECONDS)  # author_id -> (autor, visibilidade, stories)
+story_seen_cache = TTLCache(ttl_seconds=STORY_TRAY_CACHE_TTL_SECONDS)    # viewer_id -> (IDs consultados, IDs vistos)
+story_view_buffer = CoalescingBuffer(max_rows=STORY_VIEW_FLUSH_ROWS)     # (story_id, viewer_id) -> viewed_at
+story_view_task: Optional[asyncio.Task] = None
+
+def story_response(story: Story) -> StoryResponse:
+    return StoryResponse(
+        id=story.id,
+        author=author_summary(story.author),
+        content=story.content,
+        media_type=story.media_type,
+        media_url=story.media_url,
+        background_color=story.background_color,
+        created_at=story.created_at,
+        expires_at=story.expires_at,
+        views_count=story.views_count or 0
+    )
+
+def story_audience_authors(db: Session, viewer_id: int) -> List[int]:
+    """Autores cujos stories aparecem para o leitor: ele mesmo, amigos e quem ele segue (sem bloqueios)"""
+    authors = {viewer_id}
+    authors.update(friend_adjacency(db, viewer_id).ids)
+    authors.update(row[0] for row in db.query(Follow.followed_id).filter(Follow.follower_id == viewer_id))
+    blocked = db.query(Block.blocker_id, Block.blocked_id).filter(
+        (Block.blocker_id == viewer_id) | (Block.blocked_id == viewer_id)
+    )
+    for blocker_id, blocked_id in blocked:
+        authors.discard(blocked_id if blocker_id == viewer_id else blocker_id)
+    return list(authors)
+
+def active_stories_by_author(db: Session, author_ids: List[int]) -> Dict[int, tuple]:
+    """Stories ativos de cada autor (em cache; os que não estão são lidos numa consulta só)"""
+    found = {}
+    missing = []
+    for author_id in author_ids:
+        cached = author_story_cache.get(author_id)
+        if cached is None:
+            missing.append(author_id)
+        else:
+            found[author_id] = cached
+
+    if missing:
+        now = datetime.utcnow()
+        loaded = {author_id: (None, None, []) for author_id in missing}
+        stories = with_related(db.query(Story), Story.author).filter(
+            Story.author_id.in_(missing),
+            Story.archived == False,
+            Story.expires_at > now
+        ).order_by(Story.created_at, Story.id)
+        for story in stories:
+            _, _, items = loaded[story.author_id]
+            items.append(story_response(story))
+            loaded[story.author_id] = (author_summary(story.author), story.author.story_visibility or "public", items)
+        for author_id, entry in loaded.items():
+            author_story_cache.set(author_id, entry)
+        found.update(loaded)
+    return found
+
+def seen_story_ids(db: Session, viewer_id: int, story_ids: List[int]) -> set:
+    """Quais desses stories o leitor já viu; só IDs ainda não consultados vão ao banco"""
+    checked, seen = story_seen_cache.get(viewer_id) or (frozenset(), frozenset())
+    unchecked = [story_id for story_id in story_ids if story_id not in checked]
+    if unchecked:
+        newly_seen = {
+            row[0] for row in db.query(StoryView.story_id).filter(
+                StoryView.viewer_id == viewer_id,
+                StoryView.story_id.in_(unchecked)
+            )
+        }
+        # Visualizações ainda no buffer (não gravadas) também contam
+        newly_seen.update(story_id for story_id in unchecked if (story_id, viewer_id) in story_view_buffer)
+        # Só os IDs ainda ativos ficam guardados, o resto expirou
+        active = set(story_ids)
+        checked = frozenset((checked & active) | set(unchecked))
+        seen = frozenset((seen & active) | newly_seen)
+        story_seen_cache.set(viewer_id, (checked, seen))
+    return set(seen)
+
+def mark_story_seen(viewer_id: int, story_id: int):
+    cached = story_seen_cache.get(viewer_id)
+    if cached is not None:
+        checked, seen = cached
+        story_seen_cache.set(viewer_id, (checked | {story_id}, seen | {story_id}))
+
+def record_story_view(viewer_id: int, story_id: int) -> bool:
+    """Marcar como visto na hora e enfileirar a gravação; True quando o buffer encheu"""
+    mark_story_seen(viewer_id, story_id)
+    return story_view_buffer.add((story_id, viewer_id), datetime.utcnow())
+
+def flush_story_views() -> int:
+    """Gravar as visualizações pendentes num único INSERT e recontar views_count dos stories tocados"""
+    pending = story_view_buffer.drain()
+    if not pending:
+        return 0
+
+    db = SessionLocal()
+    try:
+        # Stories apagados ou já arquivados (views compactadas) desde a visualização ficam de fora
+        live_ids = {
+            row[0] for row in db.query(Story.id).filter(
+                Story.id.in_({story_id for story_id, _ in pending}),
+                Story.archived == False
+            )
+        }
+        rows = [
+            {"story_id": story_id, "viewer_id": viewer_id, "viewed_at": viewed_at}
+            for (story_id, viewer_id), viewed_at in pending.items()
+            if story_id in live_ids
+        ]
+        if not rows:
+            return 0
+
+        insert_ignore(db, StoryView, rows, ["story_id", "viewer_id"])
+        actual = select(func.count(StoryView.id)).where(StoryView.story_id == Story.id).scalar_subquery()
+        db.query(Story).filter(Story.id.in_(live_ids)).update({Story.views_count: actual}, synchronize_session=False)
+        db.commit()
+        return len(rows)
+    except Exception:
+        # Volta para o buffer (fica o primeiro viewed_at, como no add) e o próximo ciclo tenta de novo
+        db.rollback()
+        story_view_buffer.restore(pending)
+        return 0
+    finally:
+        db.close()
+
+async def flush_story_views_periodically():
+    while True:
+        await asyncio.sleep(STORY_VIEW_FLUSH_MS / 1000)
+        if len(story_view_buffer):
+            await run_in_threadpool(flush_story_views)
+
+def build_story_tray(db: Session, viewer_id: int) -> List[StoryTrayEntry]:
+    """Stories agrupados por autor: os do leitor primeiro, depois não vistos, depois vistos"""
+    now = datetime.utcnow()
+    friends = friend_adjacency(db, viewer_id).members
+    groups = []
+    for author_id, (author, visibility, stories) in active_stories_by_author(db, story_audience_authors(db, viewer_id)).items():
+        if author_id != viewer_id:
+            if visibility == "private" or (visibility == "friends" and author_id not in friends):
+                continue
+        stories = [story for story in stories if story.expires_at > now]
+        if stories:
+            groups.append((author_id, author, stories))
+
+    seen = seen_story_ids(db, viewer_id, [story.id for _, _, stories in groups for story in stories])
+    tray = []
+    for author_id, author, stories in groups:
+        items = [StoryTrayItem(**story.model_dump(), seen=story.id in seen) for story in stories]
+        tray.append(StoryTrayEntry(
+            author=author,
+            stories=items,
+            all_seen=all(item.seen for item in items),
+            latest_at=stories[-1].created_at
+        ))
+
+    tray.sort(key=lambda entry: (entry.author["id"] != viewer_id, entry.all_seen, -entry.latest_at.timestamp()))
+    return tray
+
+# Expiração de stories
+story_expiry_heap = DeadlineHeap()
+story_sweeper_task: Optional[asyncio.Task] = None
+
+def schedule_story_expiries(db: Session) -> int:
+    """Trazer para o heap os stories expirados ainda não arquivados e os que expiram em breve"""
+    now = datetime.utcnow()
+    scheduled = 0
+    # Atraso acumulado (ex.: servidor parado) vem em lotes por id até acabar
+    last_id = 0
+    while True:
+        overdue = db.query(Story.id, Story.expires_at).filter(
+            Story.archived == False,
+            Story.expires_at <= now,
+            Story.id > last_id
+        ).order_by(Story.id).limit(STORY_SWEEP_BATCH_SIZE * 10).all()
+        for story_id, expires_at in overdue:
+            story_expiry_heap.push(expires_at, story_id)
+        scheduled += len(overdue)
+        if len(overdue) < STORY_SWEEP_BATCH_SIZE * 10:
+            break
+        last_id = overdue[-1][0]
+
+    upcoming = db.query(Story.id, Story.expires_at).filter(
+        Story.archived == False,
+        Story.expires_at > now,
+        Story.expires_at <= now + timedelta(minutes=STORY_SWEEP_HORIZON_MINUTES * 2)
+    ).all()
+    for story_id, expires_at in upcoming:
+        story_expiry_heap.push(expires_at, story_id)
+    return scheduled + len(upcoming)
+
+def archive_expired_stories(db: Session, story_ids: List[int]) -> int:
+    """Arquivar stories expirados e compactar as visualizações em views_count"""
+    now = datetime.utcnow()
+    expired = db.query(Story.id, Story.author_id).filter(
+        Story.id.in_(story_ids),
+        Story.expires_at <= now  # Apagados ou com prazo alterado desde o agendamento ficam de fora
+    ).all()
+    if not expired:
+        return 0
+    expired_ids = [story_id for story_id, _ in expired]
+
+    counts = dict(db.query(StoryView.story_id, func.count(StoryView.id)).filter(
+        StoryView.story_id.in_(expired_ids)
+    ).group_by(StoryView.story_id).all())
+
+    values = {
+        Story.archived: True,
+        Story.archived_at: func.coalesce(Story.archived_at, now)
+    }
+    if counts:
+        values[Story.views_count] = case(counts, value=Story.id, else_=Story.views_count)
+    db.query(Story).filter(Story.id.in_(expired_ids)).update(values, synchronize_session=False)
+    db.query(StoryView).filter(StoryView.story_id.in_(expired_ids)).delete(synchronize_session=False)
+    db.commit()
+
+    for author_id in {author_id for _, author_id in expired}:
+        author_story_cache.delete(author_id)
+    return len(expired_ids)
+
+def run_story_sweep(story_ids: List[int]) -> int:
+    db = SessionLocal()
+    try:
+        return archive_expired_stories(db, story_ids)
+    finally:
+        db.close()
+
+def refill_story_expiries() -> int:
+    db = SessionLocal()
+    try:
+        return schedule_story_expiries(db)
+    finally:
+        db.close()
+
+async def sweep_expired_stories_periodically():
+    """Dormir até a próxima expiração do heap e arquivar os vencidos em lotes"""
+    next_refill = datetime.utcnow()
+    while True:
+        try:
+            now = datetime.utcnow()
+            if now >= next_refill:
+                await run_in_threadpool(refill_story_expiries)
+                next_refill = now + timedelta(minutes=STORY_SWEEP_HORIZON_MINUTES)
+
+            due = story_expiry_heap.pop_due(datetime.utcnow(), STORY_SWEEP_BATCH_SIZE)
+            if due:
+                await run_in_threadpool(run_story_sweep, due)
+                continue
+        except Exception as e:
+            print(f"❌ Erro ao arquivar stories expirados: {e}")
+
+        wake_at = min(filter(None, (story_expiry_heap.next_deadline(), next_refill)))
+        delay = (wake_at - datetime.utcnow()).total_seconds()
+        await asyncio.sleep(min(max(delay, 0.1), STORY_SWEEP_MAX_SLEEP_SECONDS))
+
+# Notificações (write-behind)
+notification_queue = WriteBehindQueue(max_items=NOTIFICATION_MAX_BACKLOG)
+notification_flush_lock = asyncio.Lock()
+notification_task: Optional[asyncio.Task] = None
+
+# Mensagem das notificações agrupadas, por tipo ("Ana e mais 23 pessoas reagiram ao seu post")
+NOTIFICATION_GROUP_MESSAGES = {
+    "reaction": "reagiram ao seu post",
+    "comment": "comentaram no seu post",
+}
+
+def queue_notification(background_tasks: BackgroundTasks, recipient_id: int, sender: User,
+                       notification_type: str, message: str, data: dict, group_key: Optional[str] = None):
+    """Enfileirar uma notificação; gravação e envio pelo WebSocket ficam com o flusher
+
+    Com `group_key`, notificações do mesmo tipo sobre o mesmo alvo se juntam numa
+    linha não lida (dentro de NOTIFICATION_GROUP_WINDOW_MINUTES). Com a fila
+    cheia a notificação é gravada aqui mesmo, para não perder nada.
+    """
+    values = {
+        "recipient_id": recipient_id,
+        "sender_id": sender.id,
+        "notification_type": notification_type,
+        "title": f"{sender.first_name} {sender.last_name}",
+        "message": message,
+        "data": json.dumps(data),
+        "created_at": datetime.utcnow(),
+        "group_key": group_key
+    }
+    item = (values, author_summary(sender), data)
+    if notification_queue.put(item):
+        return
+
+    for recipient, payload in write_notifications([item]):
+        background_tasks.add_task(manager.send_notification, recipient, payload)
+
+def notification_payload(notification: Notification, sender: dict, data: dict) -> dict:
+    return {
+        "id": notification.id,
+        "type": notification.notification_type,
+        "title": notification.title,
+        "message": notification.message,
+        "sender": sender,
+        "data": data,
+        "created_at": notification.created_at.isoformat(),
+        "actor_count": notification.actor_count,
+        "actor_ids": json.loads(notification.actor_ids) if notification.actor_ids else []
+    }
+
+def open_notification_groups(db: Session, items: list) -> Dict[tuple, Notification]:
+    """Linhas agrupáveis ainda não lidas, dentro da janela: {(recipient_id, group_key): notificação}"""
+    keys = {(values["recipient_id"], values["group_key"]) for values, _, _ in items if values["group_key"]}
+    if not keys:
+        return {}
+    since = datetime.utcnow() - timedelta(minutes=NOTIFICATION_GROUP_WINDOW_MINUTES)
+    rows = db.query(Notification).filter(
+        Notification.recipient_id.in_({recipient_id for recipient_id, _ in keys}),
+        Notification.group_key.in_({group_key for _, group_key in keys}),
+        Notification.is_read == False,
+        Notification.created_at >= since
+    ).order_by(Notification.created_at).all()
+    return {(row.recipient_id, row.group_key): row for row in rows if (row.recipient_id, row.group_key) in keys}
+
+def merge_notification(notification: Notification, values: dict):
+    """Somar um ator a uma notificação agrupada; quem já está entre os últimos não conta de novo"""
+    actors = json.loads(notification.actor_ids) if notification.actor_ids else [notification.sender_id]
+    if values["sender_id"] in actors:
+        actors.remove(values["sender_id"])
+    else:
+        notification.actor_count = (notification.actor_count or 1) + 1
+    notification.actor_ids = json.dumps(([values["sender_id"]] + actors)[:NOTIFICATION_GROUP_ACTORS])
+
+    notification.sender_id = values["sender_id"]
+    notification.data = values["data"]
+    notification.created_at = values["created_at"]
+    if notification.actor_count > 1:
+        others = notification.actor_count - 1
+        notification.title = f"{values['title']} e mais {others} {'pessoa' if others == 1 else 'pessoas'}"
+        notification.message = NOTIFICATION_GROUP_MESSAGES.get(values["notification_type"], values["message"])
+    else:
+        notification.title, notification.message = values["title"], values["message"]
+
+def insert_notifications(items: list) -> list:
+    """Gravar um lote numa transação; devolve [(recipient_id, payload)] na ordem da fila
+
+    Itens agrupáveis atualizam a linha aberta do grupo (ou a criam) e geram um
+    evento só por linha, com o estado final, na posição da última atualização.
+    """
+    db = SessionLocal()
+    try:
+        groups = open_notification_groups(db, items)
+        touched: Dict[int, tuple] = {}
+        for values, sender, data in items:
+            key = (values["recipient_id"], values["group_key"])
+            notification = groups.get(key) if values["group_key"] else None
+            if notification is None:
+                notification = Notification(**values, actor_count=1, actor_ids=json.dumps([values["sender_id"]]))
+                db.add(notification)
+                if values["group_key"]:
+                    groups[key] = notification
+            else:
+                merge_notification(notification, values)
+            touched.pop(id(notification), None)
+            touched[id(notification)] = (notification, sender, data)
+        db.commit()
+        return [
+            (notification.recipient_id, notification_payload(notification, sender, data))
+            for notification, sender, data in touched.values()
+        ]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def write_notifications(items: list) -> list:
+    """Lote inteiro; se falhar, uma a uma (banco fora do ar devolve o resto para a fila)"""
+    try:
+        return insert_notifications(items)
+    except Exception as e:
+        print(f"❌ Erro ao gravar lote de {len(items)} notificações: {e}")
+
+    delivered = []
+    for index, item in enumerate(items):
+        try:
+            delivered += insert_notifications([item])
+        except OperationalError:
+            notification_queue.requeue(items[index:])
+            break
+        except Exception as e:
+            print(f"❌ Notificação descartada ({item[0]['notification_type']} para {item[0]['recipient_id']}): {e}")
+    return delivered
+
+async def flush_notifications():
+    """Esvaziar a fila em lotes e enviar os eventos na ordem em que foram gravados"""
+    async with notification_flush_lock:
+        while len(notification_queue):
+            batch = notification_queue.take(NOTIFICATION_BATCH_SIZE)
+            delivered = await run_in_threadpool(write_notifications, batch)
+            for recipient_id, payload in delivered:
+                await manager.send_notification(recipient_id, payload)
+            if len(delivered) < len(batch):
+                break  # Itens devolvidos: tenta de novo no próximo ciclo
+
+async def flush_notifications_periodically():
+    while True:
+        await asyncio.sleep(NOTIFICATION_FLUSH_MS / 1000)
+        try:
+            await flush_notifications()
+        except Exception as e:
+            print(f"❌ Erro no envio de notificações: {e}")
+
+# Timeline (fan-out on write)
+def get_follower_ids(db: Session, user_id: int) -> List[int]:
+    """IDs de quem segue o usuário"""
+    return [row[0] for row in db.query(Follow.follower_id).filter(Follow.followed_id == user_id).all()]
+
+def privacy_filter(privacies: List[str]):
+    """Filtro de posts por privacidade (posts antigos sem privacidade contam como públicos)"""
+    condition = Post.privacy.in_(privacies)
+    if "public" in privacies:
+        condition = condition | Post.privacy.is_(None)
+    return condition
+
+def timeline_privacies(db: Session, viewer_id: int, author_id: int) -> List[str]:
+    """Privacidades dos posts de author que devem aparecer na timeline de viewer"""
+    if viewer_id == author_id:
+        return ["public", "friends", "private"]
+
+    blocked = db.query(Block.id).filter(
+        ((Block.blocker_id == viewer_id) & (Block.blocked_id == author_id)) |
+        ((Block.blocker_id == author_id) & (Block.blocked_id == viewer_id))
+    ).first()
+    if blocked:
+        return []
+
+    if are_friends(db, viewer_id, author_id):
+        return ["public", "friends"]
+
+    follows = db.query(Follow.id).filter(
+        Follow.follower_id == viewer_id,
+        Follow.followed_id == author_id
+    ).first()
+    return ["public"] if follows else []
+
+def push_to_timelines(db: Session, post: Post, user_ids):
+    """Inserir o post nas timelines indicadas, ignorando quem já o possui"""
+    rows = [
+        {"user_id": user_id, "post_id": post.id, "author_id": post.author_id, "created_at": post.created_at}
+        for user_id in set(user_ids)
+    ]
+    for start in range(0, len(rows), 1000):
+        insert_ignore(db, TimelineEntry, rows[start:start + 1000], ["user_id", "post_id"])
+
+def trim_timelines(db: Session, user_ids):
+    """Manter cada timeline com no máximo TIMELINE_MAX_ENTRIES posts"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    oversized = db.query(TimelineEntry.user_id).filter(
+        TimelineEntry.user_id.in_(user_ids)
+    ).group_by(TimelineEntry.user_id).having(func.count(TimelineEntry.id) > TIMELINE_MAX_ENTRIES).all()
+
+    for (user_id,) in oversized:
+        cutoff = db.query(TimelineEntry.created_at, TimelineEntry.post_id).filter(
+            TimelineEntry.user_id == user_id
+        ).order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()).offset(TIMELINE_MAX_ENTRIES).first()
+        if cutoff:
+            db.query(TimelineEntry).filter(
+                TimelineEntry.user_id == user_id,
+                or_(
+                    TimelineEntry.created_at < cutoff.created_at,
+                    and_(TimelineEntry.created_at == cutoff.created_at, TimelineEntry.post_id <= cutoff.post_id)
+                )
+            ).delete(synchronize_session=False)
+
+def fan_out_post(post_id: int):
+    """Distribuir post nas timelines de amigos e seguidores (executado em background)"""
+    db = SessionLocal()
+    try:
+        post = db.query(Post).filter(Post.id == post_id).first()
+        if not post:
+            return
+
+        privacy = post.privacy or "public"
+        recipients = {post.author_id}
+        if privacy != "private":
+            recipients.update(get_friend_ids(db, post.author_id))
+        if privacy == "public":
+            recipients.update(get_follower_ids(db, post.author_id))
+
+        push_to_timelines(db, post, recipients)
+        trim_timelines(db, recipients)
+        db.commit()
+    except Exception as e:
+        print(f"❌ Erro no fan-out do post {post_id}: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+def sync_timeline_pair(user_a: int, user_b: int):
+    """Recalcular o que cada usuário vê do outro após mudança de vínculo (executado em background)"""
+    db = SessionLocal()
+    try:
+        for viewer_id, author_id in ((user_a, user_b), (user_b, user_a)):
+            db.query(TimelineEntry).filter(
+                TimelineEntry.user_id == viewer_id,
+                TimelineEntry.author_id == author_id
+            ).delete(synchronize_session=False)
+
+            privacies = timeline_privacies(db, viewer_id, author_id)
+            if not privacies:
+                continue
+
+            posts = db.query(Post.id, Post.author_id, Post.created_at).filter(
+                Post.author_id == author_id,
+                privacy_filter(privacies)
+            ).order_by(Post.created_at.desc(), Post.id.desc()).limit(TIMELINE_BACKFILL_LIMIT).all()
+            if posts:
+                insert_ignore(db, TimelineEntry, [
+                    {"user_id": viewer_id, "post_id": post.id, "author_id": post.author_id, "created_at": post.created_at}
+                    for post in posts
+                ], ["user_id", "post_id"])
+            trim_timelines(db, [viewer_id])
+        db.commit()
+    except Exception as e:
+        print(f"❌ Erro ao sincronizar timelines {user_a} <-> {user_b}: {e}")
+        db.rollback()
+    finally:
+        db.close()
 
-# Serve static files for uploads
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+def rebuild_timeline(db: Session, user_id: int):
+    """Montar a timeline a partir dos posts recentes (usuários novos ou sem timeline ainda)"""
+    friend_ids = get_friend_ids(db, user_id)
+    followed_ids = [row[0] for row in db.query(Follow.followed_id).filter(Follow.follower_id == user_id).all()]
+    blocked_ids = [
+        row[0] if row[0] != user_id else row[1]
+        for row in db.query(Block.blocker_id, Block.blocked_id).filter(
+            (Block.blocker_id == user_id) | (Block.blocked_id == user_id)
+        ).all()
+    ]
+
+    posts = db.query(Post.id, Post.author_id, Post.created_at).filter(
+        (Post.author_id == user_id) |
+        (Post.author_id.in_(friend_ids) & privacy_filter(["public", "friends"])) |
+        (Post.author_id.in_(followed_ids) & privacy_filter(["public"])),
+        Post.author_id.notin_(blocked_ids)
+    ).order_by(Post.created_at.desc(), Post.id.desc()).limit(TIMELINE_MAX_ENTRIES).all()
+
+    # Fan-out, sincronização de vínculos e outra carga da primeira página podem gravar as mesmas linhas
+    if posts:
+        insert_ignore(db, TimelineEntry, [
+            {"user_id": user_id, "post_id": post.id, "author_id": post.author_id, "created_at": post.created_at}
+            for post in posts
+        ], ["user_id", "post_id"])
+    insert_ignore(db, TimelineState, [{"user_id": user_id, "built_at": datetime.utcnow()}], ["user_id"])
 
 # Auth routes
 @app.post("/auth/register", response_model=UserResponse)
@@ -734,6 +2541,9 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         db_user = db.query(User).filter(User.email == user.email).first()
         if db_user:
             raise HTTPException(status_code=400, detail="Email already registered")
+
+        if user.username and taken_usernames(db, [user.username], use_filter=False):
+            raise HTTPException(status_code=400, detail="Username already taken")
         
         # Cria novo usuário
         hashed_password = hash_password(user.password)
@@ -749,15 +2559,27 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
             gender=user.gender,
             birth_date=birth_date_obj,
             phone=user.phone,
+            username=user.username or None,
             is_active=True,
             created_at=datetime.utcnow(),
             last_seen=datetime.utcnow()
         )
         db.add(db_user)
+        db.flush()
+        index_user_search_terms(db, db_user)
         db.commit()
         db.refresh(db_user)
+        remember_taken(db_user)
         
         return db_user
+    except HTTPException:
+        raise
+    except IntegrityError:
+        # Outro cadastro levou o email ou o username entre a verificação e o commit
+        db.rollback()
+        if db.query(User.id).filter(User.email == user.email).first():
+            raise HTTPException(status_code=400, detail="Email already registered")
+        raise HTTPException(status_code=400, detail="Username already taken")
     except Exception as e:
         print(f"Erro no registro: {e}")
         db.rollback()
@@ -796,30 +2618,32 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 @app.get("/auth/check-email")
 def check_email_exists(email: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+    if not email_filter.might_be_taken(email):
+        return {"exists": False}
+    user = db.query(User.id).filter(User.email == email).first()
     return {"exists": user is not None}
 
 @app.get("/auth/check-username")
 def check_username_exists(username: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    user = db.query(User).filter(
-        User.username == username,
-        User.id != current_user.id  # Exclude current user
-    ).first()
-    return {"exists": user is not None}
+    return {"exists": bool(taken_usernames(db, [username], exclude_id=current_user.id))}
 
 @app.get("/auth/check-username-public")
 def check_username_exists_public(username: str, db: Session = Depends(get_db)):
     """Public route to check username availability during registration"""
-    user = db.query(User).filter(User.username == username).first()
-    return {"exists": user is not None}
+    return {"exists": bool(taken_usernames(db, [username]))}
+
+@app.get("/auth/username-suggestions")
+def get_username_suggestions(base: str, limit: int = 5, db: Session = Depends(get_db)):
+    """Usernames livres parecidos com `base` (nome digitado ou username ocupado)"""
+    return {"suggestions": username_suggestions(db, base, max(1, min(limit, 10)))}
 
 @app.get("/auth/verify-token")
 async def verify_token(current_user: User = Depends(get_current_user)):
-    return {"valid": True, "user": current_user}
+    return {"valid": True, "user": UserResponse.model_validate(current_user)}
 
 # Posts routes
 @app.post("/posts/", response_model=PostResponse)
-async def create_post(post: PostCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_post(post: PostCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Validação e processamento do conteúdo
     content_to_save = post.content
     
@@ -856,19 +2680,20 @@ async def create_post(post: PostCreate, current_user: User = Depends(get_current
     db.add(db_post)
     db.commit()
     db.refresh(db_post)
+
+    # O autor vê o próprio post imediatamente; amigos e seguidores recebem em background
+    push_to_timelines(db, db_post, [current_user.id])
+    db.commit()
+    background_tasks.add_task(fan_out_post, db_post.id)
     
     return PostResponse(
         id=db_post.id,
-        author={
-            "id": db_post.author.id,
-            "first_name": db_post.author.first_name,
-            "last_name": db_post.author.last_name,
-            "avatar": None
-        },
+        author=author_summary(db_post.author),
         content=db_post.content,
         post_type=db_post.post_type,
         media_type=db_post.media_type,
         media_url=db_post.media_url,
+        media_preview_url=post_preview_url(db_post),
         created_at=db_post.created_at,
         reactions_count=db_post.reactions_count,
         comments_count=db_post.comments_count,
@@ -877,119 +2702,127 @@ async def create_post(post: PostCreate, current_user: User = Depends(get_current
         is_cover_update=db_post.is_cover_update
     )
 
-@app.get("/posts/", response_model=List[PostResponse])
-async def get_posts(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    posts = db.query(Post).order_by(Post.created_at.desc()).limit(50).all()
+@app.get("/posts/", response_model=Page[PostResponse])
+def get_posts(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Feed inicial: lê uma fatia pré-computada da timeline do usuário"""
+    if not cursor and not db.query(TimelineState.user_id).filter(TimelineState.user_id == current_user.id).first():
+        rebuild_timeline(db, current_user.id)
+        db.commit()
+
+    entries, next_cursor = paginate(
+        db.query(TimelineEntry).filter(TimelineEntry.user_id == current_user.id),
+        TimelineEntry.created_at, TimelineEntry.post_id, cursor, limit
+    )
+
+    posts_by_id = {
+        post.id: post
+        for post in with_related(db.query(Post), Post.author).filter(
+            Post.id.in_([entry.post_id for entry in entries])
+        ).all()
+    }
+    posts = [posts_by_id[entry.post_id] for entry in entries if entry.post_id in posts_by_id]
+    states = post_viewer_states(db, current_user.id, posts)
     
-    return [
+    return Page[PostResponse](items=[
         PostResponse(
             id=post.id,
-            author={
-                "id": post.author.id,
-                "first_name": post.author.first_name,
-                "last_name": post.author.last_name,
-                "avatar": None
-            },
+            author=author_summary(post.author),
             content=post.content,
             post_type=post.post_type,
             media_type=post.media_type,
             media_url=post.media_url,
+            media_preview_url=post_preview_url(post),
             created_at=post.created_at,
-            reactions_count=post.reactions_count,
-            comments_count=post.comments_count,
-            shares_count=post.shares_count,
+            reactions_count=post.reactions_count or 0,
+            comments_count=post.comments_count or 0,
+            shares_count=post.shares_count or 0,
             is_profile_update=post.is_profile_update,
-            is_cover_update=post.is_cover_update
+            is_cover_update=post.is_cover_update,
+            viewer=states.get(post.id)
         )
         for post in posts
-    ]
+    ], next_cursor=next_cursor)
 
 # User posts routes
-@app.get("/users/{user_id}/posts", response_model=List[PostResponse])
-async def get_user_posts(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    posts = db.query(Post).filter(
-        Post.author_id == user_id,
-        Post.post_type == "post"
-    ).order_by(Post.created_at.desc()).limit(50).all()
+@app.get("/users/{user_id}/posts", response_model=Page[PostResponse])
+def get_user_posts(user_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    posts, next_cursor = paginate(
+        with_related(db.query(Post), Post.author).filter(Post.author_id == user_id, Post.post_type == "post"),
+        Post.created_at, Post.id, cursor, limit
+    )
+    states = post_viewer_states(db, current_user.id, posts)
     
-    return [
+    return Page[PostResponse](items=[
         PostResponse(
             id=post.id,
-            author={
-                "id": post.author.id,
-                "first_name": post.author.first_name,
-                "last_name": post.author.last_name,
-                "avatar": getattr(post.author, 'avatar', None)
-            },
+            author=author_summary(post.author),
             content=post.content,
             post_type=post.post_type,
             media_type=post.media_type,
             media_url=post.media_url,
+            media_preview_url=post_preview_url(post),
             created_at=post.created_at,
-            reactions_count=db.query(Reaction).filter(Reaction.post_id == post.id).count(),
-            comments_count=db.query(Comment).filter(Comment.post_id == post.id).count(),
-            shares_count=db.query(Share).filter(Share.post_id == post.id).count(),
+            reactions_count=post.reactions_count or 0,
+            comments_count=post.comments_count or 0,
+            shares_count=post.shares_count or 0,
             is_profile_update=post.is_profile_update,
-            is_cover_update=post.is_cover_update
+            is_cover_update=post.is_cover_update,
+            viewer=states.get(post.id)
         )
         for post in posts
-    ]
+    ], next_cursor=next_cursor)
+
+@app.post("/posts/viewer-state", response_model=List[PostViewerState])
+def get_posts_viewer_state(request: PostViewerStateRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Reação do leitor, compartilhamento e contagens de vários posts de uma vez (até MAX_PAGE_SIZE IDs)"""
+    if len(request.post_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} post IDs per request")
+
+    posts = db.query(Post.id, Post.comments_count).filter(Post.id.in_(request.post_ids)).all()
+    states = post_viewer_states(db, current_user.id, posts)
+    return [states[post_id] for post_id in dict.fromkeys(request.post_ids) if post_id in states]
 
 @app.get("/posts/{post_id}", response_model=PostResponse)
-async def get_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get individual post by ID"""
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = with_related(db.query(Post), Post.author).filter(Post.id == post_id).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
     return PostResponse(
         id=post.id,
-        author={
-            "id": post.author.id,
-            "first_name": post.author.first_name,
-            "last_name": post.author.last_name,
-            "avatar": getattr(post.author, 'avatar', None)
-        },
+        author=author_summary(post.author),
         content=post.content,
         post_type=post.post_type,
         media_type=post.media_type,
         media_url=post.media_url,
+        media_preview_url=post_preview_url(post),
         created_at=post.created_at,
-        reactions_count=db.query(Reaction).filter(Reaction.post_id == post.id).count(),
-        comments_count=db.query(Comment).filter(Comment.post_id == post.id).count(),
-        shares_count=db.query(Share).filter(Share.post_id == post.id).count(),
+        reactions_count=post.reactions_count or 0,
+        comments_count=post.comments_count or 0,
+        shares_count=post.shares_count or 0,
         is_profile_update=post.is_profile_update,
-        is_cover_update=post.is_cover_update
+        is_cover_update=post.is_cover_update,
+        viewer=post_viewer_states(db, current_user.id, [post])[post.id]
     )
 
-@app.get("/posts/{post_id}/comments", response_model=List[CommentResponse])
-async def get_post_comments(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/posts/{post_id}/comments", response_model=Page[CommentResponse])
+def get_post_comments(post_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get comments for a specific post"""
     post = db.query(Post).filter(Post.id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    comments = db.query(Comment).filter(Comment.post_id == post_id).order_by(Comment.created_at.asc()).all()
+    comments, next_cursor = paginate(
+        with_related(db.query(Comment), Comment.author).filter(Comment.post_id == post_id),
+        Comment.created_at, Comment.id, cursor, limit, descending=False
+    )
 
-    return [
-        CommentResponse(
-            id=comment.id,
-            content=comment.content,
-            author={
-                "id": comment.author.id,
-                "first_name": comment.author.first_name,
-                "last_name": comment.author.last_name,
-                "avatar": getattr(comment.author, 'avatar', None)
-            },
-            created_at=comment.created_at,
-            reactions_count=0  # TODO: Add comment reactions
-        )
-        for comment in comments
-    ]
+    return Page[CommentResponse](items=[comment_response(comment) for comment in comments], next_cursor=next_cursor)
 
 @app.post("/posts/{post_id}/comments", response_model=CommentResponse)
-async def create_comment(post_id: int, comment_data: CommentCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_comment(post_id: int, comment_data: CommentCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Create a comment on a post"""
     post = db.query(Post).filter(Post.id == post_id).first()
     if not post:
@@ -998,231 +2831,157 @@ async def create_comment(post_id: int, comment_data: CommentCreate, current_user
     comment = Comment(
         content=comment_data.content,
         post_id=post_id,
+        parent_id=comment_data.parent_id,
         author_id=current_user.id
     )
 
     db.add(comment)
+    attach_comment(db, comment)
+    bump_counter(db, Post, post_id, Post.comments_count)
     db.commit()
     db.refresh(comment)
 
     return CommentResponse(
         id=comment.id,
         content=comment.content,
-        author={
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": getattr(current_user, 'avatar', None)
-        },
+        author=author_summary(current_user),
         created_at=comment.created_at,
-        reactions_count=0
+        reactions_count=0,
+        parent_id=comment.parent_id
     )
 
 @app.post("/posts/{post_id}/reactions")
-async def create_post_reaction(post_id: int, reaction_data: ReactionCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_post_reaction(post_id: int, reaction_data: ReactionCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Add or update reaction to a post"""
     post = db.query(Post).filter(Post.id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    # Check if user already reacted
-    existing_reaction = db.query(Reaction).filter(
-        Reaction.post_id == post_id,
-        Reaction.user_id == current_user.id
-    ).first()
-
-    if existing_reaction:
-        # Update existing reaction
-        existing_reaction.reaction_type = reaction_data.reaction_type
-        db.commit()
-        return {"message": "Reaction updated"}
-    else:
-        # Create new reaction
-        reaction = Reaction(
-            post_id=post_id,
-            user_id=current_user.id,
-            reaction_type=reaction_data.reaction_type
-        )
-        db.add(reaction)
-        db.commit()
-        return {"message": "Reaction added"}
+    old_type, _ = write_reaction(db, post_id, current_user.id, reaction_data.reaction_type)
+    return {"message": "Reaction updated" if old_type else "Reaction added"}
 
 @app.delete("/posts/{post_id}/reactions")
-async def remove_post_reaction(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def remove_post_reaction(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Remove reaction from a post"""
-    reaction = db.query(Reaction).filter(
-        Reaction.post_id == post_id,
-        Reaction.user_id == current_user.id
-    ).first()
-
-    if reaction:
-        db.delete(reaction)
-        db.commit()
-        return {"message": "Reaction removed"}
-    else:
+    old_type, _ = write_reaction(db, post_id, current_user.id, None)
+    if old_type is None:
         raise HTTPException(status_code=404, detail="Reaction not found")
+    return {"message": "Reaction removed"}
 
-@app.get("/users/{user_id}/testimonials", response_model=List[PostResponse])
-async def get_user_testimonials(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    testimonials = db.query(Post).filter(
-        Post.author_id == user_id,
-        Post.post_type == "testimonial"
-    ).order_by(Post.created_at.desc()).limit(50).all()
+@app.get("/users/{user_id}/testimonials", response_model=Page[PostResponse])
+def get_user_testimonials(user_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    testimonials, next_cursor = paginate(
+        with_related(db.query(Post), Post.author).filter(Post.author_id == user_id, Post.post_type == "testimonial"),
+        Post.created_at, Post.id, cursor, limit
+    )
+    states = post_viewer_states(db, current_user.id, testimonials)
     
-    return [
+    return Page[PostResponse](items=[
         PostResponse(
             id=post.id,
-            author={
-                "id": post.author.id,
-                "first_name": post.author.first_name,
-                "last_name": post.author.last_name,
-                "avatar": getattr(post.author, 'avatar', None)
-            },
+            author=author_summary(post.author),
             content=post.content,
             post_type=post.post_type,
             media_type=post.media_type,
             media_url=post.media_url,
+            media_preview_url=post_preview_url(post),
             created_at=post.created_at,
-            reactions_count=db.query(Reaction).filter(Reaction.post_id == post.id).count(),
-            comments_count=db.query(Comment).filter(Comment.post_id == post.id).count(),
-            shares_count=db.query(Share).filter(Share.post_id == post.id).count(),
+            reactions_count=post.reactions_count or 0,
+            comments_count=post.comments_count or 0,
+            shares_count=post.shares_count or 0,
             is_profile_update=post.is_profile_update,
-            is_cover_update=post.is_cover_update
+            is_cover_update=post.is_cover_update,
+            viewer=states.get(post.id)
         )
         for post in testimonials
-    ]
+    ], next_cursor=next_cursor)
 
 # Reactions routes
 @app.post("/reactions/")
-async def create_reaction(reaction: ReactionCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_reaction(reaction: ReactionCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if post exists
     post = db.query(Post).filter(Post.id == reaction.post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
     # Valid reaction types (modern social media reactions)
-    valid_reactions = ["like", "love", "haha", "wow", "sad", "angry", "care", "pride", "grateful", "celebrating"]
-    if reaction.reaction_type not in valid_reactions:
+    if reaction.reaction_type not in REACTION_TYPES:
         raise HTTPException(status_code=400, detail="Invalid reaction type")
     
-    # Check if user already reacted to this post
-    existing_reaction = db.query(Reaction).filter(
-        Reaction.user_id == current_user.id,
-        Reaction.post_id == reaction.post_id
-    ).first()
-    
-    if existing_reaction:
-        if existing_reaction.reaction_type == reaction.reaction_type:
-            # Remove reaction if same type
-            db.delete(existing_reaction)
-            db.commit()
-            return {"message": "Reaction removed"}
-        else:
-            # Update reaction type
-            existing_reaction.reaction_type = reaction.reaction_type
-            db.commit()
-            return {"message": "Reaction updated"}
-    
-    # Create new reaction
-    db_reaction = Reaction(
-        user_id=current_user.id,
-        post_id=reaction.post_id,
-        reaction_type=reaction.reaction_type
-    )
-    db.add(db_reaction)
-    db.commit()
+    # Mesmo tipo remove a reação (toggle)
+    old_type, new_type = write_reaction(db, reaction.post_id, current_user.id, reaction.reaction_type, toggle=True)
+    if new_type is None:
+        return {"message": "Reaction removed"}
+    if old_type is not None:
+        return {"message": "Reaction updated"}
     
     # Send notification to post author if not self-reaction
     if post.author_id != current_user.id:
-        notification = Notification(
-            recipient_id=post.author_id,
-            sender_id=current_user.id,
-            notification_type="reaction",
-            title=f"{current_user.first_name} {current_user.last_name}",
-            message=f"reagiu ao seu post com {reaction.reaction_type}",
-            data=json.dumps({"post_id": reaction.post_id}),
-            created_at=datetime.utcnow()
-        )
-        db.add(notification)
-        db.commit()
-        
-        # Send real-time notification
-        await manager.send_notification(post.author_id, {
-            "id": notification.id,
-            "type": "reaction",
-            "title": f"{current_user.first_name} {current_user.last_name}",
-            "message": f"reagiu ao seu post com {reaction.reaction_type}",
-            "sender": {
-                "id": current_user.id,
-                "first_name": current_user.first_name,
-                "last_name": current_user.last_name,
-                "avatar": getattr(current_user, 'avatar', None)
-            },
-            "data": {"post_id": reaction.post_id},
-            "created_at": notification.created_at.isoformat()
-        })
+        queue_notification(background_tasks, post.author_id, current_user, "reaction",
+                           f"reagiu ao seu post com {reaction.reaction_type}", {"post_id": reaction.post_id},
+                           group_key=f"reaction:post:{reaction.post_id}")
     
     return {"message": "Reaction created"}
 
 @app.get("/reactions/post/{post_id}")
-async def get_post_reactions(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    reactions = db.query(Reaction).filter(Reaction.post_id == post_id).all()
-    
-    # Group reactions by type
-    reaction_counts = {}
-    user_reaction = None
-    
-    for reaction in reactions:
-        if reaction.reaction_type not in reaction_counts:
-            reaction_counts[reaction.reaction_type] = 0
-        reaction_counts[reaction.reaction_type] += 1
-        
-        if reaction.user_id == current_user.id:
-            user_reaction = reaction.reaction_type
+def get_post_reactions(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    reaction_counts = post_reaction_counts(db, post_id)
     
     return {
         "reactions": reaction_counts,
-        "user_reaction": user_reaction,
-        "total": len(reactions)
+        "user_reaction": viewer_reaction(db, post_id, current_user.id),
+        "total": sum(reaction_counts.values())
     }
 
 @app.get("/reactions/post/{post_id}/detailed")
-async def get_post_reactions_detailed(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get detailed reactions with user information"""
-    reactions = db.query(Reaction).filter(Reaction.post_id == post_id).all()
-
-    # Group reactions by type with user details
-    reaction_details = {}
-    user_reaction = None
-
-    for reaction in reactions:
-        if reaction.reaction_type not in reaction_details:
-            reaction_details[reaction.reaction_type] = {
-                "count": 0,
-                "users": []
-            }
-
-        reaction_details[reaction.reaction_type]["count"] += 1
-        reaction_details[reaction.reaction_type]["users"].append({
-            "id": reaction.user.id,
-            "first_name": reaction.user.first_name,
-            "last_name": reaction.user.last_name,
-            "avatar": reaction.user.avatar,
-            "created_at": reaction.created_at.isoformat()
-        })
-
-        if reaction.user_id == current_user.id:
-            user_reaction = reaction.reaction_type
+def get_post_reactions_detailed(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Contagem por tipo com os usuários mais recentes de cada um (a lista completa é paginada em /users)"""
+    reaction_counts = post_reaction_counts(db, post_id)
+    reactors = recent_reactors(db, post_id, REACTION_PREVIEW_USERS) if reaction_counts else {}
+
+    reaction_details = {
+        reaction_type: {
+            "count": count,
+            "users": [
+                {
+                    "id": reaction.user.id,
+                    "first_name": reaction.user.first_name,
+                    "last_name": reaction.user.last_name,
+                    "avatar": reaction.user.avatar,
+                    "created_at": reaction.created_at.isoformat()
+                }
+                for reaction in reactors.get(reaction_type, [])
+            ]
+        }
+        for reaction_type, count in reaction_counts.items()
+    }
 
     return {
         "reactions": reaction_details,
-        "user_reaction": user_reaction,
-        "total": len(reactions)
+        "user_reaction": viewer_reaction(db, post_id, current_user.id),
+        "total": sum(reaction_counts.values())
     }
 
+@app.get("/reactions/post/{post_id}/users", response_model=Page[ReactorResponse])
+def get_post_reactors(post_id: int, reaction_type: Optional[str] = None, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Quem reagiu ao post, do mais recente para o mais antigo, opcionalmente de um tipo só"""
+    query = with_related(db.query(Reaction), Reaction.user).filter(Reaction.post_id == post_id)
+    if reaction_type:
+        query = query.filter(Reaction.reaction_type == reaction_type)
+    reactions, next_cursor = paginate(query, Reaction.created_at, Reaction.id, cursor, limit)
+
+    return Page[ReactorResponse](items=[
+        ReactorResponse(
+            user=author_summary(reaction.user),
+            reaction_type=reaction.reaction_type,
+            created_at=reaction.created_at
+        )
+        for reaction in reactions
+    ], next_cursor=next_cursor)
+
 # Comments routes
 @app.post("/comments/", response_model=CommentResponse)
-async def create_comment(comment: CommentCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_comment(comment: CommentCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if post exists
     post = db.query(Post).filter(Post.id == comment.post_id).first()
     if not post:
@@ -1235,93 +2994,57 @@ async def create_comment(comment: CommentCreate, current_user: User = Depends(ge
         author_id=current_user.id
     )
     db.add(db_comment)
+    attach_comment(db, db_comment)
+    bump_counter(db, Post, comment.post_id, Post.comments_count)
     db.commit()
     db.refresh(db_comment)
     
     # Send notification to post author
     if post.author_id != current_user.id:
-        notification = Notification(
-            recipient_id=post.author_id,
-            sender_id=current_user.id,
-            notification_type="comment",
-            title=f"{current_user.first_name} {current_user.last_name}",
-            message="comentou no seu post",
-            data=json.dumps({"post_id": comment.post_id, "comment_id": db_comment.id}),
-            created_at=datetime.utcnow()
-        )
-        db.add(notification)
-        db.commit()
-        
-        # Send real-time notification
-        await manager.send_notification(post.author_id, {
-            "id": notification.id,
-            "type": "comment",
-            "title": f"{current_user.first_name} {current_user.last_name}",
-            "message": "comentou no seu post",
-            "sender": {
-                "id": current_user.id,
-                "first_name": current_user.first_name,
-                "last_name": current_user.last_name,
-                "avatar": getattr(current_user, 'avatar', None)
-            },
-            "data": {"post_id": comment.post_id, "comment_id": db_comment.id},
-            "created_at": notification.created_at.isoformat()
-        })
+        queue_notification(background_tasks, post.author_id, current_user, "comment",
+                           "comentou no seu post", {"post_id": comment.post_id, "comment_id": db_comment.id},
+                           group_key=f"comment:post:{comment.post_id}")
     
     return CommentResponse(
         id=db_comment.id,
         content=db_comment.content,
-        author={
-            "id": db_comment.author.id,
-            "first_name": db_comment.author.first_name,
-            "last_name": db_comment.author.last_name,
-            "avatar": getattr(db_comment.author, 'avatar', None)
-        },
+        author=author_summary(db_comment.author),
         created_at=db_comment.created_at,
         reactions_count=0,
+        parent_id=db_comment.parent_id,
         replies=[]
     )
 
-@app.get("/comments/post/{post_id}", response_model=List[CommentResponse])
-async def get_post_comments(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    comments = db.query(Comment).filter(Comment.post_id == post_id, Comment.parent_id.is_(None)).all()
-    
-    result = []
-    for comment in comments:
-        replies = db.query(Comment).filter(Comment.parent_id == comment.id).all()
-        result.append(CommentResponse(
-            id=comment.id,
-            content=comment.content,
-            author={
-                "id": comment.author.id,
-                "first_name": comment.author.first_name,
-                "last_name": comment.author.last_name,
-                "avatar": getattr(comment.author, 'avatar', None)
-            },
-            created_at=comment.created_at,
-            reactions_count=0,
-            replies=[
-                CommentResponse(
-                    id=reply.id,
-                    content=reply.content,
-                    author={
-                        "id": reply.author.id,
-                        "first_name": reply.author.first_name,
-                        "last_name": reply.author.last_name,
-                        "avatar": getattr(reply.author, 'avatar', None)
-                    },
-                    created_at=reply.created_at,
-                    reactions_count=0,
-                    replies=[]
-                ) for reply in replies
-            ]
-        ))
-    
-    return result
+@app.get("/comments/post/{post_id}", response_model=Page[CommentResponse])
+def get_post_comments(post_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, replies: int = COMMENT_REPLIES_PREVIEW, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Comentários de primeiro nível (cursor) com as primeiras respostas de cada thread"""
+    comments, next_cursor = paginate(
+        with_related(db.query(Comment), Comment.author).filter(Comment.post_id == post_id, Comment.parent_id.is_(None)),
+        Comment.created_at, Comment.id, cursor, limit, descending=False
+    )
+
+    return Page[CommentResponse](
+        items=comment_threads(db, comments, max(0, min(replies, MAX_PAGE_SIZE))),
+        next_cursor=next_cursor
+    )
+
+@app.get("/comments/{comment_id}/replies", response_model=Page[CommentResponse])
+def get_comment_replies(comment_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Respostas diretas de um comentário (cursor), para continuar uma thread além da prévia"""
+    parent = db.query(Comment.post_id).filter(Comment.id == comment_id).first()
+    if not parent:
+        raise HTTPException(status_code=404, detail="Comment not found")
+
+    replies, next_cursor = paginate(
+        with_related(db.query(Comment), Comment.author).filter(Comment.post_id == parent.post_id, Comment.parent_id == comment_id),
+        Comment.created_at, Comment.id, cursor, limit, descending=False
+    )
+
+    return Page[CommentResponse](items=[comment_response(reply) for reply in replies], next_cursor=next_cursor)
 
 # Shares routes
 @app.post("/shares/")
-async def share_post(share: ShareCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def share_post(share: ShareCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if post exists
     post = db.query(Post).filter(Post.id == share.post_id).first()
     if not post:
@@ -1341,13 +3064,14 @@ async def share_post(share: ShareCreate, current_user: User = Depends(get_curren
         post_id=share.post_id
     )
     db.add(db_share)
+    bump_counter(db, Post, share.post_id, Post.shares_count)
     db.commit()
     
     return {"message": "Post shared successfully"}
 
 # Friendships routes
 @app.post("/friendships/")
-async def send_friend_request(friendship: FriendshipCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def send_friend_request(friendship: FriendshipCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if user exists
     addressee = db.query(User).filter(User.id == friendship.addressee_id, User.is_active == True).first()
     if not addressee:
@@ -1357,6 +3081,15 @@ async def send_friend_request(friendship: FriendshipCreate, current_user: User =
     if current_user.id == friendship.addressee_id:
         raise HTTPException(status_code=400, detail="Cannot send friend request to yourself")
     
+    if are_friends(db, current_user.id, friendship.addressee_id):
+        raise HTTPException(status_code=400, detail="Already friends")
+
+    # Respeitar quem pode enviar solicitações ao destinatário
+    if addressee.friend_request_privacy == "none":
+        raise HTTPException(status_code=403, detail="This user is not accepting friend requests")
+    if addressee.friend_request_privacy == "friends_of_friends" and not mutual_friend_count(db, current_user.id, addressee.id):
+        raise HTTPException(status_code=403, detail="Only friends of friends can send a request to this user")
+
     # Check if friendship already exists
     existing_friendship = db.query(Friendship).filter(
         ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == friendship.addressee_id)) |
@@ -1377,40 +3110,17 @@ async def send_friend_request(friendship: FriendshipCreate, current_user: User =
     )
     db.add(db_friendship)
     db.commit()
+    suggestion_cache.delete(current_user.id)
+    suggestion_cache.delete(friendship.addressee_id)
     
     # Send notification
-    notification = Notification(
-        recipient_id=friendship.addressee_id,
-        sender_id=current_user.id,
-        notification_type="friend_request",
-        title=f"{current_user.first_name} {current_user.last_name}",
-        message="enviou uma solicitação de amizade",
-        data=json.dumps({"friendship_id": db_friendship.id}),
-        created_at=datetime.utcnow()
-    )
-    db.add(notification)
-    db.commit()
-    
-    # Send real-time notification
-    await manager.send_notification(friendship.addressee_id, {
-        "id": notification.id,
-        "type": "friend_request",
-        "title": f"{current_user.first_name} {current_user.last_name}",
-        "message": "enviou uma solicitação de amizade",
-        "sender": {
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": getattr(current_user, 'avatar', None)
-        },
-        "data": {"friendship_id": db_friendship.id},
-        "created_at": notification.created_at.isoformat()
-    })
+    queue_notification(background_tasks, friendship.addressee_id, current_user, "friend_request",
+                       "enviou uma solicitação de amizade", {"friendship_id": db_friendship.id})
     
     return {"message": "Friend request sent successfully"}
 
 @app.put("/friendships/{friendship_id}/accept")
-async def accept_friend_request(friendship_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def accept_friend_request(friendship_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     friendship = db.query(Friendship).filter(Friendship.id == friendship_id).first()
     if not friendship:
         raise HTTPException(status_code=404, detail="Friend request not found")
@@ -1424,40 +3134,17 @@ async def accept_friend_request(friendship_id: int, current_user: User = Depends
     friendship.status = "accepted"
     friendship.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_friend_graph(friendship.requester_id, friendship.addressee_id)
+    background_tasks.add_task(sync_timeline_pair, friendship.requester_id, friendship.addressee_id)
     
     # Send notification to requester
-    notification = Notification(
-        recipient_id=friendship.requester_id,
-        sender_id=current_user.id,
-        notification_type="friend_accept",
-        title=f"{current_user.first_name} {current_user.last_name}",
-        message="aceitou sua solicitação de amizade",
-        data=json.dumps({"friendship_id": friendship_id}),
-        created_at=datetime.utcnow()
-    )
-    db.add(notification)
-    db.commit()
-    
-    # Send real-time notification
-    await manager.send_notification(friendship.requester_id, {
-        "id": notification.id,
-        "type": "friend_accept",
-        "title": f"{current_user.first_name} {current_user.last_name}",
-        "message": "aceitou sua solicitação de amizade",
-        "sender": {
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": getattr(current_user, 'avatar', None)
-        },
-        "data": {"friendship_id": friendship_id},
-        "created_at": notification.created_at.isoformat()
-    })
+    queue_notification(background_tasks, friendship.requester_id, current_user, "friend_accept",
+                       "aceitou sua solicitação de amizade", {"friendship_id": friendship_id})
     
     return {"message": "Friend request accepted"}
 
 @app.put("/friendships/{friendship_id}/reject")
-async def reject_friend_request(friendship_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def reject_friend_request(friendship_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     friendship = db.query(Friendship).filter(Friendship.id == friendship_id).first()
     if not friendship:
         raise HTTPException(status_code=404, detail="Friend request not found")
@@ -1471,11 +3158,15 @@ async def reject_friend_request(friendship_id: int, current_user: User = Depends
     friendship.status = "rejected"
     friendship.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_friend_graph(friendship.requester_id, friendship.addressee_id)
     
     return {"message": "Friend request rejected"}
 
 @app.get("/friendships/status/{user_id}")
-async def get_friendship_status(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_friendship_status(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if are_friends(db, current_user.id, user_id):
+        return {"status": "accepted"}
+
     friendship = db.query(Friendship).filter(
         ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == user_id)) |
         ((Friendship.requester_id == user_id) & (Friendship.addressee_id == current_user.id))
@@ -1488,30 +3179,47 @@ async def get_friendship_status(user_id: int, current_user: User = Depends(get_c
 
 # User search
 @app.get("/users/")
-async def search_users(search: str = "", current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def search_users(search: str = "", current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if not search.strip():
         return []
     
-    users = db.query(User).filter(
-        User.is_active == True,
-        User.id != current_user.id,
-        (User.first_name.ilike(f"%{search}%") | User.last_name.ilike(f"%{search}%") | User.email.ilike(f"%{search}%"))
-    ).limit(20).all()
+    # Índice de prefixos sem acentos sobre nome, sobrenome, username e apelido
+    users = search_users_ranked(db, search, current_user.id)
     
-    return [
-        {
-            "id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "avatar": getattr(user, 'avatar', None)
-        }
-        for user in users
-    ]
+    # Só os campos públicos do autor: o email não sai na busca
+    return [author_summary(user) for user in users]
+
+# People you may know
+@app.get("/api/users/suggestions")
+def get_friend_suggestions(limit: int = 20, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Sugestões de amizade: amigos de amigos, por número de amigos em comum"""
+    ranked = friend_suggestions(db, current_user.id)[:max(1, min(limit, FRIEND_SUGGESTIONS_LIMIT))]
+    if not ranked:
+        return []
+
+    users_by_id = {
+        user.id: user
+        for user in db.query(User).filter(User.id.in_([user_id for user_id, _ in ranked]), User.is_active == True)
+    }
+    suggestions = []
+    for user_id, mutual in ranked:
+        user = users_by_id.get(user_id)
+        if user:
+            suggestions.append({
+                "id": user.id,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "username": user.username,
+                "bio": user.bio,
+                "avatar": user.avatar,
+                "location": user.location,
+                "mutual_friends": mutual
+            })
+    return suggestions
 
 # Get user by ID
 @app.get("/users/{user_id}")
-async def get_user_by_id(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_by_id(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1529,27 +3237,18 @@ async def get_user_by_id(user_id: int, current_user: User = Depends(get_current_
 
 # Get user profile with complete information
 @app.get("/users/{user_id}/profile")
-async def get_user_profile(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_profile(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter perfil completo do usuário com configurações de privacidade"""
     user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Verificar se são amigos para mostrar informações privadas
-    friendship = db.query(Friendship).filter(
-        ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == user_id)) |
-        ((Friendship.requester_id == user_id) & (Friendship.addressee_id == current_user.id)),
-        Friendship.status == "accepted"
-    ).first()
-
-    is_friend = friendship is not None
+    is_friend = are_friends(db, current_user.id, user_id)
     is_own_profile = current_user.id == user_id
 
     # Calcular estatísticas
-    friends_count = db.query(Friendship).filter(
-        ((Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id)),
-        Friendship.status == "accepted"
-    ).count()
+    friends_count = count_friends(db, user_id)
 
     posts_count = db.query(Post).filter(Post.author_id == user_id).count()
 
@@ -1600,7 +3299,7 @@ async def get_user_profile(user_id: int, current_user: User = Depends(get_curren
 
 # Get user friends list
 @app.get("/users/{user_id}/friends")
-async def get_user_friends(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_friends(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter lista de amigos do usuário"""
     # Verificar se pode ver a lista de amigos
     user = db.query(User).filter(User.id == user_id).first()
@@ -1610,25 +3309,16 @@ async def get_user_friends(user_id: int, current_user: User = Depends(get_curren
     # Verificar privacidade do perfil
     if user.profile_visibility == "private" and current_user.id != user_id:
         # Verificar se são amigos
-        friendship = db.query(Friendship).filter(
-            ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == user_id)) |
-            ((Friendship.requester_id == user_id) & (Friendship.addressee_id == current_user.id)),
-            Friendship.status == "accepted"
-        ).first()
-
-        if not friendship:
+        if not are_friends(db, current_user.id, user_id):
             raise HTTPException(status_code=403, detail="Cannot view this user's friends list")
 
     # Buscar amigos
-    friendships = db.query(Friendship).filter(
-        ((Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id)),
-        Friendship.status == "accepted"
-    ).all()
+    adjacency = friend_adjacency(db, user_id)
+    friends_by_id = {friend.id: friend for friend in db.query(User).filter(User.id.in_(adjacency.ids)).all()} if adjacency.ids else {}
 
     friends_data = []
-    for friendship in friendships:
-        friend_id = friendship.addressee_id if friendship.requester_id == user_id else friendship.requester_id
-        friend = db.query(User).filter(User.id == friend_id).first()
+    for friend_id in adjacency.ids:
+        friend = friends_by_id.get(friend_id)
 
         if friend:
             friends_data.append({
@@ -1637,14 +3327,14 @@ async def get_user_friends(user_id: int, current_user: User = Depends(get_curren
                 "last_name": friend.last_name,
                 "username": friend.username,
                 "avatar": friend.avatar,
-                "friends_since": friendship.updated_at.isoformat() if friendship.updated_at else friendship.created_at.isoformat()
+                "friends_since": adjacency.since[friend_id]
             })
 
     return friends_data
 
 # Remove friend
 @app.delete("/friends/{friend_id}")
-async def remove_friend(friend_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def remove_friend(friend_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Remover amigo"""
     friendship = db.query(Friendship).filter(
         ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == friend_id)) |
@@ -1657,12 +3347,14 @@ async def remove_friend(friend_id: int, current_user: User = Depends(get_current
 
     db.delete(friendship)
     db.commit()
+    invalidate_friend_graph(current_user.id, friend_id)
+    background_tasks.add_task(sync_timeline_pair, current_user.id, friend_id)
 
     return {"message": "Friend removed successfully"}
 
 # Avatar and cover photo routes
 @app.post("/profile/avatar")
-async def upload_avatar(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def upload_avatar(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Upload e definir avatar do usuário"""
     import os
     import uuid
@@ -1672,40 +3364,29 @@ async def upload_avatar(file: UploadFile = File(...), current_user: User = Depen
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    # Validar tamanho (5MB max para avatar)
-    if file.size > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Image too large (max 5MB)")
-
     try:
-        # Criar diretório se não existe
-        upload_dir = Path("uploads") / "image"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-
-        # Gerar nome único
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"avatar_{current_user.id}_{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-
-        # Salvar arquivo
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Salvar por conteúdo: reenviar a mesma imagem reaproveita o arquivo existente
+        media = store_media(db, file, "image", current_user.id, MAX_AVATAR_SIZE_MB * 1024 * 1024, kind="Image")
 
         # Atualizar avatar do usuário
-        avatar_url = f"/uploads/image/{unique_filename}"
+        avatar_url = media_url(media.file_path)
         current_user.avatar = avatar_url
         current_user.updated_at = datetime.utcnow()
         db.commit()
+        invalidate_user_cache(current_user.email)
+        background_tasks.add_task(generate_media_variants, media.id, "profile_avatar")
 
         return {
             "message": "Avatar updated successfully",
             "avatar_url": avatar_url
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload avatar: {str(e)}")
 
 @app.post("/users/me/avatar")
-async def upload_user_avatar(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def upload_user_avatar(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Upload e definir avatar do usuário (endpoint alternativo)"""
     import os
     import uuid
@@ -1722,31 +3403,14 @@ async def upload_user_avatar(file: UploadFile = File(...), current_user: User =
         print(f"❌ Invalid content type: {file.content_type}")
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    # Validar tamanho (5MB max para avatar)
-    if file.size and file.size > 5 * 1024 * 1024:
-        print(f"❌ File too large: {file.size} bytes")
-        raise HTTPException(status_code=400, detail="Image too large (max 5MB)")
-
     try:
-        # Criar diretório se não existe
-        upload_dir = Path("uploads") / "image"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        print(f"📁 Upload directory: {upload_dir}")
-
-        # Gerar nome único
-        file_extension = Path(file.filename).suffix if file.filename else ".jpg"
-        unique_filename = f"avatar_{current_user.id}_{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        print(f"💾 Saving to: {file_path}")
-
-        # Salvar arquivo
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Salvar por conteúdo: reenviar a mesma imagem reaproveita o arquivo existente
+        media = store_media(db, file, "image", current_user.id, MAX_AVATAR_SIZE_MB * 1024 * 1024, kind="Image")
+        print(f"💾 Stored as: {media.file_path}")
         print(f"✅ File saved successfully")
 
         # Atualizar avatar do usuário
-        avatar_url = f"/uploads/image/{unique_filename}"
+        avatar_url = media_url(media.file_path)
         current_user.avatar = avatar_url
         current_user.updated_at = datetime.utcnow()
 
@@ -1762,6 +3426,9 @@ async def upload_user_avatar(file: UploadFile = File(...), current_user: User =
         )
         db.add(profile_post)
         db.commit()
+        invalidate_user_cache(current_user.email)
+        background_tasks.add_task(fan_out_post, profile_post.id)
+        background_tasks.add_task(generate_media_variants, media.id, "profile_avatar")
         print(f"✅ Database updated with avatar URL: {avatar_url}")
         print(f"✅ Profile update post created")
 
@@ -1770,12 +3437,14 @@ async def upload_user_avatar(file: UploadFile = File(...), current_user: User =
             "avatar_url": avatar_url,
             "post_created": True
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"��� Exception during avatar upload: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upload avatar: {str(e)}")
 
 @app.post("/users/me/cover")
-async def upload_user_cover_photo(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def upload_user_cover_photo(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Upload e definir foto de capa do usuário (endpoint alternativo)"""
     import os
     import uuid
@@ -1792,31 +3461,14 @@ async def upload_user_cover_photo(file: UploadFile = File(...), current_user: Us
         print(f"❌ Invalid content type: {file.content_type}")
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    # Validar tamanho (10MB max para capa)
-    if file.size and file.size > 10 * 1024 * 1024:
-        print(f"❌ File too large: {file.size} bytes")
-        raise HTTPException(status_code=400, detail="Image too large (max 10MB)")
-
     try:
-        # Criar diretório se não existe
-        upload_dir = Path("uploads") / "image"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        print(f"📁 Upload directory: {upload_dir}")
-
-        # Gerar nome único
-        file_extension = Path(file.filename).suffix if file.filename else ".jpg"
-        unique_filename = f"cover_{current_user.id}_{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        print(f"💾 Saving to: {file_path}")
-
-        # Salvar arquivo
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Salvar por conteúdo: reenviar a mesma imagem reaproveita o arquivo existente
+        media = store_media(db, file, "image", current_user.id, MAX_COVER_SIZE_MB * 1024 * 1024, kind="Image")
+        print(f"💾 Stored as: {media.file_path}")
         print(f"✅ File saved successfully")
 
         # Atualizar foto de capa do usuário
-        cover_url = f"/uploads/image/{unique_filename}"
+        cover_url = media_url(media.file_path)
         current_user.cover_photo = cover_url
         current_user.updated_at = datetime.utcnow()
 
@@ -1832,6 +3484,9 @@ async def upload_user_cover_photo(file: UploadFile = File(...), current_user: Us
         )
         db.add(cover_post)
         db.commit()
+        invalidate_user_cache(current_user.email)
+        background_tasks.add_task(fan_out_post, cover_post.id)
+        background_tasks.add_task(generate_media_variants, media.id, "cover_photo")
         print(f"✅ Database updated with cover URL: {cover_url}")
         print(f"✅ Cover update post created")
 
@@ -1840,12 +3495,14 @@ async def upload_user_cover_photo(file: UploadFile = File(...), current_user: Us
             "cover_photo_url": cover_url,
             "post_created": True
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Exception during cover upload: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upload cover photo: {str(e)}")
 
 @app.post("/profile/cover")
-async def upload_cover_photo(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def upload_cover_photo(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Upload e definir foto de capa do usuário"""
     import os
     import uuid
@@ -1855,27 +3512,12 @@ async def upload_cover_photo(file: UploadFile = File(...), current_user: User =
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    # Validar tamanho (10MB max para capa)
-    if file.size > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Image too large (max 10MB)")
-
     try:
-        # Criar diretório se não existe
-        upload_dir = Path("uploads") / "image"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-
-        # Gerar nome único
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"cover_{current_user.id}_{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-
-        # Salvar arquivo
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Salvar por conteúdo: reenviar a mesma imagem reaproveita o arquivo existente
+        media = store_media(db, file, "image", current_user.id, MAX_COVER_SIZE_MB * 1024 * 1024, kind="Image")
 
         # Atualizar foto de capa do usuário
-        cover_url = f"/uploads/image/{unique_filename}"
+        cover_url = media_url(media.file_path)
         current_user.cover_photo = cover_url
         current_user.updated_at = datetime.utcnow()
 
@@ -1891,18 +3533,23 @@ async def upload_cover_photo(file: UploadFile = File(...), current_user: User =
         )
         db.add(cover_post)
         db.commit()
+        invalidate_user_cache(current_user.email)
+        background_tasks.add_task(fan_out_post, cover_post.id)
+        background_tasks.add_task(generate_media_variants, media.id, "cover_photo")
 
         return {
             "message": "Cover photo updated successfully",
             "cover_photo_url": cover_url,
             "post_created": True
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload cover photo: {str(e)}")
 
 # Mark all notifications as read
 @app.put("/notifications/mark-all-read")
-async def mark_all_notifications_as_read(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def mark_all_notifications_as_read(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     db.query(Notification).filter(
         Notification.recipient_id == current_user.id,
         Notification.is_read == False
@@ -1913,7 +3560,7 @@ async def mark_all_notifications_as_read(current_user: User = Depends(get_curren
 
 # Delete notification
 @app.delete("/notifications/{notification_id}")
-async def delete_notification(notification_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_notification(notification_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     notification = db.query(Notification).filter(
         Notification.id == notification_id,
         Notification.recipient_id == current_user.id
@@ -1929,7 +3576,7 @@ async def delete_notification(notification_id: int, current_user: User = Depends
 
 # Delete post
 @app.delete("/posts/{post_id}")
-async def delete_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     post = db.query(Post).filter(Post.id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
@@ -1939,8 +3586,10 @@ async def delete_post(post_id: int, current_user: User = Depends(get_current_use
     
     # Delete related data
     db.query(Reaction).filter(Reaction.post_id == post_id).delete()
+    db.query(PostReactionCount).filter(PostReactionCount.post_id == post_id).delete()
     db.query(Comment).filter(Comment.post_id == post_id).delete()
     db.query(Share).filter(Share.post_id == post_id).delete()
+    db.query(TimelineEntry).filter(TimelineEntry.post_id == post_id).delete()
     
     db.delete(post)
     db.commit()
@@ -1949,7 +3598,7 @@ async def delete_post(post_id: int, current_user: User = Depends(get_current_use
 
 # Stories routes
 @app.post("/stories/", response_model=StoryResponse)
-async def create_story(story: StoryCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_story(story: StoryCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Validação especial para vídeos - máximo 25 segundos
     if story.media_type == "video" and story.max_duration_seconds > 25:
         raise HTTPException(status_code=400, detail="Video stories cannot exceed 25 seconds")
@@ -1970,15 +3619,12 @@ async def create_story(story: StoryCreate, current_user: User = Depends(get_curr
     db.add(db_story)
     db.commit()
     db.refresh(db_story)
+    author_story_cache.delete(current_user.id)
+    story_expiry_heap.push(db_story.expires_at, db_story.id)
     
     return StoryResponse(
         id=db_story.id,
-        author={
-            "id": db_story.author.id,
-            "first_name": db_story.author.first_name,
-            "last_name": db_story.author.last_name,
-            "avatar": None
-        },
+        author=author_summary(db_story.author),
         content=db_story.content,
         media_type=db_story.media_type,
         media_url=db_story.media_url,
@@ -1989,58 +3635,34 @@ async def create_story(story: StoryCreate, current_user: User = Depends(get_curr
     )
 
 @app.get("/stories/", response_model=List[StoryResponse])
-async def get_stories(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Get stories that haven't expired
-    now = datetime.utcnow()
-    stories = db.query(Story).filter(Story.expires_at > now).order_by(Story.created_at.desc()).all()
-    
-    return [
-        StoryResponse(
-            id=story.id,
-            author={
-                "id": story.author.id,
-                "first_name": story.author.first_name,
-                "last_name": story.author.last_name,
-                "avatar": None
-            },
-            content=story.content,
-            media_type=story.media_type,
-            media_url=story.media_url,
-            background_color=story.background_color,
-            created_at=story.created_at,
-            expires_at=story.expires_at,
-            views_count=db.query(StoryView).filter(StoryView.story_id == story.id).count()
-        )
-        for story in stories
-    ]
+def get_stories(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Stories ativos visíveis ao usuário (amigos, seguidos e os próprios), mais recentes primeiro"""
+    stories = [story for entry in build_story_tray(db, current_user.id) for story in entry.stories]
+    stories.sort(key=lambda story: (story.created_at, story.id), reverse=True)
+    return [StoryResponse(**story.model_dump(exclude={"seen"})) for story in stories]
+
+@app.get("/stories/tray", response_model=List[StoryTrayEntry])
+def get_story_tray(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Bandeja de stories: um grupo por autor com o estado "visto" do usuário"""
+    return build_story_tray(db, current_user.id)
 
 @app.post("/stories/{story_id}/view")
-async def view_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    story = db.query(Story).filter(Story.id == story_id).first()
-    if not story:
+def view_story(story_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    expires_at = db.query(Story.expires_at).filter(Story.id == story_id).scalar()
+    if expires_at is None:
         raise HTTPException(status_code=404, detail="Story not found")
     
-    if story.expires_at <= datetime.utcnow():
+    if expires_at <= datetime.utcnow():
         raise HTTPException(status_code=410, detail="Story has expired")
     
-    # Check if already viewed
-    existing_view = db.query(StoryView).filter(
-        StoryView.story_id == story_id,
-        StoryView.viewer_id == current_user.id
-    ).first()
-    
-    if not existing_view:
-        db_view = StoryView(
-            story_id=story_id,
-            viewer_id=current_user.id
-        )
-        db.add(db_view)
-        db.commit()
+    # Gravação em lote (chave única story_id + viewer_id): repetições viram uma linha só
+    if record_story_view(current_user.id, story_id):
+        background_tasks.add_task(flush_story_views)
     
     return {"message": "Story viewed"}
 
 @app.delete("/stories/{story_id}")
-async def delete_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
@@ -2054,12 +3676,13 @@ async def delete_story(story_id: int, current_user: User = Depends(get_current_u
     # Delete the story
     db.delete(story)
     db.commit()
+    author_story_cache.delete(current_user.id)
     
     return {"message": "Story deleted successfully"}
 
 # Advanced Story Editor routes
 @app.post("/stories/with-editor", response_model=StoryResponse)
-async def create_story_with_editor(story_data: StoryWithEditor, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_story_with_editor(story_data: StoryWithEditor, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Criar story com editor mobile completo (tags, overlays, etc.)"""
     # Validação especial para vídeos - máximo 25 segundos
     if story_data.media_type == "video" and story_data.max_duration_seconds > 25:
@@ -2081,8 +3704,11 @@ async def create_story_with_editor(story_data: StoryWithEditor, current_user: Us
     db.add(db_story)
     db.commit()
     db.refresh(db_story)
+    author_story_cache.delete(current_user.id)
+    story_expiry_heap.push(db_story.expires_at, db_story.id)
 
     # Adicionar tags
+    tagged_ids = []
     for tag_data in story_data.tags:
         # Verificar se usuário tagueado existe
         tagged_user = db.query(User).filter(User.id == tag_data.tagged_user_id).first()
@@ -2095,18 +3721,9 @@ async def create_story_with_editor(story_data: StoryWithEditor, current_user: Us
             )
             db.add(story_tag)
 
-            # Notificar usuário tagueado
+            # Notificar usuário tagueado (depois do commit)
             if tagged_user.story_notifications:
-                notification = Notification(
-                    recipient_id=tag_data.tagged_user_id,
-                    sender_id=current_user.id,
-                    notification_type="story_tag",
-                    title=f"{current_user.first_name} {current_user.last_name}",
-                    message="marcou você em um story",
-                    data=json.dumps({"story_id": db_story.id}),
-                    created_at=datetime.utcnow()
-                )
-                db.add(notification)
+                tagged_ids.append(tag_data.tagged_user_id)
 
     # Adicionar overlays
     for overlay_data in story_data.overlays:
@@ -2125,15 +3742,13 @@ async def create_story_with_editor(story_data: StoryWithEditor, current_user: Us
         db.add(story_overlay)
 
     db.commit()
+    for tagged_id in tagged_ids:
+        queue_notification(background_tasks, tagged_id, current_user, "story_tag",
+                           "marcou você em um story", {"story_id": db_story.id})
 
     return StoryResponse(
         id=db_story.id,
-        author={
-            "id": db_story.author.id,
-            "first_name": db_story.author.first_name,
-            "last_name": db_story.author.last_name,
-            "avatar": db_story.author.avatar
-        },
+        author=author_summary(db_story.author),
         content=db_story.content,
         media_type=db_story.media_type,
         media_url=db_story.media_url,
@@ -2144,7 +3759,7 @@ async def create_story_with_editor(story_data: StoryWithEditor, current_user: Us
     )
 
 @app.post("/stories/{story_id}/tags")
-async def add_story_tag(story_id: int, tag_data: StoryTagCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def add_story_tag(story_id: int, tag_data: StoryTagCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Adicionar tag a um story existente"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2180,7 +3795,7 @@ async def add_story_tag(story_id: int, tag_data: StoryTagCreate, current_user: U
     return {"message": "User tagged successfully"}
 
 @app.post("/stories/{story_id}/overlays")
-async def add_story_overlay(story_id: int, overlay_data: StoryOverlayCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def add_story_overlay(story_id: int, overlay_data: StoryOverlayCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Adicionar overlay a um story existente"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2207,7 +3822,7 @@ async def add_story_overlay(story_id: int, overlay_data: StoryOverlayCreate, cur
     return {"message": "Overlay added successfully"}
 
 @app.get("/stories/{story_id}/details")
-async def get_story_details(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_story_details(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter detalhes completos do story incluindo tags e overlays"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2218,16 +3833,11 @@ async def get_story_details(story_id: int, current_user: User = Depends(get_curr
         raise HTTPException(status_code=410, detail="Story has expired")
 
     # Buscar tags
-    tags = db.query(StoryTag).filter(StoryTag.story_id == story_id).all()
+    tags = with_related(db.query(StoryTag), StoryTag.tagged_user).filter(StoryTag.story_id == story_id).all()
     tag_data = [
         {
             "id": tag.id,
-            "tagged_user": {
-                "id": tag.tagged_user.id,
-                "first_name": tag.tagged_user.first_name,
-                "last_name": tag.tagged_user.last_name,
-                "avatar": tag.tagged_user.avatar
-            },
+            "tagged_user": author_summary(tag.tagged_user),
             "position_x": tag.position_x,
             "position_y": tag.position_y
         }
@@ -2254,12 +3864,7 @@ async def get_story_details(story_id: int, current_user: User = Depends(get_curr
 
     return {
         "id": story.id,
-        "author": {
-            "id": story.author.id,
-            "first_name": story.author.first_name,
-            "last_name": story.author.last_name,
-            "avatar": story.author.avatar
-        },
+        "author": author_summary(story.author),
         "content": story.content,
         "media_type": story.media_type,
         "media_url": story.media_url,
@@ -2267,19 +3872,20 @@ async def get_story_details(story_id: int, current_user: User = Depends(get_curr
         "max_duration_seconds": story.max_duration_seconds,
         "created_at": story.created_at,
         "expires_at": story.expires_at,
-        "views_count": db.query(StoryView).filter(StoryView.story_id == story_id).count(),
+        "views_count": story.views_count or 0,
         "tags": tag_data,
         "overlays": overlay_data
     }
 
 # Notifications routes
-@app.get("/notifications/", response_model=List[NotificationResponse])
-async def get_notifications(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    notifications = db.query(Notification).filter(
-        Notification.recipient_id == current_user.id
-    ).order_by(Notification.created_at.desc()).limit(50).all()
+@app.get("/notifications/", response_model=Page[NotificationResponse])
+def get_notifications(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    notifications, next_cursor = paginate(
+        with_related(db.query(Notification), Notification.sender).filter(Notification.recipient_id == current_user.id),
+        Notification.created_at, Notification.id, cursor, limit
+    )
     
-    return [
+    return Page[NotificationResponse](items=[
         NotificationResponse(
             id=notification.id,
             notification_type=notification.notification_type,
@@ -2291,13 +3897,15 @@ async def get_notifications(current_user: User = Depends(get_current_user), db:
             sender={
                 "id": notification.sender.id,
                 "name": f"{notification.sender.first_name} {notification.sender.last_name}"
-            } if notification.sender else None
+            } if notification.sender else None,
+            actor_count=notification.actor_count or 1,
+            actor_ids=json.loads(notification.actor_ids) if notification.actor_ids else []
         )
         for notification in notifications
-    ]
+    ], next_cursor=next_cursor)
 
 @app.get("/notifications/unread-count")
-async def get_unread_notifications_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_unread_notifications_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     count = db.query(Notification).filter(
         Notification.recipient_id == current_user.id,
         Notification.is_read == False
@@ -2306,7 +3914,7 @@ async def get_unread_notifications_count(current_user: User = Depends(get_curren
     return {"count": count}
 
 @app.put("/notifications/{notification_id}/read")
-async def mark_notification_as_read(notification_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def mark_notification_as_read(notification_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     notification = db.query(Notification).filter(
         Notification.id == notification_id,
         Notification.recipient_id == current_user.id
@@ -2322,7 +3930,7 @@ async def mark_notification_as_read(notification_id: int, current_user: User = D
 
 # Friendships routes
 @app.get("/friendships/pending-count")
-async def get_pending_friendships_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_pending_friendships_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     count = db.query(Friendship).filter(
         Friendship.addressee_id == current_user.id,
         Friendship.status == "pending"
@@ -2331,8 +3939,8 @@ async def get_pending_friendships_count(current_user: User = Depends(get_current
     return {"count": count}
 
 @app.get("/friendships/pending")
-async def get_pending_friendships(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    friendships = db.query(Friendship).filter(
+def get_pending_friendships(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    friendships = with_related(db.query(Friendship), Friendship.requester).filter(
         Friendship.addressee_id == current_user.id,
         Friendship.status == "pending"
     ).all()
@@ -2340,12 +3948,7 @@ async def get_pending_friendships(current_user: User = Depends(get_current_user)
     return [
         {
             "id": friendship.id,
-            "requester": {
-                "id": friendship.requester.id,
-                "first_name": friendship.requester.first_name,
-                "last_name": friendship.requester.last_name,
-                "avatar": None
-            },
+            "requester": author_summary(friendship.requester),
             "created_at": friendship.created_at
         }
         for friendship in friendships
@@ -2353,17 +3956,14 @@ async def get_pending_friendships(current_user: User = Depends(get_current_user)
 
 # Settings and Profile routes
 @app.put("/profile/")
-async def update_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Atualizar perfil do usuário"""
     update_data = profile_data.dict(exclude_unset=True)
+    previous_email = current_user.email
 
     # Verificar se username é único (se fornecido)
     if "username" in update_data and update_data["username"]:
-        existing_user = db.query(User).filter(
-            User.username == update_data["username"],
-            User.id != current_user.id
-        ).first()
-        if existing_user:
+        if taken_usernames(db, [update_data["username"]], exclude_id=current_user.id, use_filter=False):
             raise HTTPException(status_code=400, detail="Username already taken")
 
     # Atualizar campos
@@ -2381,19 +3981,29 @@ async def update_profile(profile_data: UserProfileUpdate, current_user: User = D
                 value = None
         setattr(current_user, field, value)
 
+    if update_data.keys() & {"first_name", "last_name", "username", "nickname"}:
+        index_user_search_terms(db, current_user)
+
     current_user.updated_at = datetime.utcnow()
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Username gravado por outra requisição depois da verificação
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Username already taken")
+    invalidate_user_cache(previous_email, current_user.email)
+    remember_taken(current_user)
     db.refresh(current_user)
 
     return {"message": "Profile updated successfully"}
 
 @app.put("/settings/profile")
-async def update_settings_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_settings_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Atualizar perfil do usuário (endpoint alternativo)"""
-    return await update_profile(profile_data, current_user, db)
+    return update_profile(profile_data, current_user, db)
 
 @app.put("/settings/password")
-async def update_password(password_data: PasswordUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_password(password_data: PasswordUpdate, current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Alterar senha do usuário"""
     if not verify_password(password_data.current_password, current_user.password_hash):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
@@ -2405,6 +4015,7 @@ async def update_password(password_data: PasswordUpdate, current_user: User = De
     current_user.password_hash = hash_password(password_data.new_password)
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_user_cache(current_user.email)
     db.refresh(current_user)
 
     return {"message": "Password updated successfully"}
@@ -2423,7 +4034,7 @@ async def get_privacy_settings(current_user: User = Depends(get_current_user)):
     }
 
 @app.put("/settings/privacy")
-async def update_privacy_settings(privacy_data: PrivacySettings, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_privacy_settings(privacy_data: PrivacySettings, current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Atualizar configurações de privacidade"""
     update_data = privacy_data.dict(exclude_unset=True)
 
@@ -2441,6 +4052,9 @@ async def update_privacy_settings(privacy_data: PrivacySettings, current_user: U
 
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_user_cache(current_user.email)
+    if "story_visibility" in update_data:
+        author_story_cache.delete(current_user.id)
 
     return {"message": "Privacy settings updated successfully"}
 
@@ -2458,7 +4072,7 @@ async def get_notification_settings(current_user: User = Depends(get_current_use
     }
 
 @app.put("/settings/notifications")
-async def update_notification_settings(notification_data: NotificationSettings, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_notification_settings(notification_data: NotificationSettings, current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Atualizar configurações de notificação"""
     update_data = notification_data.dict(exclude_unset=True)
 
@@ -2467,23 +4081,26 @@ async def update_notification_settings(notification_data: NotificationSettings,
 
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_user_cache(current_user.email)
 
     return {"message": "Notification settings updated successfully"}
 
 @app.delete("/account/deactivate")
-async def deactivate_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def deactivate_account(current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Desativar conta do usuário"""
     current_user.account_deactivated = True
     current_user.deactivated_at = datetime.utcnow()
     current_user.is_active = False
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_user_cache(current_user.email)
 
     return {"message": "Account deactivated successfully"}
 
 @app.delete("/account/delete")
-async def delete_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_account(current_user: User = Depends(get_current_user_for_update), db: Session = Depends(get_db)):
     """Deletar conta permanentemente (soft delete)"""
+    previous_email = current_user.email
     # Soft delete - manter dados mas marcar como deletado
     current_user.account_deactivated = True
     current_user.deactivated_at = datetime.utcnow()
@@ -2491,12 +4108,13 @@ async def delete_account(current_user: User = Depends(get_current_user), db: Ses
     current_user.email = f"deleted_{current_user.id}_{current_user.email}"  # Permitir reuso do email
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_user_cache(previous_email, current_user.email)
 
     return {"message": "Account deleted successfully"}
 
 # Messages routes
 @app.post("/messages/", response_model=MessageResponse)
-async def send_message(message_data: MessageCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def send_message(message_data: MessageCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Enviar mensagem"""
     # Verificar se destinatário existe
     recipient = db.query(User).filter(User.id == message_data.recipient_id, User.is_active == True).first()
@@ -2521,48 +4139,20 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
         media_metadata=message_data.media_metadata
     )
     db.add(db_message)
+    db.flush()
+    record_conversation_message(db, db_message)
     db.commit()
     db.refresh(db_message)
 
     # Enviar notificação em tempo real se o usuário quiser receber
     if recipient.message_notifications:
-        notification = Notification(
-            recipient_id=message_data.recipient_id,
-            sender_id=current_user.id,
-            notification_type="message",
-            title=f"{current_user.first_name} {current_user.last_name}",
-            message="enviou uma mensagem",
-            data=json.dumps({"message_id": db_message.id}),
-            created_at=datetime.utcnow()
-        )
-        db.add(notification)
-        db.commit()
-
-        # Enviar via WebSocket
-        await manager.send_notification(message_data.recipient_id, {
-            "id": notification.id,
-            "type": "message",
-            "title": f"{current_user.first_name} {current_user.last_name}",
-            "message": "enviou uma mensagem",
-            "sender": {
-                "id": current_user.id,
-                "first_name": current_user.first_name,
-                "last_name": current_user.last_name,
-                "avatar": current_user.avatar
-            },
-            "data": {"message_id": db_message.id},
-            "created_at": notification.created_at.isoformat()
-        })
+        queue_notification(background_tasks, message_data.recipient_id, current_user, "message",
+                           "enviou uma mensagem", {"message_id": db_message.id})
 
     # Enviar mensagem em tempo real via WebSocket (independente das configurações de notificação)
-    await manager.send_message(message_data.recipient_id, {
+    background_tasks.add_task(manager.send_message, message_data.recipient_id, {
         "id": db_message.id,
-        "sender": {
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": current_user.avatar
-        },
+        "sender": author_summary(current_user),
         "content": db_message.content,
         "message_type": db_message.message_type,
         "media_url": db_message.media_url,
@@ -2572,18 +4162,8 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
 
     return MessageResponse(
         id=db_message.id,
-        sender={
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": current_user.avatar
-        },
-        recipient={
-            "id": recipient.id,
-            "first_name": recipient.first_name,
-            "last_name": recipient.last_name,
-            "avatar": recipient.avatar
-        },
+        sender=author_summary(current_user),
+        recipient=author_summary(recipient),
         content=db_message.content,
         message_type=db_message.message_type,
         media_url=db_message.media_url,
@@ -2592,22 +4172,20 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
     )
 
 @app.get("/messages/conversation/{user_id}")
-async def get_conversation(user_id: int, limit: int = 50, offset: int = 0, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Obter conversação com um usuário específico"""
-    messages = db.query(Message).filter(
-        ((Message.sender_id == current_user.id) & (Message.recipient_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.recipient_id == current_user.id))
-    ).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()
+def get_conversation(user_id: int, cursor: Optional[str] = None, limit: int = 50, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Obter conversação com um usuário específico (next_cursor aponta para mensagens mais antigas)"""
+    messages, next_cursor = paginate(
+        with_related(db.query(Message), Message.sender).filter(
+            ((Message.sender_id == current_user.id) & (Message.recipient_id == user_id)) |
+            ((Message.sender_id == user_id) & (Message.recipient_id == current_user.id))
+        ),
+        Message.created_at, Message.id, cursor, limit
+    )
 
-    return [
+    items = [
         {
             "id": msg.id,
-            "sender": {
-                "id": msg.sender.id,
-                "first_name": msg.sender.first_name,
-                "last_name": msg.sender.last_name,
-                "avatar": msg.sender.avatar
-            },
+            "sender": author_summary(msg.sender),
             "content": msg.content,
             "message_type": msg.message_type,
             "media_url": msg.media_url,
@@ -2617,62 +4195,36 @@ async def get_conversation(user_id: int, limit: int = 50, offset: int = 0, curre
         }
         for msg in reversed(messages)
     ]
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.get("/messages/conversations")
-async def get_conversations(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Obter lista de conversações"""
-    # Buscar últimas mensagens de cada conversação
-    subquery = db.query(
-        Message.id,
-        Message.sender_id,
-        Message.recipient_id,
-        Message.content,
-        Message.message_type,
-        Message.is_read,
-        Message.created_at
-    ).filter(
-        (Message.sender_id == current_user.id) | (Message.recipient_id == current_user.id)
-    ).order_by(Message.created_at.desc()).subquery()
-
-    # Agrupar por conversa e pegar a mais recente
-    conversations = db.query(subquery).all()
-
-    conversation_dict = {}
-    for msg in conversations:
-        other_user_id = msg.recipient_id if msg.sender_id == current_user.id else msg.sender_id
-
-        if other_user_id not in conversation_dict:
-            other_user = db.query(User).filter(User.id == other_user_id).first()
-            conversation_dict[other_user_id] = {
-                "user": {
-                    "id": other_user.id,
-                    "first_name": other_user.first_name,
-                    "last_name": other_user.last_name,
-                    "avatar": other_user.avatar
-                },
-                "last_message": {
-                    "content": msg.content,
-                    "message_type": msg.message_type,
-                    "created_at": msg.created_at,
-                    "is_read": msg.is_read,
-                    "is_own": msg.sender_id == current_user.id
-                },
-                "unread_count": 0
-            }
-
-    # Contar mensagens não lidas
-    for conv_id in conversation_dict:
-        unread_count = db.query(Message).filter(
-            Message.sender_id == conv_id,
-            Message.recipient_id == current_user.id,
-            Message.is_read == False
-        ).count()
-        conversation_dict[conv_id]["unread_count"] = unread_count
+def get_conversations(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Obter lista de conversações (mais recentes primeiro)"""
+    conversations, next_cursor = paginate(
+        with_related(db.query(Conversation), Conversation.partner, Conversation.last_message).filter(
+            Conversation.owner_id == current_user.id
+        ),
+        Conversation.last_activity, Conversation.id, cursor, limit
+    )
 
-    return list(conversation_dict.values())
+    items = []
+    for conversation in conversations:
+        msg = conversation.last_message
+        items.append({
+            "user": author_summary(conversation.partner),
+            "last_message": {
+                "content": msg.content,
+                "message_type": msg.message_type,
+                "created_at": msg.created_at,
+                "is_read": msg.is_read,
+                "is_own": msg.sender_id == current_user.id
+            } if msg else None,
+            "unread_count": conversation.unread_count
+        })
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.put("/messages/{message_id}/read")
-async def mark_message_as_read(message_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def mark_message_as_read(message_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Marcar mensagem como lida"""
     message = db.query(Message).filter(
         Message.id == message_id,
@@ -2682,15 +4234,17 @@ async def mark_message_as_read(message_id: int, current_user: User = Depends(get
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    message.is_read = True
-    message.updated_at = datetime.utcnow()
-    db.commit()
+    if not message.is_read:
+        message.is_read = True
+        message.updated_at = datetime.utcnow()
+        mark_conversation_read(db, current_user.id, message.sender_id)
+        db.commit()
 
     return {"message": "Message marked as read"}
 
 # Block and Follow routes
 @app.post("/blocks/")
-async def block_user(block_data: BlockCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def block_user(block_data: BlockCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Bloquear usuário"""
     if current_user.id == block_data.blocked_id:
         raise HTTPException(status_code=400, detail="Cannot block yourself")
@@ -2735,11 +4289,13 @@ async def block_user(block_data: BlockCreate, current_user: User = Depends(get_c
         db.delete(follow)
 
     db.commit()
+    invalidate_friend_graph(current_user.id, block_data.blocked_id)
+    background_tasks.add_task(sync_timeline_pair, current_user.id, block_data.blocked_id)
 
     return {"message": "User blocked successfully"}
 
 @app.delete("/blocks/{block_id}")
-async def unblock_user(block_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def unblock_user(block_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Desbloquear usuário"""
     block = db.query(Block).filter(
         Block.id == block_id,
@@ -2749,25 +4305,22 @@ async def unblock_user(block_id: int, current_user: User = Depends(get_current_u
     if not block:
         raise HTTPException(status_code=404, detail="Block not found")
 
+    blocked_id = block.blocked_id
     db.delete(block)
     db.commit()
+    background_tasks.add_task(sync_timeline_pair, current_user.id, blocked_id)
 
     return {"message": "User unblocked successfully"}
 
 @app.get("/blocks/")
-async def get_blocked_users(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_blocked_users(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter lista de usuários bloqueados"""
-    blocks = db.query(Block).filter(Block.blocker_id == current_user.id).all()
+    blocks = with_related(db.query(Block), Block.blocked).filter(Block.blocker_id == current_user.id).all()
 
     return [
         {
             "id": block.id,
-            "blocked_user": {
-                "id": block.blocked.id,
-                "first_name": block.blocked.first_name,
-                "last_name": block.blocked.last_name,
-                "avatar": block.blocked.avatar
-            },
+            "blocked_user": author_summary(block.blocked),
             "created_at": block.created_at
         }
         for block in blocks
@@ -2775,7 +4328,7 @@ async def get_blocked_users(current_user: User = Depends(get_current_user), db:
 
 # Stories archive routes
 @app.put("/stories/{story_id}/archive")
-async def archive_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def archive_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Arquivar story"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2787,11 +4340,12 @@ async def archive_story(story_id: int, current_user: User = Depends(get_current_
     story.archived = True
     story.archived_at = datetime.utcnow()
     db.commit()
+    author_story_cache.delete(current_user.id)
 
     return {"message": "Story archived successfully"}
 
 @app.get("/stories/archived")
-async def get_archived_stories(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_archived_stories(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter stories arquivados"""
     stories = db.query(Story).filter(
         Story.author_id == current_user.id,
@@ -2807,12 +4361,31 @@ async def get_archived_stories(current_user: User = Depends(get_current_user), d
             "background_color": story.background_color,
             "created_at": story.created_at,
             "archived_at": story.archived_at,
-            "views_count": db.query(StoryView).filter(StoryView.story_id == story.id).count()
+            "views_count": story.views_count or 0
         }
         for story in stories
     ]
 
 # WebSocket endpoint
+def mark_message_read_from_socket(message_id: int, user_id: int):
+    """Marcar como lida (executado no threadpool); retorna (remetente, horário) se mudou"""
+    db = SessionLocal()
+    try:
+        msg = db.query(Message).filter(
+            Message.id == message_id,
+            Message.recipient_id == user_id
+        ).first()
+
+        if not msg or msg.is_read:
+            return None
+        msg.is_read = True
+        msg.updated_at = datetime.utcnow()
+        mark_conversation_read(db, user_id, msg.sender_id)
+        db.commit()
+        return msg.sender_id, msg.updated_at
+    finally:
+        db.close()
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     # Get token from query parameters
@@ -2824,12 +4397,12 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
         return
     
     # Verify token
-    user = verify_websocket_token(token)
+    user = await run_in_threadpool(verify_websocket_token, token)
     if not user or user.id != user_id:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
-    await manager.connect(websocket, user_id)
+    connection = await manager.connect(websocket, user_id)
     try:
         while True:
             data = await websocket.receive_text()
@@ -2852,121 +4425,106 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                     # Marcar mensagem como lida
                     message_id = message_data.get('message_id')
                     if message_id:
-                        db = SessionLocal()
-                        try:
-                            msg = db.query(Message).filter(
-                                Message.id == message_id,
-                                Message.recipient_id == user_id
-                            ).first()
-
-                            if msg and not msg.is_read:
-                                msg.is_read = True
-                                msg.updated_at = datetime.utcnow()
-                                db.commit()
-
-                                # Notificar remetente
-                                await manager.send_message_read(msg.sender_id, {
-                                    "message_id": message_id,
-                                    "read_by": user_id,
-                                    "read_at": msg.updated_at.isoformat()
-                                })
-                        finally:
-                            db.close()
+                        receipt = await run_in_threadpool(mark_message_read_from_socket, message_id, user_id)
+                        if receipt:
+                            # Notificar remetente
+                            sender_id, read_at = receipt
+                            await manager.send_message_read(sender_id, {
+                                "message_id": message_id,
+                                "read_by": user_id,
+                                "read_at": read_at.isoformat()
+                            })
 
                 elif message_type == 'heartbeat':
                     # Manter conexão viva
-                    await websocket.send_text(json.dumps({"type": "pong"}))
+                    connection.send(json.dumps({"type": "pong"}))
 
             except json.JSONDecodeError:
                 # Se não for JSON válido, tratar como texto simples
                 await manager.send_personal_message(f"Echo: {data}", user_id)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
+        pass
+    finally:
+        await manager.disconnect(connection, user_id)
 
 # Media upload routes
 @app.post("/upload/media", response_model=MediaUploadResponse)
-async def upload_media(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def upload_media(background_tasks: BackgroundTasks, file: UploadFile = File(...), context: str = "post_image", current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Upload de arquivos de mídia"""
-    import os
-    import uuid
-    from pathlib import Path
-
     # Validar tipo de arquivo
-    allowed_types = {
-        "image": ["image/jpeg", "image/png", "image/gif", "image/webp"],
-        "video": ["video/mp4", "video/webm", "video/avi", "video/mov"],
-        "audio": ["audio/mp3", "audio/wav", "audio/ogg", "audio/m4a"],
-        "document": ["application/pdf", "text/plain", "application/msword"]
-    }
-
-    file_type = None
-    for ftype, mimes in allowed_types.items():
-        if file.content_type in mimes:
-            file_type = ftype
-            break
-
+    file_type = media_type_for(file.content_type)
     if not file_type:
         raise HTTPException(status_code=400, detail="File type not supported")
+    if context not in MEDIA_CONTEXTS:
+        raise HTTPException(status_code=400, detail="Invalid media context")
 
-    # Validar tamanho (100MB max)
-    if file.size > 100 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large (max 100MB)")
-
-    # Criar diretório se não existe
-    upload_dir = Path("uploads") / file_type
-    upload_dir.mkdir(parents=True, exist_ok=True)
-
-    # Gerar nome único
-    file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = upload_dir / unique_filename
-
-    # Salvar arquivo
+    # Salvar por conteúdo (limite de 100MB verificado durante a cópia)
     try:
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        db_media = store_media(db, file, file_type, current_user.id, MAX_MEDIA_SIZE_MB * 1024 * 1024)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
-    # Salvar no banco
+    db.commit()
+    db.refresh(db_media)
+    # Miniaturas e tamanhos intermediários são gerados depois da resposta
+    background_tasks.add_task(generate_media_variants, db_media.id, context)
+    return media_upload_response(db_media)
+
+@app.post("/upload/media/by-hash", response_model=MediaUploadResponse)
+def upload_media_by_hash(upload: MediaHashUpload, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Reenvio instantâneo: registrar mídia cujo conteúdo (SHA-256) já está armazenado"""
+    file_type = media_type_for(upload.mime_type)
+    if not file_type:
+        raise HTTPException(status_code=400, detail="File type not supported")
+
+    blob = reference_blob(db, upload.sha256.lower())
+    if not blob:
+        raise HTTPException(status_code=404, detail="Content not found, upload the file")
+
     db_media = MediaFile(
-        filename=unique_filename,
-        original_filename=file.filename,
-        file_path=str(file_path),
-        file_size=file.size,
-        mime_type=file.content_type,
+        filename=Path(blob.file_path).name,
+        original_filename=upload.filename,
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        mime_type=upload.mime_type,
         file_type=file_type,
-        uploaded_by=current_user.id
+        uploaded_by=current_user.id,
+        blob_id=blob.id
     )
     db.add(db_media)
     db.commit()
     db.refresh(db_media)
+    return media_upload_response(db_media)
+
+@app.delete("/upload/media/{media_id}")
+def delete_media(media_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Remover mídia enviada; o arquivo é apagado quando nenhum upload o referencia mais"""
+    media = db.query(MediaFile).filter(
+        MediaFile.id == media_id,
+        MediaFile.uploaded_by == current_user.id
+    ).first()
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    release_media(db, media)
+    db.commit()
+    return {"message": "Media deleted successfully"}
 
+def media_upload_response(media: MediaFile) -> MediaUploadResponse:
     return MediaUploadResponse(
-        id=db_media.id,
-        filename=db_media.filename,
-        file_path=f"/uploads/{file_type}/{unique_filename}",
-        file_type=db_media.file_type,
-        file_size=db_media.file_size,
-        mime_type=db_media.mime_type,
-        upload_date=db_media.upload_date
+        id=media.id,
+        filename=media.filename,
+        file_path=media_url(media.file_path),
+        file_type=media.file_type,
+        file_size=media.file_size,
+        mime_type=media.mime_type,
+        upload_date=media.upload_date,
+        sha256=media.blob.sha256 if media.blob else None
     )
 
-@app.get("/uploads/{file_type}/{filename}")
-async def serve_media(file_type: str, filename: str):
-    """Servir arquivos de mídia"""
-    from fastapi.responses import FileResponse
-    import os
-
-    file_path = Path("uploads") / file_type / filename
-
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-
-    return FileResponse(file_path)
-
 # Health check
 @app.get("/health")
 def health_check():
@@ -3107,6 +4665,8 @@ def init_sample_data():
                 last_seen=datetime.utcnow()
             )
             db.add(sample_user)
+            db.flush()
+            index_user_search_terms(db, sample_user)
             db.commit()
             db.refresh(sample_user)
             
@@ -3131,7 +4691,7 @@ def init_sample_data():
 
 # User search endpoint
 @app.get("/users/search")
-async def search_users(q: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def search_users(q: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Search users by name, email, or username"""
     if not q or len(q.strip()) < 2:
         return []
@@ -3159,7 +4719,7 @@ async def search_users(q: str, current_user: User = Depends(get_current_user), d
 
 # Follow/Unfollow endpoints
 @app.post("/follow/{user_id}")
-async def follow_user(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def follow_user(user_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Follow a user"""
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
@@ -3185,11 +4745,12 @@ async def follow_user(user_id: int, current_user: User = Depends(get_current_use
     )
     db.add(follow)
     db.commit()
+    background_tasks.add_task(sync_timeline_pair, current_user.id, user_id)
 
     return {"message": "User followed successfully"}
 
 @app.delete("/follow/{user_id}")
-async def unfollow_user(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def unfollow_user(user_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Unfollow a user"""
     follow = db.query(Follow).filter(
         Follow.follower_id == current_user.id,
@@ -3201,11 +4762,12 @@ async def unfollow_user(user_id: int, current_user: User = Depends(get_current_u
 
     db.delete(follow)
     db.commit()
+    background_tasks.add_task(sync_timeline_pair, current_user.id, user_id)
 
     return {"message": "User unfollowed successfully"}
 
 @app.get("/follow/status/{user_id}")
-async def get_follow_status(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_follow_status(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Check if current user is following another user"""
     follow = db.query(Follow).filter(
         Follow.follower_id == current_user.id,
@@ -3215,9 +4777,9 @@ async def get_follow_status(user_id: int, current_user: User = Depends(get_curre
     return {"is_following": follow is not None}
 
 @app.get("/users/{user_id}/followers")
-async def get_user_followers(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_followers(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get list of user's followers"""
-    followers = db.query(Follow).filter(Follow.followed_id == user_id).all()
+    followers = with_related(db.query(Follow), Follow.follower).filter(Follow.followed_id == user_id).all()
 
     followers_data = []
     for follow in followers:
@@ -3234,9 +4796,9 @@ async def get_user_followers(user_id: int, current_user: User = Depends(get_curr
     return followers_data
 
 @app.get("/users/{user_id}/following")
-async def get_user_following(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_following(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get list of users that a user is following"""
-    following = db.query(Follow).filter(Follow.follower_id == user_id).all()
+    following = with_related(db.query(Follow), Follow.followed).filter(Follow.follower_id == user_id).all()
 
     following_data = []
     for follow in following:
@@ -3253,7 +4815,7 @@ async def get_user_following(user_id: int, current_user: User = Depends(get_curr
     return following_data
 
 @app.get("/users/{user_id}/stats")
-async def get_user_stats(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_stats(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get user statistics"""
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -3262,10 +4824,7 @@ async def get_user_stats(user_id: int, current_user: User = Depends(get_current_
     followers_count = db.query(Follow).filter(Follow.followed_id == user_id).count()
     following_count = db.query(Follow).filter(Follow.follower_id == user_id).count()
     posts_count = db.query(Post).filter(Post.author_id == user_id).count()
-    friends_count = db.query(Friendship).filter(
-        ((Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id)),
-        Friendship.status == "accepted"
-    ).count()
+    friends_count = count_friends(db, user_id)
 
     return {
         "followers_count": followers_count,
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Add comments.root_id, path, depth and replies_count, used by the threaded comment
+loader, and backfill them level by level from parent_id. The (root_id, path)
+index is created by sync_indexes.py.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+COLUMNS = {
+    "root_id": "INT NULL",
+    "path": "VARCHAR(255) NULL",
+    "depth": "INT NOT NULL DEFAULT 0",
+    "replies_count": "INT NOT NULL DEFAULT 0",
+}
+
+def add_comment_paths():
+    """Add the missing columns, fill paths for comments that have none and recount replies"""
+    from main import engine, SessionLocal, reconcile_counters
+
+    print("🔧 Checking comment tree columns...")
+    with engine.connect() as conn:
+        for column, definition in COLUMNS.items():
+            if conn.execute(text(f"SHOW COLUMNS FROM comments LIKE '{column}'")).fetchone():
+                continue
+            print(f"➕ Adding {column} column...")
+            conn.execute(text(f"ALTER TABLE comments ADD COLUMN {column} {definition}"))
+        conn.commit()
+
+        print("🌳 Filling paths of top-level comments...")
+        conn.execute(text(
+            "UPDATE comments SET root_id = id, path = LPAD(id, 10, '0'), depth = 0 "
+            "WHERE parent_id IS NULL AND path IS NULL"
+        ))
+        conn.commit()
+
+        level = 1
+        while True:
+            filled = conn.execute(text(
+                "UPDATE comments child JOIN comments parent ON child.parent_id = parent.id "
+                "SET child.root_id = parent.root_id, "
+                "child.path = CONCAT(parent.path, '/', LPAD(child.id, 10, '0')), "
+                "child.depth = parent.depth + 1 "
+                "WHERE child.path IS NULL AND parent.path IS NOT NULL"
+            )).rowcount
+            conn.commit()
+            if not filled:
+                break
+            print(f"   level {level}: {filled} replies")
+            level += 1
+
+    db = SessionLocal()
+    try:
+        print(f"🔢 {reconcile_counters(db)} counters recounted (including comments.replies_count)")
+    finally:
+        db.close()
+    print("✅ Comment tree columns ready")
+
+if __name__ == "__main__":
+    add_comment_paths()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Add media_files.blob_id, the link from each upload to its content-addressed blob
+(media_blobs). Importing main creates the media_blobs table itself; existing
+media_files rows keep blob_id NULL and their original files.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+def add_media_blob_column():
+    """Add the blob_id column and its foreign key if missing"""
+    from main import engine
+
+    print("🔧 Checking media_files.blob_id...")
+    with engine.connect() as conn:
+        result = conn.execute(text("SHOW COLUMNS FROM media_files LIKE 'blob_id'"))
+        if result.fetchone():
+            print("✅ blob_id column already exists")
+            return False
+
+        print("➕ Adding blob_id column...")
+        conn.execute(text("ALTER TABLE media_files ADD COLUMN blob_id INT NULL"))
+        conn.execute(text(
+            "ALTER TABLE media_files ADD CONSTRAINT fk_media_files_blob "
+            "FOREIGN KEY (blob_id) REFERENCES media_blobs(id)"
+        ))
+        conn.commit()
+        print("✅ Added blob_id column")
+        return True
+
+if __name__ == "__main__":
+    add_media_blob_column()
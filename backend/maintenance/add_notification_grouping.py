@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Add notifications.group_key, actor_count and actor_ids, used to merge reactions
+and comments on the same post into one unread notification. Existing rows keep
+group_key NULL (never merged). The (recipient_id, group_key, created_at) index
+is created by sync_indexes.py.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+COLUMNS = {
+    "group_key": "VARCHAR(100) NULL",
+    "actor_count": "INT NOT NULL DEFAULT 1",
+    "actor_ids": "TEXT NULL",
+}
+
+def add_notification_grouping():
+    """Add the missing grouping columns"""
+    from main import engine
+
+    print("🔧 Checking notification grouping columns...")
+    added = False
+    with engine.connect() as conn:
+        for column, definition in COLUMNS.items():
+            if conn.execute(text(f"SHOW COLUMNS FROM notifications LIKE '{column}'")).fetchone():
+                continue
+            print(f"➕ Adding {column} column...")
+            conn.execute(text(f"ALTER TABLE notifications ADD COLUMN {column} {definition}"))
+            added = True
+        conn.commit()
+    print("✅ Notification grouping columns ready")
+    return added
+
+if __name__ == "__main__":
+    add_notification_grouping()
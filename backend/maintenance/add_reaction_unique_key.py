@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Add the (user_id, post_id) unique key to reactions and fill post_reaction_counts,
+the per-type aggregate read by the reaction summaries. Duplicate reactions of the
+same user on a post are removed first (the most recent one is kept). Importing
+main creates the post_reaction_counts table itself.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+def add_reaction_unique_key():
+    """Remove duplicate reactions, create uq_reactions_user_post if missing and recount"""
+    from main import engine, SessionLocal, reconcile_counters
+
+    print("🔧 Checking reactions unique key...")
+    with engine.connect() as conn:
+        result = conn.execute(text("SHOW INDEX FROM reactions WHERE Key_name = 'uq_reactions_user_post'"))
+        if result.fetchone():
+            print("✅ Unique key already exists")
+        else:
+            print("🧹 Removing duplicate reactions...")
+            removed = conn.execute(text(
+                "DELETE older FROM reactions older "
+                "JOIN reactions newer ON newer.user_id = older.user_id "
+                "AND newer.post_id = older.post_id AND newer.id > older.id"
+            )).rowcount
+            print(f"   {removed} duplicate rows removed")
+
+            print("➕ Adding unique key...")
+            conn.execute(text(
+                "ALTER TABLE reactions ADD CONSTRAINT uq_reactions_user_post UNIQUE (user_id, post_id)"
+            ))
+            conn.commit()
+
+    db = SessionLocal()
+    try:
+        print(f"🔢 {reconcile_counters(db)} counters recounted (including post_reaction_counts)")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    add_reaction_unique_key()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Add the (story_id, viewer_id) unique key to story_views, which the batched view
+writer relies on to skip repeated views. Duplicate rows left by the old
+SELECT-then-INSERT race are removed first (the oldest view is kept) and the
+story view counters are recounted.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+def add_story_view_unique_key():
+    """Remove duplicate views and create uq_story_views_story_viewer if missing"""
+    from main import engine, SessionLocal, reconcile_counters
+
+    print("🔧 Checking story_views unique key...")
+    with engine.connect() as conn:
+        result = conn.execute(text("SHOW INDEX FROM story_views WHERE Key_name = 'uq_story_views_story_viewer'"))
+        if result.fetchone():
+            print("✅ Unique key already exists")
+            return False
+
+        print("🧹 Removing duplicate views...")
+        removed = conn.execute(text(
+            "DELETE newer FROM story_views newer "
+            "JOIN story_views older ON older.story_id = newer.story_id "
+            "AND older.viewer_id = newer.viewer_id AND older.id < newer.id"
+        )).rowcount
+        print(f"   {removed} duplicate rows removed")
+
+        print("➕ Adding unique key...")
+        conn.execute(text(
+            "ALTER TABLE story_views ADD CONSTRAINT uq_story_views_story_viewer UNIQUE (story_id, viewer_id)"
+        ))
+        conn.commit()
+
+    if removed:
+        db = SessionLocal()
+        try:
+            print(f"🔢 {reconcile_counters(db)} counters recounted")
+        finally:
+            db.close()
+    print("✅ Added unique key")
+    return True
+
+if __name__ == "__main__":
+    add_story_view_unique_key()
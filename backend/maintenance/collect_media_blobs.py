@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Garbage-collect content-addressed media: delete media_blobs rows (and their files)
+whose reference count has been zero for longer than MEDIA_GC_GRACE_SECONDS.
+Safe to run from cron while the backend is up.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_collection():
+    """Remove unreferenced blobs in batches until none are left"""
+    from main import SessionLocal, collect_media_blobs
+
+    print("🔧 Collecting unreferenced media blobs...")
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            removed = collect_media_blobs(db)
+            total += removed
+            if not removed:
+                break
+        print(f"✅ {total} blob(s) removed")
+        return total
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_collection()
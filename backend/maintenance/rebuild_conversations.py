@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Populate the conversations table (inbox index) from the existing messages.
+Run once after deploying the table; afterwards send_message and the read paths
+keep it up to date. Rerunning rebuilds it from scratch.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_rebuild():
+    """Rebuild every user's conversation index"""
+    from main import SessionLocal, rebuild_conversations
+
+    print("🔧 Rebuilding conversation index...")
+    db = SessionLocal()
+    try:
+        total = rebuild_conversations(db)
+        print(f"✅ {total} conversation row(s) written")
+        return total
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_rebuild()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Populate the user search index (user_search_terms) from the existing users.
+Run once after deploying the table; afterwards register and the profile update
+routes keep it up to date. Rerunning rebuilds it from scratch.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_rebuild():
+    """Rebuild the search terms of every user"""
+    from main import SessionLocal, rebuild_user_search_index
+
+    print("🔧 Rebuilding user search index...")
+    db = SessionLocal()
+    try:
+        total = rebuild_user_search_index(db)
+        print(f"✅ {total} user(s) indexed")
+        return total
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_rebuild()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Repair drift in the denormalized counters (posts.reactions_count, comments_count,
+shares_count, comments.replies_count, stories.views_count and post_reaction_counts)
+by recounting the source tables in batches.
+Safe to run from cron while the backend is up.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_reconciliation():
+    """Recount every denormalized counter"""
+    from main import SessionLocal, reconcile_counters
+
+    print("🔧 Reconciling denormalized counters...")
+    db = SessionLocal()
+    try:
+        fixed = reconcile_counters(db)
+        print(f"✅ {fixed} row(s) repaired")
+        return fixed
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_reconciliation()
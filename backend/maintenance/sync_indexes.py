@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Create indexes declared on the models that are missing from an existing database.
+Base.metadata.create_all only creates indexes together with new tables, so tables
+created before an index was added to __table_args__ need this script.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect
+
+def sync_indexes():
+    """Create every model index that does not exist yet"""
+    from main import engine, Base
+
+    print("🔧 Checking model indexes...")
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = 0
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        existing.update(
+            constraint["name"] for constraint in inspector.get_unique_constraints(table.name)
+        )
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            print(f"➕ Creating {index.name} on {table.name}...")
+            index.create(bind=engine)
+            created += 1
+
+    if created:
+        print(f"✅ {created} index(es) created")
+    else:
+        print("✅ All model indexes already exist")
+    return created
+
+if __name__ == "__main__":
+    sync_indexes()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark de throughput concorrente contra um backend em execução.
+
+Dispara N requisições autenticadas (padrão: GET /posts/) com C clientes simultâneos
+e, ao mesmo tempo, mede a latência de /openapi.json, que é servido direto pelo
+event loop sem tocar no banco. Se as rotas bloqueiam o loop com consultas
+síncronas, essa latência cresce junto com a carga.
+
+Uso:
+    python scripts/benchmark_concurrency.py --email user@exemplo.com --password senha
+    python scripts/benchmark_concurrency.py --token <jwt> --path /notifications/ -c 100 -n 2000
+
+Rode uma vez antes e outra depois da mudança, com os mesmos parâmetros.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def login(base_url: str, email: str, password: str) -> str:
+    request = urllib.request.Request(
+        f"{base_url}/auth/login",
+        data=json.dumps({"email": email, "password": password}).encode(),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())["access_token"]
+
+def timed_get(url: str, headers: dict) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+        response.read()
+    return time.perf_counter() - started
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(name: str, samples):
+    if not samples:
+        print(f"   {name}: sem amostras")
+        return
+    print(
+        f"   {name}: p50={percentile(samples, 0.5) * 1000:.1f}ms "
+        f"p95={percentile(samples, 0.95) * 1000:.1f}ms "
+        f"p99={percentile(samples, 0.99) * 1000:.1f}ms "
+        f"max={max(samples) * 1000:.1f}ms"
+    )
+
+def run(base_url: str, token: str, path: str, concurrency: int, total: int):
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"{base_url}{path}"
+    timed_get(url, headers)  # Aquecimento (cache de usuário, pool de conexões)
+    timed_get(f"{base_url}/openapi.json", {})
+
+    probe_samples = []
+    finished = threading.Event()
+
+    def probe():
+        while not finished.is_set():
+            probe_samples.append(timed_get(f"{base_url}/openapi.json", {}))
+            time.sleep(0.05)
+
+    probe_thread = threading.Thread(target=probe, daemon=True)
+    probe_thread.start()
+
+    errors = 0
+    latencies = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed_get, url, headers) for _ in range(total)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    finished.set()
+    probe_thread.join()
+
+    print(f"📊 {total} x GET {path} com {concurrency} clientes simultâneos")
+    print(f"   throughput: {len(latencies) / elapsed:.1f} req/s em {elapsed:.2f}s ({errors} erro(s))")
+    if latencies:
+        print(f"   média: {statistics.mean(latencies) * 1000:.1f}ms")
+    report(path, latencies)
+    report("/openapi.json durante a carga (lag do event loop)", probe_samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de requisições concorrentes")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/posts/")
+    parser.add_argument("--token")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    token = args.token
+    if not token:
+        if not (args.email and args.password):
+            parser.error("informe --token ou --email/--password")
+        token = login(args.base_url, args.email, args.password)
+
+    run(args.base_url.rstrip("/"), token, args.path, args.concurrency, args.requests)
+
+if __name__ == "__main__":
+    main()
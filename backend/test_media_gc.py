@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Garante que a coleta de blobs não apaga o arquivo de um reenvio do mesmo conteúdo
+que chega entre o DELETE da linha e a remoção do arquivo.
+Roda contra o banco configurado no .env; tudo é desfeito com rollback no final.
+"""
+import io
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+
+from main import engine, MediaBlob, store_blob, collect_media_blobs
+
+@contextmanager
+def rollback_session():
+    """Sessão cujos commits ficam dentro de uma transação desfeita no final"""
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield db
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+def test_reupload_during_collection_keeps_file():
+    content = f"gc-{uuid.uuid4()}".encode()
+    with rollback_session() as db:
+        blob = store_blob(db, io.BytesIO(content), "image", ".bin", 1024)
+        sha256, file_path = blob.sha256, blob.file_path
+        db.query(MediaBlob).filter(MediaBlob.sha256 == sha256).update({
+            MediaBlob.ref_count: 0,
+            MediaBlob.released_at: datetime.utcnow() - timedelta(hours=1)
+        }, synchronize_session=False)
+        db.commit()
+
+        # Reenvio logo depois do commit do DELETE, antes de a coleta mexer no arquivo
+        commit = db.commit
+
+        def commit_then_reupload():
+            commit()
+            db.commit = commit
+            store_blob(db, io.BytesIO(content), "image", ".bin", 1024)
+            commit()
+
+        db.commit = commit_then_reupload
+        try:
+            assert collect_media_blobs(db, grace_seconds=0) == 1
+            reuploaded = db.query(MediaBlob).filter(MediaBlob.sha256 == sha256).one()
+            assert reuploaded.ref_count == 1
+            assert os.path.exists(file_path), "reenvio ficou sem arquivo"
+            with open(file_path, "rb") as stored:
+                assert stored.read() == content
+            assert not [name for name in os.listdir(os.path.dirname(file_path)) if ".gc-" in name]
+        finally:
+            db.commit = commit
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+if __name__ == "__main__":
+    test_reupload_during_collection_keeps_file()
+    print("✅ Reenvio durante a coleta mantém o arquivo")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Garante que as listas (feed, posts, comentários, stories, notificações, conversas,
+estado do leitor) fazem um número fixo de consultas, independente do tamanho da página.
+Roda contra o banco configurado no .env; tudo é desfeito com rollback no final.
+"""
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from main import (
+    app, engine, User, Post, Comment, Story, Notification, Message, Friendship,
+    get_posts, get_user_posts, get_stories, get_notifications, get_conversation,
+    get_conversations, record_conversation_message, get_posts_viewer_state, PostViewerStateRequest
+)
+
+def route(path: str):
+    """Endpoint registrado para um path GET (há funções com nomes repetidos no main.py)"""
+    for registered in app.routes:
+        if getattr(registered, "path", None) == path and "GET" in registered.methods:
+            return registered.endpoint
+    raise LookupError(path)
+
+@contextmanager
+def rollback_session():
+    """Sessão cujos commits ficam dentro de uma transação desfeita no final"""
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield db
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+def make_user(db: Session) -> User:
+    user = User(
+        first_name="Teste",
+        last_name="Consultas",
+        email=f"qc_{uuid.uuid4().hex[:12]}@exemplo.com",
+        password_hash="hash_teste",
+        is_active=True
+    )
+    db.add(user)
+    db.flush()
+    return user
+
+def count_queries(call) -> int:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+def seed(db: Session, viewer: User, size: int) -> dict:
+    """Cria `size` linhas de cada tipo, cada uma de um autor diferente"""
+    target = make_user(db)
+    post = Post(author_id=target.id, content="post base", created_at=datetime.utcnow())
+    db.add(post)
+    db.add(Friendship(requester_id=viewer.id, addressee_id=target.id, status="accepted"))
+    db.flush()
+
+    for i in range(size):
+        author = make_user(db)
+        db.add(Post(author_id=target.id, content=f"post {i}"))
+        comment = Comment(post_id=post.id, author_id=author.id, content=f"comentário {i}")
+        db.add(comment)
+        db.flush()
+        db.add(Comment(post_id=post.id, author_id=viewer.id, content=f"resposta {i}", parent_id=comment.id))
+        db.add(Story(author_id=author.id, content=f"story {i}", expires_at=datetime.utcnow() + timedelta(hours=1)))
+        db.add(Notification(recipient_id=viewer.id, sender_id=author.id, notification_type="reaction",
+                            title="Teste", message=f"notificação {i}"))
+        sender = author if i % 2 else viewer
+        message = Message(sender_id=sender.id, recipient_id=target.id if sender is viewer else viewer.id,
+                          content=f"mensagem {i}")
+        db.add(message)
+        db.flush()
+        record_conversation_message(db, message)
+    db.commit()
+    return {"target_id": target.id, "post_id": post.id}
+
+def queries_per_endpoint(size: int) -> dict:
+    with rollback_session() as db:
+        viewer = make_user(db)
+        viewer_id = viewer.id
+        data = seed(db, viewer, size)
+
+        # Esvaziar o identity map: autores já carregados mascarariam lazy loads
+        db.expunge_all()
+        viewer = db.get(User, viewer_id)
+        target_id, post_id = data["target_id"], data["post_id"]
+        flat_comments = route("/posts/{post_id}/comments")
+        comment_tree = route("/comments/post/{post_id}")
+        page_ids = PostViewerStateRequest(post_ids=[row[0] for row in db.query(Post.id).filter(Post.author_id == target_id)])
+
+        # Primeira leitura monta a timeline; a contagem vale para as leituras seguintes
+        get_posts(cursor=None, limit=50, current_user=viewer, db=db)
+
+        return {
+            "feed": count_queries(lambda: get_posts(cursor=None, limit=50, current_user=viewer, db=db)),
+            "user_posts": count_queries(lambda: get_user_posts(target_id, cursor=None, limit=50, current_user=viewer, db=db)),
+            "comments": count_queries(lambda: flat_comments(post_id, cursor=None, limit=50, current_user=viewer, db=db)),
+            "comment_tree": count_queries(lambda: comment_tree(post_id, cursor=None, limit=50, current_user=viewer, db=db)),
+            "stories": count_queries(lambda: get_stories(current_user=viewer, db=db)),
+            "notifications": count_queries(lambda: get_notifications(cursor=None, limit=50, current_user=viewer, db=db)),
+            "conversation": count_queries(lambda: get_conversation(target_id, cursor=None, limit=50, current_user=viewer, db=db)),
+            "inbox": count_queries(lambda: get_conversations(cursor=None, limit=50, current_user=viewer, db=db)),
+            "viewer_state": count_queries(lambda: get_posts_viewer_state(page_ids, current_user=viewer, db=db)),
+        }
+
+def test_list_endpoints_use_fixed_number_of_queries():
+    """O número de consultas não pode crescer com o número de linhas da página"""
+    small = queries_per_endpoint(2)
+    large = queries_per_endpoint(12)
+
+    for endpoint, count in small.items():
+        print(f"{endpoint}: {count} consulta(s) com 2 linhas, {large[endpoint]} com 12")
+        assert large[endpoint] == count, f"{endpoint} faz consultas por linha"
+
+if __name__ == "__main__":
+    test_list_endpoints_use_fixed_number_of_queries()
+    print("✅ Todas as listas usam um número fixo de consultas")
@@ -0,0 +1,84 @@
+"""
+In-memory availability filter for usernames and emails (Bloom filter)
+
+A miss is only certain for values written by this process; other workers'
+writes show up after the next refresh, so write paths must still check the DB.
+"""
+import hashlib
+import math
+import threading
+from typing import Iterable
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, double hashing on one BLAKE2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+class AvailabilityFilter:
+    """Answers "is this value certainly free?" without touching the database
+
+    A miss in the filter means no user had the value at the last refresh (or
+    was given it by this process since), so typeahead can say "available"
+    straight away; a hit may be a false positive and must be confirmed by the
+    caller with a query. Writes from other workers are only seen after the
+    next refresh, so register/profile updates query the database regardless.
+    Values are compared lowercased, matching the database's case-insensitive
+    collation. Freed values stay in the filter until the next full load (they
+    just cost a confirming query).
+    """
+
+    def __init__(self, error_rate: float = 0.01, headroom: float = 2.0, minimum_capacity: int = 100000):
+        self.error_rate = error_rate
+        self.headroom = headroom
+        self.minimum_capacity = minimum_capacity
+        self.loaded = False
+        self._filter = BloomFilter(minimum_capacity, error_rate)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(value: str) -> str:
+        return value.strip().lower()
+
+    def load(self, values: Iterable[str], expected: int = 0):
+        """Replace the filter with one built from every value currently taken"""
+        bloom = BloomFilter(max(self.minimum_capacity, int(expected * self.headroom)), self.error_rate)
+        for value in values:
+            if value:
+                bloom.add(self._key(value))
+        with self._lock:
+            self._filter = bloom
+            self.loaded = True
+
+    def add(self, value: str):
+        if value:
+            with self._lock:
+                self._filter.add(self._key(value))
+
+    def needs_reload(self) -> bool:
+        """Past its planned capacity the false-positive rate climbs; rebuild bigger"""
+        return self._filter.count > self._filter.capacity
+
+    def might_be_taken(self, value: str) -> bool:
+        """False only when the value is certainly free (always True before the first load)"""
+        if not self.loaded:
+            return True
+        return self._key(value) in self._filter
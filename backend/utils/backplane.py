@@ -0,0 +1,142 @@
+"""
+Pub/sub backplane for real-time delivery across uvicorn workers and hosts
+"""
+import asyncio
+import json
+import os
+import uuid
+from typing import Awaitable, Callable, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Backplane Redis é opcional
+    aioredis = None
+
+DeliverHandler = Callable[[int, str], Awaitable[None]]
+
+class Backplane:
+    """Routes a message for a user ID to whichever workers hold that user's sockets
+
+    The connection manager binds a handler that writes to its local sockets,
+    subscribes to the user IDs it holds and publishes every outgoing message.
+    """
+
+    def __init__(self):
+        self._deliver: Optional[DeliverHandler] = None
+
+    def bind(self, deliver: DeliverHandler):
+        self._deliver = deliver
+
+    async def subscribe(self, user_id: int):
+        pass
+
+    async def unsubscribe(self, user_id: int):
+        pass
+
+    async def publish(self, user_id: int, message: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class InMemoryBackplane(Backplane):
+    """Single-process backplane: publishing is a direct local delivery"""
+
+    async def publish(self, user_id: int, message: str):
+        await self._deliver(user_id, message)
+
+class RedisBackplane(Backplane):
+    """Redis (or any Redis-protocol server) pub/sub, one channel per user ID
+
+    Works over TCP or a UNIX socket (REDIS_URL=unix:///path/to/redis.sock).
+    Messages are delivered to local sockets immediately; the copy echoed back
+    by Redis to this worker is recognized by its origin ID and skipped.
+    """
+
+    def __init__(self, client, prefix: str = "ws"):
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self.origin = uuid.uuid4().hex
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._channels = set()
+        self._listener: Optional[asyncio.Task] = None
+
+    def _channel(self, user_id: int) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    async def subscribe(self, user_id: int):
+        self._channels.add(self._channel(user_id))
+        await self._pubsub.subscribe(self._channel(user_id))
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, user_id: int):
+        self._channels.discard(self._channel(user_id))
+        await self._pubsub.unsubscribe(self._channel(user_id))
+
+    async def publish(self, user_id: int, message: str):
+        await self._deliver(user_id, message)
+        try:
+            await self.client.publish(self._channel(user_id), json.dumps({"origin": self.origin, "message": message}))
+        except Exception as e:
+            print(f"❌ Erro ao publicar no backplane: {e}")
+
+    async def _resubscribe(self):
+        """Trocar o pubsub cuja conexão caiu por um novo, inscrito nos mesmos canais"""
+        try:
+            await self._pubsub.close()
+        except Exception:
+            pass
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        if self._channels:
+            await self._pubsub.subscribe(*self._channels)
+
+    async def _listen(self):
+        retry_delay = 1
+        while True:
+            try:
+                event = await self._pubsub.get_message(timeout=1.0)
+                retry_delay = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Erro no backplane Redis, reconectando em {retry_delay}s: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+                try:
+                    await self._resubscribe()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"❌ Falha ao reinscrever no backplane Redis: {e}")
+                continue
+
+            if event is None or event.get("type") != "message":
+                continue
+            try:
+                channel = event["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                user_id = int(channel.rsplit(":", 1)[1])
+                envelope = json.loads(event["data"])
+                origin, message = envelope["origin"], envelope["message"]
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                print(f"⚠️ Mensagem inválida no backplane ignorada: {e}")
+                continue
+            if origin == self.origin:
+                continue
+            await self._deliver(user_id, message)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._pubsub.close()
+        await self.client.close()
+
+def build_backplane(prefix: str = "ws") -> Backplane:
+    """Redis backplane from REDIS_URL, or the in-memory one when Redis is not configured/installed"""
+    url = os.getenv("REDIS_URL")
+    if not url or aioredis is None:
+        return InMemoryBackplane()
+    return RedisBackplane(aioredis.Redis.from_url(url), prefix)
@@ -0,0 +1,89 @@
+"""
+Caching utilities: in-process TTL cache and optional shared (Redis) cache
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+try:
+    import redis
+except ImportError:  # Cache compartilhado é opcional
+    redis = None
+
+class TTLCache:
+    """Thread-safe in-process cache with a per-entry TTL and an LRU size bound"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class RedisCache:
+    """String cache shared by every worker; failures degrade to cache misses"""
+
+    def __init__(self, client, prefix: str, ttl_seconds: int):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.prefix}:{key}"
+
+    def get(self, key: Hashable) -> Optional[str]:
+        try:
+            value = self.client.get(self._key(key))
+        except Exception:
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key: Hashable, value: str):
+        try:
+            self.client.set(self._key(key), value, ex=self.ttl_seconds)
+        except Exception:
+            pass
+
+    def delete(self, key: Hashable):
+        try:
+            self.client.delete(self._key(key))
+        except Exception:
+            pass
+
+def build_shared_cache(prefix: str, ttl_seconds: int) -> Optional[RedisCache]:
+    """Shared cache from REDIS_URL, or None when Redis is not configured/installed"""
+    url = os.getenv("REDIS_URL")
+    if not url or redis is None:
+        return None
+    return RedisCache(redis.Redis.from_url(url, socket_timeout=0.2), prefix, ttl_seconds)
@@ -0,0 +1,76 @@
+"""
+WebSocket connections with a bounded outbound queue drained by a writer task
+"""
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from starlette.websockets import WebSocket
+
+DROP = "drop"    # Descarta a mensagem nova quando a fila está cheia
+CLOSE = "close"  # Fecha a conexão; o cliente reconecta e recarrega o estado
+
+WS_1013_TRY_AGAIN_LATER = 1013
+
+class QueuedConnection:
+    """Sends never await the network: they enqueue and the writer task does the I/O
+
+    A client that stops reading fills its own queue only; what happens then is
+    decided by `overflow` (DROP or CLOSE). A send that takes longer than
+    `send_timeout` also closes the connection.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int = 256, send_timeout: float = 10.0,
+                 overflow: str = CLOSE, on_close: Optional[Callable[["QueuedConnection"], Awaitable[None]]] = None):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.overflow = overflow
+        self.on_close = on_close
+        self.dropped = 0
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._drain())
+
+    def send(self, message: str) -> bool:
+        """Enfileirar sem bloquear; False se a mensagem não foi aceita"""
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow == CLOSE:
+                self._abort()
+            return False
+
+    async def _drain(self):
+        try:
+            while True:
+                message = await self._queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self._shutdown()
+
+    def _abort(self):
+        """Fechar em background (send() é síncrono)"""
+        self.closed = True
+        asyncio.create_task(self._shutdown())
+
+    async def _shutdown(self):
+        self.closed = True
+        try:
+            await self.websocket.close(code=WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+        if self.on_close is not None:
+            await self.on_close(self)
+
+    def stop(self):
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
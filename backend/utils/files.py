@@ -5,7 +5,9 @@ import os
 import uuid
 from pathlib import Path
 from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
 from core.config import UPLOAD_DIR, MAX_FILE_SIZE_MB, MAX_AVATAR_SIZE_MB, MAX_COVER_SIZE_MB
+from utils.uploads import stream_to_disk
 
 def validate_image_file(file: UploadFile, max_size_mb: int = MAX_FILE_SIZE_MB):
     """Validate uploaded image file"""
@@ -13,7 +15,7 @@ def validate_image_file(file: UploadFile, max_size_mb: int = MAX_FILE_SIZE_MB):
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Validate file size
+    # Validate declared size (the limit is enforced again on the bytes actually saved)
     if file.size and file.size > max_size_mb * 1024 * 1024:
         raise HTTPException(status_code=400, detail=f"Image too large (max {max_size_mb}MB)")
 
@@ -35,8 +37,8 @@ def validate_media_file(file: UploadFile):
     if not file_type:
         raise HTTPException(status_code=400, detail="File type not supported")
 
-    # Validate size (100MB max)
-    if file.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+    # Validate declared size (100MB max; enforced again while saving)
+    if file.size and file.size > MAX_FILE_SIZE_MB * 1024 * 1024:
         raise HTTPException(status_code=400, detail=f"File too large (max {MAX_FILE_SIZE_MB}MB)")
     
     return file_type
@@ -52,11 +54,11 @@ async def save_uploaded_file(file: UploadFile, file_type: str, prefix: str = "fi
     unique_filename = f"{prefix}_{uuid.uuid4()}{file_extension}"
     file_path = upload_dir / unique_filename
 
-    # Save file
+    # Save file in chunks off the event loop; the size limit applies to the bytes read
     try:
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        await run_in_threadpool(stream_to_disk, file.file, file_path, MAX_FILE_SIZE_MB * 1024 * 1024)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
@@ -74,9 +76,7 @@ async def save_avatar(file: UploadFile, user_id: int) -> str:
     unique_filename = f"avatar_{user_id}_{uuid.uuid4()}{file_extension}"
     file_path = upload_dir / unique_filename
 
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    await run_in_threadpool(stream_to_disk, file.file, file_path, MAX_AVATAR_SIZE_MB * 1024 * 1024, "Image")
 
     return f"/{UPLOAD_DIR}/image/{unique_filename}"
 
@@ -91,9 +91,7 @@ async def save_cover_photo(file: UploadFile, user_id: int) -> str:
     unique_filename = f"cover_{user_id}_{uuid.uuid4()}{file_extension}"
     file_path = upload_dir / unique_filename
 
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    await run_in_threadpool(stream_to_disk, file.file, file_path, MAX_COVER_SIZE_MB * 1024 * 1024, "Image")
 
     return f"/{UPLOAD_DIR}/image/{unique_filename}"
 
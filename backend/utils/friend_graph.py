@@ -0,0 +1,124 @@
+"""
+Friend-graph adjacency cache: accepted friendships per user as a sorted ID list plus a set
+"""
+import json
+from collections import Counter
+from typing import Callable, Collection, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from utils.cache import RedisCache, TTLCache
+
+# Carrega as amizades aceitas de um usuário: [(friend_id, friends_since_iso), ...]
+AdjacencyLoader = Callable[[int], Iterable[Tuple[int, Optional[str]]]]
+# Mesma coisa para vários usuários numa consulta: {user_id: [(friend_id, since), ...]}
+BatchAdjacencyLoader = Callable[[List[int]], Dict[int, Iterable[Tuple[int, Optional[str]]]]]
+
+class Adjacency(NamedTuple):
+    ids: Tuple[int, ...]            # ordenados: listas paginam e fazem merge sem reordenar
+    members: frozenset              # is_friend em O(1)
+    since: Dict[int, Optional[str]]
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Tuple[int, Optional[str]]]) -> "Adjacency":
+        since = dict(edges)
+        return cls(tuple(sorted(since)), frozenset(since), since)
+
+    def to_json(self) -> str:
+        return json.dumps([[friend_id, self.since[friend_id]] for friend_id in self.ids])
+
+    @classmethod
+    def from_json(cls, raw: str) -> "Adjacency":
+        return cls.from_edges((friend_id, since) for friend_id, since in json.loads(raw))
+
+class FriendGraph:
+    """Per-user adjacency lists, loaded once and dropped when a friendship changes
+
+    L1 is per process with a short TTL (bounds staleness in other workers);
+    L2, when Redis is configured, is shared and invalidated together with L1.
+    Both users of an edge must be invalidated after accept/remove/block.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 50000, shared: Optional[RedisCache] = None):
+        self._local = TTLCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._shared = shared
+
+    def _cached(self, user_id: int) -> Optional[Adjacency]:
+        cached = self._local.get(user_id)
+        if cached is None and self._shared is not None:
+            raw = self._shared.get(user_id)
+            if raw:
+                cached = Adjacency.from_json(raw)
+                self._local.set(user_id, cached)
+        return cached
+
+    def _store(self, user_id: int, edges: Iterable[Tuple[int, Optional[str]]]) -> Adjacency:
+        adjacency = Adjacency.from_edges(edges)
+        self._local.set(user_id, adjacency)
+        if self._shared is not None:
+            self._shared.set(user_id, adjacency.to_json())
+        return adjacency
+
+    def adjacency(self, user_id: int, load: AdjacencyLoader) -> Adjacency:
+        cached = self._cached(user_id)
+        if cached is None:
+            cached = self._store(user_id, load(user_id))
+        return cached
+
+    def adjacency_many(self, user_ids: Iterable[int], load_many: BatchAdjacencyLoader) -> Dict[int, Adjacency]:
+        """Adjacency for several users; only the cache misses are loaded, in one batch"""
+        found: Dict[int, Adjacency] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._cached(user_id)
+            if cached is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = cached
+
+        if missing:
+            loaded = load_many(missing)
+            for user_id in missing:
+                found[user_id] = self._store(user_id, loaded.get(user_id, ()))
+        return found
+
+    def friend_ids(self, user_id: int, load: AdjacencyLoader) -> List[int]:
+        return list(self.adjacency(user_id, load).ids)
+
+    def is_friend(self, user_id: int, other_id: int, load: AdjacencyLoader) -> bool:
+        return other_id in self.adjacency(user_id, load).members
+
+    def friend_count(self, user_id: int, load: AdjacencyLoader) -> int:
+        return len(self.adjacency(user_id, load).ids)
+
+    def invalidate(self, *user_ids: int):
+        for user_id in user_ids:
+            self._local.delete(user_id)
+            if self._shared is not None:
+                self._shared.delete(user_id)
+
+    def clear(self):
+        self._local.clear()
+
+def count_common(first: Adjacency, second: Adjacency) -> int:
+    """Mutual friends: walk the smaller list, probe the larger set"""
+    if len(first.ids) > len(second.ids):
+        first, second = second, first
+    return sum(1 for friend_id in first.ids if friend_id in second.members)
+
+def rank_friends_of_friends(own: Adjacency, friends: Dict[int, Adjacency], exclude: Collection[int],
+                            limit: int) -> List[Tuple[int, int]]:
+    """Friends of friends ranked by mutual-friend count: [(candidate_id, mutual), ...]
+
+    This is the user's row of the squared adjacency matrix, accumulated
+    sparsely (one counter increment per friend-of-friend edge). Ties are
+    broken by ID so the order is stable between calls.
+    """
+    mutual: Counter = Counter()
+    for friend_id in own.ids:
+        adjacency = friends.get(friend_id)
+        if adjacency is not None:
+            mutual.update(adjacency.ids)
+
+    candidates = [(candidate, count) for candidate, count in mutual.items()
+                  if candidate not in own.members and candidate not in exclude]
+    candidates.sort(key=lambda item: (-item[1], item[0]))
+    return candidates[:limit]
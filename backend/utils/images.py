@@ -0,0 +1,87 @@
+"""
+Image variants (thumbnail/small/medium/large) rendered from media_quality_settings
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.cache import TTLCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Variantes são opcionais: sem Pillow, o original é servido
+    Image = None
+
+VARIANTS_DIR = Path("uploads") / "variants"
+FORMAT_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+
+_resolved_urls = TTLCache(ttl_seconds=60, max_entries=50000)
+
+def variants_available() -> bool:
+    return Image is not None
+
+def variant_path(source_path: str, context: str, variant_type: str, fmt: str) -> Path:
+    """Nome derivado do original: uploads/variants/<nome>_<contexto>_<variante>.<formato>"""
+    stem = Path(source_path).stem
+    return VARIANTS_DIR / f"{stem}_{context}_{variant_type}{FORMAT_EXTENSIONS.get(fmt, '.jpg')}"
+
+def variant_url(url: Optional[str], context: str, variant_type: str) -> Optional[str]:
+    """URL da variante já gerada para `url`, ou a própria `url` enquanto ela não existir
+
+    Resolved from the file system (no query per row), cached for a minute.
+    """
+    if not url or not url.startswith("/uploads/"):
+        return url
+
+    key = (url, context, variant_type)
+    resolved = _resolved_urls.get(key)
+    if resolved is None:
+        resolved = url
+        for fmt in FORMAT_EXTENSIONS:
+            candidate = variant_path(url, context, variant_type, fmt)
+            if candidate.exists():
+                resolved = "/" + candidate.as_posix()
+                break
+        _resolved_urls.set(key, resolved)
+    return resolved
+
+def forget_variant_url(url: str, context: str, variant_type: str):
+    """Descartar a resolução em cache assim que a variante é gerada neste processo"""
+    _resolved_urls.delete((url, context, variant_type))
+
+def remove_variants(source_path: str):
+    """Apagar todas as variantes derivadas de um original"""
+    for path in VARIANTS_DIR.glob(f"{Path(source_path).stem}_*"):
+        path.unlink(missing_ok=True)
+
+def render_variants(source_path: str, jobs: List[Dict]) -> List[Dict]:
+    """Resize/re-encode one image into every requested variant (runs in a worker process)
+
+    Each job has variant_type, max_width, max_height, quality, format and
+    output_path. Outputs that already exist are reused: variant names derive
+    from content-addressed originals, so the same bytes produce the same file.
+    """
+    results = []
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        for job in jobs:
+            output = Path(job["output_path"])
+            if not output.exists():
+                output.parent.mkdir(parents=True, exist_ok=True)
+                variant = image.copy()
+                variant.thumbnail((job["max_width"], job["max_height"]), Image.LANCZOS)
+                if job["format"] == "jpeg" and variant.mode not in ("RGB", "L"):
+                    variant = variant.convert("RGB")
+                partial = output.with_name(output.name + ".part")
+                variant.save(partial, format=job["format"].upper(), quality=job["quality"], optimize=True)
+                os.replace(partial, output)
+
+            with Image.open(output) as saved:
+                width, height = saved.size
+            results.append({
+                "variant_type": job["variant_type"],
+                "width": width,
+                "height": height,
+                "file_size": output.stat().st_size
+            })
+    return results
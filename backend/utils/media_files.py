@@ -0,0 +1,173 @@
+"""
+Static serving for /uploads: strong ETags, conditional GETs, byte ranges and zero-copy sends
+"""
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+# Originais (<sha256>.<ext>) e variantes (<sha256>_<contexto>_<variante>.<ext>) nunca mudam de conteúdo
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(?:[._]|$)")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, no-cache"
+READ_CHUNK_SIZE = 256 * 1024
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def file_etag(path: str, stat_result: os.stat_result) -> str:
+    """Strong validator: the content hash for content-addressed names, mtime+size otherwise"""
+    name = os.path.basename(path)
+    if CONTENT_ADDRESSED.match(name):
+        return f'"{os.path.splitext(name)[0]}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single byte range, or None to serve the whole file
+
+    Multi-range and malformed headers are ignored (a full 200 is a valid answer
+    to those); a range starting past the end raises RangeNotSatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, separator, last = spec.strip().partition("-")
+    if not separator or not (first or last):
+        return None
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class MediaFileResponse(Response):
+    """File (or byte range of a file) sent with sendfile when the server offers it
+
+    Uses the ASGI zero-copy extensions (http.response.zerocopysend /
+    http.response.pathsend) when the server advertises them, and otherwise
+    reads the requested span in fixed-size chunks on a worker thread.
+    """
+
+    def __init__(self, path: str, size: int, headers: dict, media_type: Optional[str] = None,
+                 byte_range: Optional[Tuple[int, int]] = None, method: str = "GET"):
+        self.path = path
+        self.send_header_only = method.upper() == "HEAD"
+        self.start, end = byte_range if byte_range else (0, size - 1)
+        self.length = end - self.start + 1
+        self.status_code = 206 if byte_range is not None else 200
+        self.media_type = media_type or guess_type(path)[0] or "application/octet-stream"
+        self.background = None
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.length)
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {self.start}-{end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only or self.length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            return
+
+        if "http.response.zerocopysend" in extensions:
+            file = await anyio.to_thread.run_sync(open, self.path, "rb")
+            try:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False
+                })
+            finally:
+                await anyio.to_thread.run_sync(file.close)
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+class MediaFiles(StaticFiles):
+    """StaticFiles with long-lived caching, 304s and Range support for uploaded media"""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        path = str(full_path)
+        size = stat_result.st_size
+        etag = file_etag(path, stat_result)
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        headers = {
+            "etag": etag,
+            "last-modified": last_modified,
+            "accept-ranges": "bytes",
+            "cache-control": IMMUTABLE_CACHE if CONTENT_ADDRESSED.match(os.path.basename(path)) else REVALIDATE_CACHE
+        }
+
+        if self.not_modified(request_headers, etag, stat_result.st_mtime):
+            return NotModifiedResponse(Headers(headers))
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if range_header and self.range_applies(request_headers.get("if-range"), etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                return Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+
+        return MediaFileResponse(path, size, headers, byte_range=byte_range, method=scope["method"])
+
+    @staticmethod
+    def not_modified(request_headers: Headers, etag: str, mtime: float) -> bool:
+        """If-None-Match wins over If-Modified-Since when both are sent"""
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def range_applies(if_range: Optional[str], etag: str, last_modified: str) -> bool:
+        """Honor Range only while the client's copy (If-Range) is still current"""
+        return if_range is None or if_range.strip() in (etag, last_modified)
@@ -0,0 +1,66 @@
+"""
+Cursor pagination utilities
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    """Encode an opaque (created_at, id) cursor"""
+    raw = json.dumps([created_at.isoformat(), item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Decode a cursor created by encode_cursor, or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def clamp_limit(limit: int) -> int:
+    """Keep page size between 1 and MAX_PAGE_SIZE"""
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def paginate(query, created_column, id_column, cursor: Optional[str], limit: int, descending: bool = True):
+    """Apply (created_at, id) keyset pagination to a query and return (rows, next_cursor)
+
+    The composite index behind the query should end in (created_at, id) so every
+    page is a single index range scan, no matter how deep the cursor is.
+    """
+    limit = clamp_limit(limit)
+    position = decode_cursor(cursor)
+    if position:
+        created_at, item_id = position
+        if descending:
+            query = query.filter(or_(
+                created_column < created_at,
+                and_(created_column == created_at, id_column < item_id)
+            ))
+        else:
+            query = query.filter(or_(
+                created_column > created_at,
+                and_(created_column == created_at, id_column > item_id)
+            ))
+
+    if descending:
+        query = query.order_by(created_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(created_column.asc(), id_column.asc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,70 @@
+"""
+Shared query-building helpers for list endpoints
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import joinedload, selectinload
+
+from utils.images import variant_url
+
+UPSERT_DIALECTS = {
+    "mysql": mysql.insert,
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def with_related(query, *relationships):
+    """Eager-load relationships so serializing a page never lazy-loads per row
+
+    Many-to-one relationships (post.author, message.sender) are joined into the
+    main SELECT; collections (comment.replies) are fetched with one SELECT ... IN.
+    """
+    options = []
+    for relationship in relationships:
+        if relationship.property.uselist:
+            options.append(selectinload(relationship))
+        else:
+            options.append(joinedload(relationship))
+    return query.options(*options)
+
+def author_summary(user) -> Optional[Dict[str, Any]]:
+    """Compact author projection embedded in list responses"""
+    if user is None:
+        return None
+    return {
+        "id": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "avatar": variant_url(getattr(user, "avatar", None), "profile_avatar", "small")
+    }
+
+def upsert(db, model, values: Dict[str, Any], conflict_columns: Iterable[str], update: Callable[[Any], Dict[str, Any]]):
+    """Single-statement insert-or-update keyed on a unique constraint
+
+    MySQL gets INSERT ... ON DUPLICATE KEY UPDATE, SQLite/PostgreSQL get
+    ON CONFLICT DO UPDATE. `update` receives the proposed row (VALUES()/excluded)
+    and returns the assignments applied when the key already exists.
+    """
+    dialect = db.get_bind().dialect.name
+    stmt = UPSERT_DIALECTS[dialect](model.__table__).values(**values)
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**update(stmt.inserted))
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=list(conflict_columns), set_=update(stmt.excluded))
+    db.execute(stmt)
+
+def insert_ignore(db, model, rows: List[Dict[str, Any]], conflict_columns: Iterable[str]):
+    """Multi-row insert that leaves rows whose unique key already exists untouched
+
+    MySQL gets INSERT ... ON DUPLICATE KEY UPDATE with a no-op assignment (unlike
+    INSERT IGNORE it still fails on other errors), SQLite/PostgreSQL get
+    ON CONFLICT DO NOTHING.
+    """
+    conflict_columns = list(conflict_columns)
+    dialect = db.get_bind().dialect.name
+    stmt = UPSERT_DIALECTS[dialect](model.__table__).values(rows)
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update({conflict_columns[0]: stmt.inserted[conflict_columns[0]]})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+    db.execute(stmt)
@@ -0,0 +1,43 @@
+"""
+Deadline min-heap for background jobs that fire when something expires
+"""
+import heapq
+import threading
+from datetime import datetime
+from typing import Hashable, List, Optional
+
+class DeadlineHeap:
+    """Keys ordered by deadline; each key is scheduled at most once
+
+    Pushing an already scheduled key is a no-op, so a periodic refill from the
+    database can overlap with keys pushed at creation time.
+    """
+
+    def __init__(self):
+        self._heap: list = []
+        self._scheduled: set = set()
+        self._lock = threading.Lock()
+
+    def push(self, deadline: datetime, key: Hashable):
+        with self._lock:
+            if key in self._scheduled:
+                return
+            self._scheduled.add(key)
+            heapq.heappush(self._heap, (deadline, key))
+
+    def pop_due(self, now: datetime, limit: int) -> List[Hashable]:
+        """Up to `limit` keys whose deadline has passed, earliest first"""
+        due = []
+        with self._lock:
+            while self._heap and len(due) < limit and self._heap[0][0] <= now:
+                _, key = heapq.heappop(self._heap)
+                self._scheduled.discard(key)
+                due.append(key)
+        return due
+
+    def next_deadline(self) -> Optional[datetime]:
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,39 @@
+"""
+User search helpers: accent folding, tokenization and the prefix terms stored in the search index
+"""
+import re
+import unicodedata
+from typing import List, Optional, Set
+
+MAX_TERM_LENGTH = 20  # Prefixos mais longos são truncados (o índice guarda até aqui)
+MAX_QUERY_TERMS = 4
+
+_TOKEN = re.compile(r"[0-9a-z]+")
+
+def fold(text: Optional[str]) -> str:
+    """Lowercase without accents: "João Conceição" -> "joao conceicao" """
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def tokenize(*texts: Optional[str]) -> List[str]:
+    """Distinct folded tokens, in order of appearance"""
+    tokens = []
+    for text in texts:
+        for token in _TOKEN.findall(fold(text)):
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
+def index_terms(*texts: Optional[str]) -> Set[str]:
+    """Every prefix of every token: an exact lookup on a prefix answers a typeahead query"""
+    terms = set()
+    for token in tokenize(*texts):
+        for length in range(1, min(len(token), MAX_TERM_LENGTH) + 1):
+            terms.add(token[:length])
+    return terms
+
+def query_terms(query: str) -> List[str]:
+    """Terms to look up for a search box input; each must prefix some token of the user"""
+    return [token[:MAX_TERM_LENGTH] for token in tokenize(query)][:MAX_QUERY_TERMS]
@@ -0,0 +1,50 @@
+"""
+Streaming upload storage: fixed-size chunks, size limit and SHA-256 while copying
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from fastapi import HTTPException
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+class StoredUpload(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+
+def stream_to_disk(source: BinaryIO, destination: Path, max_bytes: int, kind: str = "File",
+                   chunk_size: int = UPLOAD_CHUNK_SIZE) -> StoredUpload:
+    """Copy `source` to `destination` one chunk at a time (blocking: call from a worker thread)
+
+    The limit is checked against the bytes actually read, not the size the
+    client declared. The file is written under a .part name and renamed only
+    when complete, so an aborted or oversized upload never leaves a file behind.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    partial = destination.with_name(destination.name + ".part")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(partial, "wb") as out:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"{kind} too large (max {max_bytes // (1024 * 1024)}MB)"
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(partial, destination)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+
+    return StoredUpload(destination, size, digest.hexdigest())
@@ -0,0 +1,79 @@
+"""
+In-memory write-behind buffers drained in batches by a background flusher
+"""
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, List
+
+class CoalescingBuffer:
+    """Pending writes keyed by the row's unique key; repeats before a flush collapse into one
+
+    The first value for a key wins (e.g. the first time a story was seen).
+    `add` reports when the buffer reached `max_rows`, so the caller can flush
+    early instead of waiting for the next tick. Rows live only in this
+    process: anything not flushed before a crash is lost, which is acceptable
+    for best-effort data such as views.
+    """
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self._pending: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable, value: Any = None) -> bool:
+        with self._lock:
+            self._pending.setdefault(key, value)
+            return len(self._pending) >= self.max_rows
+
+    def drain(self) -> Dict[Hashable, Any]:
+        """Take everything pending; later adds go to a fresh batch"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending: Dict[Hashable, Any], keep: Callable[[Any, Any], Any] = min):
+        """Hand back a drained batch whose flush failed; `keep` picks between it and newer adds
+
+        The default keeps the earliest value, matching `add` (first value wins).
+        """
+        with self._lock:
+            for key, value in pending.items():
+                current = self._pending.get(key)
+                self._pending[key] = value if current is None else keep(current, value)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+class WriteBehindQueue:
+    """Bounded FIFO of pending writes; `put` refuses instead of growing past `max_items`
+
+    A refused item is the caller's cue to write it inline (backpressure), so
+    nothing is dropped when the flusher falls behind. Items taken by a flush
+    that failed can be handed back with `requeue`, ahead of newer ones.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: deque = deque()
+        self._lock = threading.Lock()
+
+    def put(self, item: Any) -> bool:
+        with self._lock:
+            if len(self._items) >= self.max_items:
+                return False
+            self._items.append(item)
+            return True
+
+    def take(self, limit: int) -> List[Any]:
+        with self._lock:
+            return [self._items.popleft() for _ in range(min(limit, len(self._items)))]
+
+    def requeue(self, items: List[Any]):
+        with self._lock:
+            self._items.extendleft(reversed(items))
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -69,7 +69,7 @@ export const Feed: React.FC<FeedProps> = ({ user }) => {
       if (response.ok) {
         const data = await response.json();
         setPosts(
-          data.map((post: any) => ({
+          data.items.map((post: any) => ({
             ...post,
             author: {
               ...post.author,
@@ -261,7 +261,7 @@ export function ChatPage({ user, onClose }: ChatPageProps) {
       if (response.ok) {
         const data = await response.json();
         setConversations(
-          data.map((conv: any) => ({
+          data.items.map((conv: any) => ({
             id: conv.user.id,
             first_name: conv.user.first_name,
             last_name: conv.user.last_name,
@@ -291,9 +291,9 @@ export function ChatPage({ user, onClose }: ChatPageProps) {
 
       if (response.ok) {
         const data = await response.json();
-        setMessages(data);
+        setMessages(data.items);
 
-        const unreadMessages = data.filter(
+        const unreadMessages = data.items.filter(
           (msg: Message) => !msg.is_read && !msg.is_own,
         );
         for (const msg of unreadMessages) {
@@ -385,7 +385,7 @@ export function ChatPage({ user, onClose }: ChatPageProps) {
       const formData = new FormData();
       formData.append("file", file);
 
-      const uploadResponse = await fetch("http://localhost:8000/upload/media", {
+      const uploadResponse = await fetch("http://localhost:8000/upload/media?context=chat_image", {
         method: "POST",
         headers: {
           Authorization: `Bearer ${user.token}`,
@@ -54,7 +54,7 @@ export const CommentSection: React.FC<CommentSectionProps> = ({
 
       if (response.ok) {
         const data = await response.json();
-        setComments(data);
+        setComments(data.items);
       }
     } catch (error) {
       console.error("Erro ao carregar comentários:", error);
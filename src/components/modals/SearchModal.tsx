@@ -78,7 +78,6 @@ export function SearchModal({ isOpen, onClose, userToken }: SearchModalProps) {
                   />
                   <div>
                     <p className="font-medium text-gray-900">{user.first_name} {user.last_name}</p>
-                    <p className="text-sm text-gray-500">{user.email}</p>
                   </div>
                 </div>
               ))}
@@ -156,9 +156,9 @@ export function EnhancedReactionDisplay({
                         ", "}
                     </span>
                   ))}
-                  {data.users.length > 5 && (
+                  {data.count > data.users.length && (
                     <span className="text-sm text-gray-500">
-                      e mais {data.users.length - 5} pessoas
+                      e mais {data.count - Math.min(data.users.length, 5)} pessoas
                     </span>
                   )}
                 </div>
@@ -26,12 +26,19 @@ interface PostCardProps {
     post_type: "post" | "testimonial";
     media_type?: string;
     media_url?: string;
+    media_preview_url?: string;
     created_at: string;
     reactions_count: number;
     comments_count: number;
     shares_count: number;
     is_profile_update?: boolean;
     is_cover_update?: boolean;
+    viewer?: {
+      user_reaction: string | null;
+      shared: boolean;
+      comments_count: number;
+      reactions: { [key: string]: number };
+    };
   };
   userToken: string;
   onPostDeleted: () => void;
@@ -60,7 +67,12 @@ export const PostCard: React.FC<PostCardProps> = ({
   const [isMobile, setIsMobile] = useState(false);
 
   useEffect(() => {
-    fetchReactions();
+    // O feed já traz o estado do leitor; só busca quando o post veio sem ele
+    if (post.viewer) {
+      applyReactionSummary(post.viewer.reactions, post.viewer.user_reaction);
+    } else {
+      fetchReactions();
+    }
     fetchComments();
 
     const checkIfMobile = () => {
@@ -85,24 +97,31 @@ export const PostCard: React.FC<PostCardProps> = ({
 
       if (response.ok) {
         const data = await response.json();
-        setReactionCounts(data.reactions || {});
-
-        // Separar like de amei
-        if (data.user_reaction === "like") {
-          setCurrentReaction("like");
-        } else if (data.user_reaction === "amei") {
-          setIsLoved(true);
-        } else {
-          setCurrentReaction(data.user_reaction);
-        }
-
-        setLoveCount(data.reactions?.amei || 0);
+        applyReactionSummary(data.reactions, data.user_reaction);
       }
     } catch (error) {
       console.error("Erro ao carregar reações:", error);
     }
   };
 
+  const applyReactionSummary = (
+    reactions: { [key: string]: number } | undefined,
+    userReaction: string | null,
+  ) => {
+    setReactionCounts(reactions || {});
+
+    // Separar like de amei
+    if (userReaction === "like") {
+      setCurrentReaction("like");
+    } else if (userReaction === "amei") {
+      setIsLoved(true);
+    } else {
+      setCurrentReaction(userReaction);
+    }
+
+    setLoveCount(reactions?.amei || 0);
+  };
+
   const fetchComments = async () => {
     try {
       const response = await fetch(
@@ -116,7 +135,7 @@ export const PostCard: React.FC<PostCardProps> = ({
 
       if (response.ok) {
         const data = await response.json();
-        setComments(data);
+        setComments(data.items);
       }
     } catch (error) {
       console.error("Erro ao carregar comentários:", error);
@@ -345,7 +364,7 @@ export const PostCard: React.FC<PostCardProps> = ({
                 className={`${post.is_profile_update || post.is_cover_update ? "border-2 border-blue-200 rounded-lg overflow-hidden" : ""}`}
               >
                 <img
-                  src={post.media_url}
+                  src={post.media_preview_url || post.media_url}
                   alt={
                     post.is_profile_update
                       ? "Nova foto do perfil"
@@ -110,7 +110,7 @@ export function Profile({
 
       if (response.ok) {
         const data = await response.json();
-        setPosts(data.filter((post: Post) => post.post_type === "post"));
+        setPosts(data.items.filter((post: Post) => post.post_type === "post"));
       }
     } catch (error) {
       console.error("Erro ao carregar posts:", error);
@@ -131,7 +131,7 @@ export function Profile({
       if (response.ok) {
         const data = await response.json();
         setTestimonials(
-          data.filter((post: Post) => post.post_type === "testimonial"),
+          data.items.filter((post: Post) => post.post_type === "testimonial"),
         );
       }
     } catch (error) {
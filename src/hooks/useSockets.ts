@@ -16,6 +16,8 @@ interface Notification {
   };
   data?: any;
   created_at: string;
+  actor_count?: number;
+  actor_ids?: number[];
 }
 
 export const useSocket = ({ userId, token }: UseSocketProps) => {
@@ -48,7 +50,8 @@ export const useSocket = ({ userId, token }: UseSocketProps) => {
 
     socket.on('notification', (notification: Notification) => {
       console.log('New notification received:', notification);
-      setNotifications(prev => [notification, ...prev]);
+      // Notificações agrupadas chegam de novo com o mesmo id: substitui e sobe para o topo
+      setNotifications(prev => [notification, ...prev.filter(n => n.id !== notification.id)]);
       
       // Show browser notification if permission granted
       if (Notification.permission === 'granted') {
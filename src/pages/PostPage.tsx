@@ -91,7 +91,7 @@ export function PostPage({ userToken, currentUserId }: PostPageProps) {
 
       if (response.ok) {
         const data = await response.json();
-        setComments(data);
+        setComments(data.items);
       }
     } catch (error) {
       console.error("Erro ao carregar comentários:", error);
@@ -161,7 +161,7 @@ export function PublicProfilePage({
 
       if (response.ok) {
         const userPosts = await response.json();
-        setPosts(userPosts);
+        setPosts(userPosts.items);
       }
     } catch (error) {
       console.error("Error fetching user posts:", error);